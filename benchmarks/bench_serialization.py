@@ -0,0 +1,84 @@
+"""
+Serialization throughput of the financial_data response, rows per second.
+
+before - ORM entities validated by FinancialDataResponse in orm_mode, jsonable_encoder and JSONResponse
+after  - plain row tuples rendered by FastJSONResponse
+
+    python benchmarks/bench_serialization.py --rows 1000 --repeat 20
+"""
+import argparse
+import datetime
+import decimal
+import random
+import time
+from typing import Any, Callable, List, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from financial.apps.financial.models import FinancialData
+from financial.apps.financial.schemas import FinancialDataResponse
+from financial.responses import FastJSONResponse
+
+
+PAGINATION = {"count": 1, "page": 1, "limit": 1, "pages": 1, "next_cursor": None}
+
+
+def make_rows(count: int) -> List[Tuple[Any, ...]]:
+    rnd = random.Random(42)
+    start = datetime.date(2000, 1, 1)
+    return [
+        (
+            "IBM",
+            start + datetime.timedelta(days=i),
+            decimal.Decimal(rnd.randint(1, 10**7)).scaleb(-4),
+            decimal.Decimal(rnd.randint(1, 10**7)).scaleb(-4),
+            rnd.randint(0, 10**9),
+        )
+        for i in range(count)
+    ]
+
+
+def render_before(rows: List[Tuple[Any, ...]]) -> bytes:
+    objects = [
+        FinancialData(symbol=symbol, date=date, open_price=open_price, close_price=close_price, volume=volume)
+        for symbol, date, open_price, close_price, volume in rows
+    ]
+    content = FinancialDataResponse.parse_obj({"data": objects, "pagination": PAGINATION, "info": {"error": ""}})
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def render_after(rows: List[Tuple[Any, ...]]) -> bytes:
+    columns = [column.name for column in FinancialData.__table__.columns]
+    data = [dict(zip(columns, row)) for row in rows]
+    return FastJSONResponse({"data": data, "pagination": PAGINATION, "info": {"error": ""}}).body
+
+
+def measure(render: Callable[[List[Tuple[Any, ...]]], bytes], rows: List[Tuple[Any, ...]], repeat: int) -> float:
+    """Returns rows per second of the best run"""
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        render(rows)
+        best = min(best, time.perf_counter() - started_at)
+    return len(rows) / best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    assert render_before(rows) == render_after(rows), "outputs differ"
+
+    before = measure(render_before, rows, args.repeat)
+    after = measure(render_after, rows, args.repeat)
+    print(f"before: {before:,.0f} rows/sec")
+    print(f"after:  {after:,.0f} rows/sec")
+    print(f"speedup: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
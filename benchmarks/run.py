@@ -0,0 +1,233 @@
+"""
+Benchmark suite. Fills the configured database (DB_* settings) with synthetic data, times scenarios
+and writes results as JSON, which can be compared between commits:
+
+    DB_DATABASE=financial_bench python -m benchmarks.run --symbols 20 --years 5 --output before.json
+    DB_DATABASE=financial_bench python -m benchmarks.run --symbols 20 --years 5 --baseline before.json
+
+Synthetic symbols (ZZ### for queries, ZY### for ingestion) are deleted at the end unless --keep is passed.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+import sqlalchemy as sa
+from benchmarks import generator
+from benchmarks.stub import make_stub_app, serve
+
+from financial.apps.financial.ingestion import fill_financial_data
+from financial.apps.financial.models import FinancialData, FinancialDataCumulative
+from financial.config import settings
+from financial.db import async_session, dispose_engines
+from financial.main import app
+
+
+# Data ends on a fixed date, so every run queries the same rows
+END_DATE = datetime.date(2022, 12, 30)
+PER_PAGE = 100
+
+
+class Scenario(NamedTuple):
+    name: str
+    run: Callable[[], Awaitable[Any]]
+    # Not timed, runs before every repetition
+    setup: Optional[Callable[[], Awaitable[Any]]] = None
+
+
+async def measure(scenario: Scenario, repeat: int, warmup: int) -> Dict[str, float]:
+    durations = []
+    for i in range(warmup + repeat):
+        if scenario.setup is not None:
+            await scenario.setup()
+        started_at = time.perf_counter()
+        await scenario.run()
+        if i >= warmup:
+            durations.append(time.perf_counter() - started_at)
+
+    durations.sort()
+    return {
+        "repeat": len(durations),
+        "min_ms": durations[0] * 1000,
+        "median_ms": statistics.median(durations) * 1000,
+        "mean_ms": statistics.mean(durations) * 1000,
+        "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+        "max_ms": durations[-1] * 1000,
+    }
+
+
+def query_scenarios(symbol: str, start: datetime.date, end: datetime.date, rows_per_symbol: int) -> List[Scenario]:
+    last_page = -(-rows_per_symbol // PER_PAGE)
+    month_ago = end - datetime.timedelta(days=30)
+
+    async def paginate(page: int) -> None:
+        async with async_session() as session:
+            await FinancialData.paginate(
+                session, {"symbol": symbol}, sorting={"date": "asc"}, page=page, per_page=PER_PAGE
+            )
+
+    async def count_stats(start_date: datetime.date) -> None:
+        async with async_session() as session:
+            await FinancialData.count_stats(session, {"symbol": symbol, "date__ge": start_date, "date__le": end})
+
+    async def range_stats(start_date: datetime.date) -> None:
+        async with async_session() as session:
+            await FinancialDataCumulative.range_stats(session, symbol, start_date, end)
+
+    return [
+        Scenario("paginate_shallow", lambda: paginate(1)),
+        Scenario("paginate_deep", lambda: paginate(last_page)),
+        Scenario("count_stats_short", lambda: count_stats(month_ago)),
+        Scenario("count_stats_long", lambda: count_stats(start)),
+        Scenario("range_stats_short", lambda: range_stats(month_ago)),
+        Scenario("range_stats_long", lambda: range_stats(start)),
+    ]
+
+
+def http_scenarios(client: httpx.AsyncClient, symbol: str, start: datetime.date, end: datetime.date) -> List[Scenario]:
+    async def get(path: str, params: Dict[str, Any]) -> None:
+        response = await client.get(path, params=params)
+        response.raise_for_status()
+
+    page = {"symbol": symbol, "limit": PER_PAGE}
+    stats = {"symbol": symbol, "start_date": start.isoformat(), "end_date": end.isoformat()}
+    return [
+        Scenario("http_financial_data", lambda: get("/api/financial_data", page)),
+        Scenario("http_financial_data_cursor", lambda: get("/api/financial_data", {**page, "mode": "cursor"})),
+        Scenario("http_statistics_cached", lambda: get("/api/statistics", stats)),
+        Scenario("http_export_csv", lambda: get("/api/financial_data/export", {"symbol": symbol, "format": "csv"})),
+    ]
+
+
+def ingestion_scenarios(symbols: List[str]) -> List[Scenario]:
+    async def clear() -> None:
+        async with async_session() as session:
+            await generator.delete_symbols(session, symbols)
+            await session.commit()
+
+    return [
+        # Full history of new symbols, then only the last saved day is collected again
+        Scenario("fill_financial_data_initial", fill_financial_data, setup=clear),
+        Scenario("fill_financial_data_incremental", fill_financial_data),
+    ]
+
+
+async def server_version() -> str:
+    async with async_session() as session:
+        return str(await session.scalar(sa.text("SHOW server_version")))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    start = END_DATE.replace(year=END_DATE.year - args.years) + datetime.timedelta(days=1)
+    symbols = generator.make_symbols("ZZ", args.symbols)
+    ingestion_symbols = generator.make_symbols("ZY", args.ingestion_symbols)
+
+    started_at = time.perf_counter()
+    async with async_session() as session:
+        rows = await generator.fill(session, symbols, start, END_DATE, args.seed)
+        await session.commit()
+    fill_seconds = time.perf_counter() - started_at
+    rows_per_symbol = rows // len(symbols)
+    postgres = await server_version()
+
+    # Ingestion collects history up to today from the stub
+    today = datetime.date.today()
+    settings.ALPHAVANTAGE_SYMBOLS = tuple(ingestion_symbols)
+    settings.ALPHAVANTAGE_LAST_DAYS = (today - start).days
+    settings.ALPHAVANTAGE_REQUESTS_PER_MINUTE = 10**6
+    settings.ALPHAVANTAGE_REQUESTS_PER_DAY = 10**9
+
+    results = {}
+    try:
+        async with serve(make_stub_app(start, today, args.seed)) as stub_url, serve(app) as app_url:
+            settings.ALPHAVANTAGE_URL = f"{stub_url}/query"
+            async with httpx.AsyncClient(base_url=app_url) as client:
+                scenarios = [
+                    *query_scenarios(symbols[0], start, END_DATE, rows_per_symbol),
+                    *http_scenarios(client, symbols[0], start, END_DATE),
+                    *ingestion_scenarios(ingestion_symbols),
+                ]
+                for scenario in scenarios:
+                    if args.only and scenario.name not in args.only:
+                        continue
+                    results[scenario.name] = await measure(scenario, args.repeat, args.warmup)
+                    print(f"{scenario.name}: {results[scenario.name]['median_ms']:.2f} ms", file=sys.stderr)
+    finally:
+        if not args.keep:
+            async with async_session() as session:
+                await generator.delete_symbols(session, symbols + ingestion_symbols)
+                await session.commit()
+        await dispose_engines()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "postgres": postgres,
+            "symbols": args.symbols,
+            "years": args.years,
+            "seed": args.seed,
+            "rows": rows,
+            "fill_seconds": fill_seconds,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> str:
+    """Table of median durations, the ratio above 1 means the current run is slower"""
+    lines = [f"{'scenario':<36}{'baseline ms':>14}{'current ms':>14}{'ratio':>8}"]
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            lines.append(f"{name:<36}{'-':>14}{result['median_ms']:>14.2f}{'-':>8}")
+            continue
+        ratio = result["median_ms"] / before["median_ms"] if before["median_ms"] else float("inf")
+        lines.append(f"{name:<36}{before['median_ms']:>14.2f}{result['median_ms']:>14.2f}{ratio:>8.2f}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--symbols", type=int, default=20, help="synthetic symbols to query")
+    parser.add_argument("--years", type=int, default=5, help="years of daily bars per symbol")
+    parser.add_argument("--ingestion-symbols", type=int, default=5, help="symbols collected from the stub")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--only", nargs="*", help="run only these scenarios")
+    parser.add_argument("--output", help="write results to the file instead of stdout")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--keep", action="store_true", help="don't delete synthetic data")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            print(compare(json.load(file), report), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Local alphavantage server answering TIME_SERIES_DAILY_ADJUSTED requests with generated csv history"""
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import uvicorn
+from benchmarks.generator import generate_bars, trading_days
+from fastapi import FastAPI, Response
+
+
+CSV_HEADER = "timestamp,open,high,low,close,adjusted_close,volume,dividend_amount,split_coefficient"
+COMPACT_SIZE = 100
+
+
+def make_stub_app(start: datetime.date, end: datetime.date, seed: int = 0) -> FastAPI:
+    """History of every symbol is generated from start to end, compact output has the latest 100 days"""
+    app = FastAPI()
+    days = list(trading_days(start, end))
+
+    @app.get("/query")
+    async def query(symbol: str, outputsize: str = "compact") -> Response:
+        bars = list(generate_bars(symbol, days, seed))[::-1]
+        if outputsize == "compact":
+            bars = bars[:COMPACT_SIZE]
+
+        lines = [CSV_HEADER]
+        for _, day, open_price, close_price, volume in bars:
+            high, low = max(open_price, close_price), min(open_price, close_price)
+            lines.append(f"{day},{open_price},{high},{low},{close_price},{close_price},{volume},0.0000,1.0")
+        return Response("\r\n".join(lines) + "\r\n", media_type="application/x-download")
+
+    return app
+
+
+@asynccontextmanager
+async def serve(app: FastAPI) -> AsyncIterator[str]:
+    """Runs the app on a free local port, yields its base url"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
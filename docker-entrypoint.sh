@@ -19,6 +19,10 @@ case "$1" in
         alembic upgrade head
         python get_raw_data.py
         ;;
+    import-csv)
+        alembic upgrade head
+        python import_csv.py "${@:2}"
+        ;;
     pytest)
         alembic downgrade base
         alembic upgrade head
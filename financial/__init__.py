@@ -0,0 +1,5 @@
+import time
+
+
+# Start of the package import, the app reports the import duration, see financial.main
+IMPORT_STARTED_AT = time.perf_counter()
@@ -1,10 +1,16 @@
 import logging
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from financial.apps.financial.models import count_stats_flight, range_stats_flight
+from financial.cache import stats_cache
+from financial.db import is_warming_up, paginate_flight
 from financial.deps import get_db
+from financial.profiling import profile_reports
+from financial.scheduler import ingestion_scheduler
 
 
 logger = logging.getLogger(__name__)
@@ -34,5 +40,38 @@ async def liveness_probe():
 
 @router.get("/healthz")
 async def readiness_probe(db: AsyncSession = Depends(get_db)) -> str:
+    if is_warming_up():
+        raise ProbeError("Database pools are warming up")
     await db_check(db)
     return "OK"
+
+
+@router.get("/cachez")
+async def cache_probe() -> dict:
+    return {
+        "statistics": stats_cache.info(),
+        "coalescing": {
+            flight.operation: flight.info() for flight in (paginate_flight, count_stats_flight, range_stats_flight)
+        },
+    }
+
+
+@router.get("/ingestionz")
+async def ingestion_probe() -> dict:
+    """State of scheduled ingestion in this process, runs are reported only by the leader, see INGESTION_ENABLED"""
+    return ingestion_scheduler.info()
+
+
+@router.get("/metrics", response_class=Response)
+async def metrics() -> Response:
+    """Metrics in Prometheus text exposition format"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@router.get("/profilez/{profile_id}")
+async def profile_report(profile_id: str) -> dict:
+    """Report of a profiled request by its X-Profile-Id response header, see PROFILING_ENABLED"""
+    report = profile_reports.get(profile_id)
+    if report is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Profile report not found")
+    return report
@@ -0,0 +1,201 @@
+import asyncio
+import itertools
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from types import TracebackType
+from typing import Any, AsyncIterator, Dict, Optional, Type
+
+import httpx
+from fastapi import status
+
+from financial.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_STATUSES = (
+    status.HTTP_429_TOO_MANY_REQUESTS,
+    status.HTTP_502_BAD_GATEWAY,
+    status.HTTP_503_SERVICE_UNAVAILABLE,
+    status.HTTP_504_GATEWAY_TIMEOUT,
+)
+# Alphavantage responds to throttled requests with HTTP 200 and a short JSON message in "Note" or "Information".
+# "Information" is also the answer to premium-only or invalid calls, only its rate limit messages are throttling.
+THROTTLING_KEY = "Note"
+INFORMATION_KEY = "Information"
+RATE_LIMIT_MESSAGE = re.compile(r"rate limit|call frequency", re.IGNORECASE)
+THROTTLING_MESSAGE_MAX_SIZE = 1024
+
+
+class AlphaVantageError(Exception):
+    """Alphavantage rejected the request with a message other than throttling, retries won't help"""
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Holds up to capacity tokens and adds rate tokens per second.
+    Every request takes one token and waits while the bucket is empty. Waiters are served in FIFO order.
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(float(self.capacity), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    Limits requests per minute and per day. Per minute requests are spread evenly (burst of one request
+    by default), so the limit holds for any sliding minute. Daily quota may be spent at the per minute pace.
+    """
+
+    def __init__(self, per_minute: int, per_day: int, burst: int = 1) -> None:
+        self.minute = TokenBucket(rate=per_minute / 60, capacity=burst)
+        self.day = TokenBucket(rate=per_day / 86400, capacity=per_day)
+
+    async def acquire(self) -> None:
+        await self.day.acquire()
+        await self.minute.acquire()
+
+
+class AlphaVantageClient:
+    """
+    Shared alphavantage HTTP client for many symbols. Must be used as an async context manager.
+
+    Keeps a pool of keep-alive connections, runs at most concurrency requests at once, spends requests
+    within the per minute and per day quota and retries throttled requests with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        apikey: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        requests_per_day: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff: Optional[float] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        limiter: Optional[RateLimiter] = None,
+    ) -> None:
+        self.url = url or settings.ALPHAVANTAGE_URL
+        self.apikey = apikey or settings.ALPHAVANTAGE_APIKEY
+        self.concurrency = concurrency or settings.ALPHAVANTAGE_CONCURRENCY
+        self.max_retries = settings.ALPHAVANTAGE_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.ALPHAVANTAGE_BACKOFF if backoff is None else backoff
+        # A limiter shared by clients keeps the quota across them, e.g. of scheduled ingestion runs
+        self.limiter = limiter or RateLimiter(
+            per_minute=requests_per_minute or settings.ALPHAVANTAGE_REQUESTS_PER_MINUTE,
+            per_day=requests_per_day or settings.ALPHAVANTAGE_REQUESTS_PER_DAY,
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=settings.ALPHAVANTAGE_TIMEOUT,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            transport=transport,
+        )
+
+    async def __aenter__(self) -> "AlphaVantageClient":
+        await self._client.__aenter__()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        await self._client.__aexit__(exc_type, exc_value, traceback)
+
+    @staticmethod
+    def is_json(response: httpx.Response) -> bool:
+        return "json" in response.headers.get("content-type", "")
+
+    @classmethod
+    def get_message(cls, response: httpx.Response) -> Dict[str, Any]:
+        """Returns the short JSON message of a successful response, e.g. throttling, or an empty dict"""
+        if response.status_code != status.HTTP_200_OK or not cls.is_json(response):
+            return {}
+
+        if len(response.content) > THROTTLING_MESSAGE_MAX_SIZE:
+            return {}
+
+        try:
+            data = response.json()
+        except ValueError:
+            return {}
+
+        return data if isinstance(data, dict) else {}
+
+    @classmethod
+    def is_throttled(cls, response: httpx.Response) -> bool:
+        if response.status_code in THROTTLING_STATUSES:
+            return True
+
+        message = cls.get_message(response)
+        return THROTTLING_KEY in message or bool(RATE_LIMIT_MESSAGE.search(str(message.get(INFORMATION_KEY, ""))))
+
+    def get_delay(self, response: httpx.Response, attempt: int) -> float:
+        """Returns seconds to wait before the next attempt. Retry-After header takes precedence."""
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * 2**attempt
+
+    async def get(self, params: Dict[str, Any]) -> httpx.Response:
+        """
+        Makes GET request with params and apikey. Returns the last response if all retries were throttled.
+        Raises httpx.RequestError on connection errors and AlphaVantageError if the request is rejected.
+        """
+        async with self.stream(params) as response:
+            await response.aread()
+        return response
+
+    @asynccontextmanager
+    async def stream(self, params: Dict[str, Any]) -> AsyncIterator[httpx.Response]:
+        """
+        Makes GET request with params and apikey and yields the response with unread body,
+        so it can be parsed incrementally (e.g. datatype=csv). JSON bodies are read beforehand:
+        in csv mode they are short error and throttling messages.
+        The request holds a concurrency slot until the body is consumed.
+        Raises AlphaVantageError if the request is rejected with an "Information" message other than throttling.
+        """
+        params = {**params, "apikey": self.apikey}
+
+        async with self._semaphore:
+            for attempt in itertools.count():
+                await self.limiter.acquire()
+                async with self._client.stream("GET", self.url, params=params) as response:
+                    if self.is_json(response):
+                        await response.aread()
+
+                    throttled = self.is_throttled(response)
+                    information = self.get_message(response).get(INFORMATION_KEY)
+                    if not throttled and information is not None:
+                        raise AlphaVantageError(information)
+
+                    if not throttled or attempt >= self.max_retries:
+                        yield response
+                        return
+
+                    delay = self.get_delay(response, attempt)
+
+                logger.warning("Alphavantage throttled request %s, retry in %.1f seconds", params.get("symbol"), delay)
+                await asyncio.sleep(delay)
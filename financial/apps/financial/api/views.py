@@ -1,45 +1,289 @@
+import csv
+import datetime
+import io
+import json
 import logging
-from typing import Any
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from financial.apps.financial import schemas
-from financial.apps.financial.models import FinancialData
-from financial.deps import get_db
+from financial.apps.financial.indicators import calculate_indicators
+from financial.apps.financial.models import FinancialData, FinancialDataCumulative, FinancialDataVersion
+from financial.cache import stats_cache
+from financial.config import settings
+from financial.deps import get_read_db
+from financial.profiling import ProfilingRoute
+from financial.responses import ColumnarResponse, FastJSONResponse, Validators
 
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(route_class=ProfilingRoute)
 
+EPOCH = datetime.date(1970, 1, 1)
+NO_DATA_ERROR = "No data for the symbol in the period"
 
-@router.get("/financial_data", response_model=schemas.FinancialDataResponse)
+
+@router.get(
+    "/financial_data",
+    response_model=schemas.FinancialDataResponse,
+    responses={status.HTTP_200_OK: {"content": {ColumnarResponse.media_type: {}}}},
+)
 async def get_financial_data(
-    db: AsyncSession = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
     filters: schemas.FinancialDataFilters = Depends(),
     pagination: schemas.PaginationFilters = Depends(),
+    data_format: schemas.DataFormatFilters = Depends(),
+    accept: str = Header(""),
 ) -> Any:
     """
     For the user specified period and symbol retrieves daily records
     with daily open price, daily closing price and daily volume.
+
+    Pages are selected by page number or, in the cursor mode (mode=cursor), by the next_cursor value of the
+    previous response. The cursor mode orders records by symbol and date and costs the same for any page depth.
+
+    With format=columnar or Accept: application/vnd.financial.columnar records are returned as
+    columns in the packed binary layout of ColumnarResponse: symbol (uint16 index into the header "symbols"),
+    date (int32 days since 1970-01-01), open_price and close_price (int64 units of 10^-price_scale, exact as
+    stored, price_scale is in the header), volume (int64). Pagination and info are in the header.
+
+    Responses have ETag and Last-Modified headers of the data version of the symbol (of all symbols without
+    a symbol filter). Requests with a matching If-None-Match or If-Modified-Since get 304 Not Modified
+    without running the query.
     """
-    data, count, pages = await FinancialData.paginate(
-        db, filters=filters.make_filters(), sorting={"date": "asc"}, page=pagination.page, per_page=pagination.limit
+    version, modified_at = await FinancialDataVersion.get(db, filters.symbol)
+    validators = Validators(version, modified_at, (request.url.query, accept))
+    if validators.is_not_modified(request):
+        return validators.not_modified()
+    headers = {**validators.headers(), "Vary": "Accept"}
+
+    if pagination.mode == schemas.PaginationMode.cursor:
+        try:
+            rows, next_cursor = await FinancialData.paginate_by_cursor(
+                db,
+                filters=filters.make_filters(),
+                cursor=pagination.cursor,
+                per_page=pagination.limit,  # type: ignore
+                as_rows=True,
+            )
+        except ValueError as e:
+            raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"cursor: {e}") from e
+
+        page_info = schemas.Pagination(limit=pagination.limit, next_cursor=next_cursor)  # type: ignore
+    else:
+        rows, count, pages = await FinancialData.paginate(
+            db,
+            filters=filters.make_filters(),
+            sorting={"date": "asc"},
+            page=pagination.page,
+            per_page=pagination.limit,
+            as_rows=True,
+            version=version,
+        )
+        page_info = schemas.Pagination(
+            count=count, page=pagination.page, limit=pagination.limit, pages=pages  # type: ignore
+        )
+
+    if data_format.format == schemas.DataFormat.columnar or (
+        data_format.format is None and ColumnarResponse.media_type in accept
+    ):
+        return ColumnarResponse(make_columnar_content(rows, page_info), headers=headers)
+
+    # Rows are plain tuples rendered with orjson, the output is the same as of the response_model
+    columns = [column.name for column in FinancialData.__table__.columns]
+    return FastJSONResponse(
+        {"data": [dict(zip(columns, row)) for row in rows], "pagination": page_info.dict(), "info": {"error": ""}},
+        headers=headers,
     )
+
+
+def make_columnar_content(rows: List[Any], page_info: schemas.Pagination) -> Dict[str, Any]:
+    symbols = list(dict.fromkeys(row.symbol for row in rows))
+    symbol_codes = {symbol: code for code, symbol in enumerate(symbols)}
+    scale = FinancialData.open_price.type.scale
     return {
-        "data": data,
-        "pagination": {"count": count, "page": pagination.page, "limit": pagination.limit, "pages": pages},
+        "columns": {
+            "symbol": ("uint16", [symbol_codes[row.symbol] for row in rows]),
+            "date": ("int32", [(row.date - EPOCH).days for row in rows]),
+            "open_price": ("int64", [int(row.open_price.scaleb(scale)) for row in rows]),
+            "close_price": ("int64", [int(row.close_price.scaleb(scale)) for row in rows]),
+            "volume": ("int64", [row.volume for row in rows]),
+        },
+        "symbols": symbols,
+        "price_scale": scale,
+        "pagination": page_info.dict(),
         "info": {"error": ""},
     }
 
 
+@router.get("/financial_data/export", response_class=StreamingResponse)
+async def export_financial_data(
+    db: AsyncSession = Depends(get_read_db),
+    filters: schemas.FinancialDataFilters = Depends(),
+    export: schemas.ExportFilters = Depends(),
+) -> StreamingResponse:
+    """
+    Streams all daily records for the user specified period and symbol as NDJSON or CSV ordered by symbol and date.
+    Records are read through a server-side cursor, so there is no limit on their number.
+    Prices are exported as strings in NDJSON to keep their precision.
+    """
+    if export.format == schemas.ExportFormat.csv:
+        media_type, rows = "text/csv", export_csv(db, filters.make_filters())
+    else:
+        media_type, rows = "application/x-ndjson", export_ndjson(db, filters.make_filters())
+
+    headers = {"Content-Disposition": f'attachment; filename="financial_data.{export.format}"'}
+    return StreamingResponse(rows, media_type=media_type, headers=headers)
+
+
+async def export_ndjson(db: AsyncSession, filters: Optional[Dict[str, Any]]) -> AsyncIterator[str]:
+    columns = [column.name for column in FinancialData.__table__.columns]
+    async for rows in FinancialData.stream_rows(db, filters, settings.EXPORT_CHUNK_SIZE):
+        yield "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
+
+
+async def export_csv(db: AsyncSession, filters: Optional[Dict[str, Any]]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow([column.name for column in FinancialData.__table__.columns])
+
+    async for rows in FinancialData.stream_rows(db, filters, settings.EXPORT_CHUNK_SIZE):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+
 @router.get("/statistics", response_model=schemas.StatsResponse)
-async def get_statistics(db: AsyncSession = Depends(get_db), filters: schemas.StatisticsFilters = Depends()) -> Any:
+async def get_statistics(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+    filters: schemas.StatisticsFilters = Depends(),
+) -> Any:
     """
     For the user specified period and symbol calculates the average daily open price,
     the average daily closing price and the average daily volume.
+    Averages are calculated from running totals, so the cost does not depend on the period length.
+    Results are cached until new data of the symbol is saved.
+    Conditional requests are answered the same way as by /financial_data.
     """
-    result = await FinancialData.count_stats(db, filters.make_filters())  # type: ignore
+    version, modified_at = await FinancialDataVersion.get(db, filters.symbol)
+    validators = Validators(version, modified_at, request.url.query)
+    if validators.is_not_modified(request):
+        return validators.not_modified()
+    response.headers.update(validators.headers())
+
+    results = await calculate_statistics(db, [(filters.symbol, filters.start_date, filters.end_date)], version)
     data = filters.dict()
-    data.update(result)
+    data.update(results[0])
+    return {"data": data, "info": {"error": ""}}
+
+
+@router.post("/statistics/batch", response_model=schemas.BatchStatsResponse)
+async def get_batch_statistics(filters: schemas.BatchStatisticsFilters, db: AsyncSession = Depends(get_read_db)) -> Any:
+    """
+    For every symbol and its own or the common period calculates the average daily open price,
+    the average daily closing price and the average daily volume with a single database query.
+    Errors of a symbol are reported in its error field and don't affect other symbols,
+    a symbol without days in its period has the error "No data for the symbol in the period".
+    """
+    windows = filters.make_windows()
+    valid = [window for window in windows if not window.validation_error()]
+    results = await calculate_statistics(db, [(w.symbol, w.start_date, w.end_date) for w in valid])  # type: ignore
+    results_map = {id(window): result for window, result in zip(valid, results)}
+
+    data = []
+    for window in windows:
+        item = window.dict()
+        result = results_map.get(id(window))
+        if result is None:
+            item["error"] = window.validation_error()
+        else:
+            item.update(result)
+            item["error"] = "" if result["average_daily_volume"] is not None else NO_DATA_ERROR
+        data.append(item)
+
     return {"data": data, "info": {"error": ""}}
+
+
+@router.get("/resample", response_model=schemas.ResampleResponse)
+async def get_resampled_data(
+    db: AsyncSession = Depends(get_read_db),
+    filters: schemas.ResampleFilters = Depends(),
+    pagination: schemas.OffsetPaginationFilters = Depends(),
+) -> Any:
+    """
+    For the user specified period and symbol aggregates daily records into weekly, monthly, quarterly or yearly
+    candles: open price of the first day, closing price of the last day and the total volume of the interval.
+    Weeks start on Monday, candles at the ends of the period include only days within it.
+    Candles are calculated by the database and paginated like /financial_data.
+    """
+    rows, count, pages = await FinancialData.resample(
+        db, filters.make_filters(), filters.interval, pagination.page, pagination.limit  # type: ignore
+    )
+    page_info = schemas.Pagination(
+        count=count, page=pagination.page, limit=pagination.limit, pages=pages  # type: ignore
+    )
+    return FastJSONResponse(
+        {"data": [dict(row._mapping) for row in rows], "pagination": page_info.dict(), "info": {"error": ""}}
+    )
+
+
+@router.get("/indicators", response_model=schemas.IndicatorsResponse)
+async def get_indicators(
+    db: AsyncSession = Depends(get_read_db),
+    filters: schemas.StatisticsFilters = Depends(),
+    indicators: List[str] = Query(..., description="Indicators as kind_period, e.g. sma_20, ema_50"),
+) -> Any:
+    """
+    For the user specified period and symbol returns daily close prices, volumes and technical indicators as columns:
+    - sma_N - simple moving average of close prices over N days
+    - ema_N - exponential moving average of close prices with the smoothing factor 2 / (N + 1)
+    - vwap_N - volume weighted average close price over N days
+    - volatility_N - standard deviation of daily log returns of close prices over N days
+
+    Indicators are calculated from history before start_date too, so they have values from the first day of the
+    period if there is enough history. Otherwise values of the first days are null.
+    """
+    requested = schemas.IndicatorsFilters.parse_obj({"indicators": indicators})
+    data = filters.dict()
+    data.update(
+        await calculate_indicators(db, filters.symbol, filters.start_date, filters.end_date, requested.indicators)
+    )
+    return FastJSONResponse({"data": data, "info": {"error": ""}})
+
+
+async def calculate_statistics(
+    db: AsyncSession, windows: List[Tuple[str, datetime.date, datetime.date]], data_version: Optional[int] = None
+) -> List[dict]:
+    """
+    Returns statistics for every (symbol, start_date, end_date) window. Cached results are taken from the cache,
+    the rest are calculated with a single query and cached. Concurrent calculations are shared only between calls
+    with the same data version (if it was read) and cache versions, so a result read before a change
+    is neither returned to a call that has seen the change nor cached as current.
+    """
+    results: Dict[Tuple[str, datetime.date, datetime.date], dict] = {}
+    versions: Dict[Tuple[str, datetime.date, datetime.date], Tuple[int, int]] = {}
+
+    for window in windows:
+        symbol, *key = window
+        cached = stats_cache.get(symbol, tuple(key))
+        if cached is not None:
+            results[window] = cached
+        else:
+            versions.setdefault(window, stats_cache.version(symbol))
+
+    missing = list(versions)
+    version = (data_version, tuple(versions[window] for window in missing))
+    for window, result in zip(missing, await FinancialDataCumulative.range_stats_batch(db, missing, version)):
+        stats_cache.set(window[0], window[1:], result, versions[window])
+        results[window] = result
+
+    return [results[window] for window in windows]
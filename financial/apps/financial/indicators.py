@@ -0,0 +1,118 @@
+import datetime
+import itertools
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from financial.apps.financial import schemas
+from financial.apps.financial.models import FinancialData
+
+
+# EMA depends on the whole history, after this many periods of warm-up the weight of earlier days is below 0.1%
+EMA_WARMUP_PERIODS = 4
+
+
+def rolling_sums(values: Sequence[float], period: int) -> List[Optional[float]]:
+    """
+    Sums of every period consecutive values ending at every position, None while there are fewer values.
+    Calculated as differences of prefix sums, so the cost doesn't depend on the period.
+    """
+    sums = list(itertools.accumulate(values, initial=0.0))
+    return [None] * min(period - 1, len(values)) + [sums[i] - sums[i - period] for i in range(period, len(sums))]
+
+
+def sma(closes: Sequence[float], volumes: Sequence[int], period: int) -> List[Optional[float]]:
+    """Simple moving average of close prices"""
+    return [None if total is None else total / period for total in rolling_sums(closes, period)]
+
+
+def ema(closes: Sequence[float], volumes: Sequence[int], period: int) -> List[Optional[float]]:
+    """
+    Exponential moving average of close prices with the smoothing factor 2 / (period + 1).
+    It starts from the simple average of the first period days.
+    """
+    if len(closes) < period:
+        return [None] * len(closes)
+
+    alpha = 2 / (period + 1)
+    average = sum(closes[:period]) / period
+    result: List[Optional[float]] = [None] * (period - 1)
+    result.append(average)
+    for close in closes[period:]:
+        average += alpha * (close - average)
+        result.append(average)
+    return result
+
+
+def vwap(closes: Sequence[float], volumes: Sequence[int], period: int) -> List[Optional[float]]:
+    """Volume weighted average close price"""
+    amounts = rolling_sums([close * volume for close, volume in zip(closes, volumes)], period)
+    total_volumes = rolling_sums(volumes, period)
+    return [
+        None if amount is None or not total_volume else amount / total_volume
+        for amount, total_volume in zip(amounts, total_volumes)
+    ]
+
+
+def volatility(closes: Sequence[float], volumes: Sequence[int], period: int) -> List[Optional[float]]:
+    """Sample standard deviation of daily log returns of close prices, the first day has no return"""
+    # A day with a zero price has no return
+    returns = [
+        math.log(close / previous) if close > 0 and previous > 0 else 0.0 for previous, close in zip(closes, closes[1:])
+    ]
+    sums = rolling_sums(returns, period)
+    squares = rolling_sums([value * value for value in returns], period)
+    result: List[Optional[float]] = [None] if closes else []
+    for total, square in zip(sums, squares):
+        if total is None or square is None:
+            result.append(None)
+        else:
+            result.append(math.sqrt(max(0.0, (square - total * total / period) / (period - 1))))
+    return result
+
+
+CALCULATORS: Dict[str, Callable[[Sequence[float], Sequence[int], int], List[Optional[float]]]] = {
+    schemas.IndicatorKind.sma: sma,
+    schemas.IndicatorKind.ema: ema,
+    schemas.IndicatorKind.vwap: vwap,
+    schemas.IndicatorKind.volatility: volatility,
+}
+
+
+def warmup_days(indicator: schemas.Indicator) -> int:
+    """Days of history before the start date the indicator needs to have a value on the start date"""
+    if indicator.kind == schemas.IndicatorKind.ema:
+        return EMA_WARMUP_PERIODS * indicator.period
+    if indicator.kind == schemas.IndicatorKind.volatility:
+        return indicator.period
+    return indicator.period - 1
+
+
+async def calculate_indicators(
+    session: AsyncSession,
+    symbol: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    indicators: Sequence[schemas.Indicator],
+) -> Dict[str, Any]:
+    """
+    Returns close prices, volumes and indicators of the symbol as columns for every day from start_date to end_date.
+    History is loaded with a single query including warm-up days before start_date, so indicators have values
+    from start_date if there is enough history. Every indicator takes a single pass over the history.
+    """
+    rows = await FinancialData.close_series(
+        session, symbol, start_date, end_date, max(warmup_days(indicator) for indicator in indicators)
+    )
+    dates, closes, volumes = (list(column) for column in zip(*rows)) if rows else ([], [], [])
+    first = next((i for i, date in enumerate(dates) if date >= start_date), len(dates))
+
+    return {
+        "date": dates[first:],
+        "close_price": closes[first:],
+        "volume": volumes[first:],
+        "indicators": {
+            indicator.name: CALCULATORS[indicator.kind](closes, volumes, indicator.period)[first:]
+            for indicator in indicators
+        },
+    }
@@ -0,0 +1,268 @@
+"""Collects daily history of ALPHAVANTAGE_SYMBOLS from alphavantage into financial_data"""
+import asyncio
+import logging
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+from json import JSONDecodeError
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from fastapi import status
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+
+from financial.apps.financial import models, schemas
+from financial.apps.financial.alphavantage import AlphaVantageClient, AlphaVantageError, RateLimiter
+from financial.config import settings
+from financial.db import async_session
+from financial.metrics import INGESTION_ERRORS, INGESTION_ROWS, INGESTION_RUNS
+from financial.utils import chunked, utcnow
+
+
+PARAMS = {
+    "function": "TIME_SERIES_DAILY_ADJUSTED",
+}
+
+# Columns of datatype=csv output
+CSV_DATE = "timestamp"
+CSV_OPEN = "open"
+CSV_CLOSE = "close"
+CSV_VOLUME = "volume"
+
+logger = logging.getLogger(__name__)
+
+
+async def get_symbol_history(client: AlphaVantageClient, symbol: str, outputsize: str = "compact") -> dict:
+    """
+    Returns alphavantage raw (as-traded) daily open/high/low/close/volume values,
+    daily adjusted close values, and historical split/dividend events of the
+    specified symbol.
+
+    Compact output contains only latest 100 data points, full output contains 20+ years of history.
+
+    https://www.alphavantage.co/documentation/#dailyadj
+    """
+    params = {"symbol": symbol, "outputsize": outputsize}
+    params.update(PARAMS)
+
+    try:
+        response = await client.get(params)
+    except (httpx.RequestError, AlphaVantageError):
+        logger.exception("Exception while getting symbol history")
+        INGESTION_ERRORS.labels("fetch").inc()
+        return {}
+
+    if response.status_code != status.HTTP_200_OK:
+        logger.error("Error: alphavantage respond with status %s: %s", response.status_code, response.text)
+        INGESTION_ERRORS.labels("fetch").inc()
+        return {}
+
+    try:
+        data = response.json()
+    except (TypeError, ValueError, JSONDecodeError):
+        logger.error("Error: alphavantage respond with wrong data: %s", response.text)
+        INGESTION_ERRORS.labels("fetch").inc()
+        return {}
+
+    if "Time Series (Daily)" not in data:
+        logger.error("Error: alphavantage respond with wrong data: %s", response.text)
+        INGESTION_ERRORS.labels("fetch").inc()
+        return {}
+
+    return data["Time Series (Daily)"]
+
+
+async def iter_symbol_history_csv(
+    client: AlphaVantageClient, symbol: str, start_date: date, outputsize: str = "compact"
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Streams alphavantage history of the specified symbol in datatype=csv format and yields
+    rows since start_date in batches of DB_UPSERT_BATCH_SIZE rows.
+
+    The body is parsed line by line and rows come from the latest day, so reading stops at the first
+    day before start_date. Memory usage does not depend on the history length.
+    """
+    params = {"symbol": symbol, "outputsize": outputsize, "datatype": "csv"}
+    params.update(PARAMS)
+    start_day = start_date.isoformat()
+
+    try:
+        async with client.stream(params) as response:
+            if response.status_code != status.HTTP_200_OK or client.is_json(response):
+                await response.aread()
+                logger.error("Error: alphavantage respond with status %s: %s", response.status_code, response.text)
+                INGESTION_ERRORS.labels("fetch").inc()
+                return
+
+            lines = response.aiter_lines()
+            header = (await lines.__anext__()).strip().split(",")
+            try:
+                columns = [header.index(name) for name in (CSV_DATE, CSV_OPEN, CSV_CLOSE, CSV_VOLUME)]
+            except ValueError:
+                logger.error("Error: alphavantage respond with wrong csv header: %s", header)
+                INGESTION_ERRORS.labels("fetch").inc()
+                return
+
+            batch: List[Dict[str, Any]] = []
+            async for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    day, open_price, close_price, volume = (line.split(",")[i] for i in columns)
+                    # Days in isoformat are compared as strings
+                    if day < start_day:
+                        break
+                    row = {
+                        "symbol": symbol,
+                        "date": date.fromisoformat(day),
+                        "open_price": Decimal(open_price),
+                        "close_price": Decimal(close_price),
+                        "volume": int(volume),
+                    }
+                except (IndexError, ValueError, InvalidOperation):
+                    logger.error("Error while parsing alphavantage csv line: %s", line)
+                    INGESTION_ERRORS.labels("parse").inc()
+                    continue
+
+                batch.append(row)
+                if len(batch) >= settings.DB_UPSERT_BATCH_SIZE:
+                    yield batch
+                    batch = []
+
+            if batch:
+                yield batch
+    except (httpx.RequestError, AlphaVantageError, StopAsyncIteration):
+        logger.exception("Exception while getting symbol history")
+        INGESTION_ERRORS.labels("fetch").inc()
+
+
+async def iter_symbol_history_json(
+    client: AlphaVantageClient, symbol: str, start_date: date, outputsize: str = "compact"
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Collects alphavantage history of the specified symbol in JSON format and yields
+    rows since start_date in batches of DB_UPSERT_BATCH_SIZE rows.
+    """
+    history = await get_symbol_history(client, symbol, outputsize)
+    start_day = start_date.isoformat()
+    rows = []
+
+    for day, raw_obj in history.items():
+        # Days in isoformat are compared as strings
+        if day < start_day:
+            continue
+
+        raw_obj["symbol"] = symbol
+        raw_obj["date"] = day
+
+        try:
+            obj = schemas.FinancialDataCreate.parse_obj(raw_obj)
+        except ValidationError:
+            logger.exception("Error while parsing alphavantage object data.")
+            INGESTION_ERRORS.labels("parse").inc()
+            continue
+
+        rows.append(obj.dict())
+
+    for batch in chunked(rows, settings.DB_UPSERT_BATCH_SIZE):
+        yield batch
+
+
+def get_start_date(last_date: Optional[date], today: date) -> date:
+    """
+    Returns the first day to collect: the last saved day or ALPHAVANTAGE_LAST_DAYS back in history
+    for a new symbol. The last saved day is collected again because it could be saved before the market close.
+    """
+    if last_date is None:
+        return today - timedelta(days=settings.ALPHAVANTAGE_LAST_DAYS - 1)
+    return last_date
+
+
+def get_output_size(start_date: date, today: date) -> str:
+    """Returns compact if all days from start_date fit into compact output, otherwise full."""
+    return "compact" if (today - start_date).days < settings.ALPHAVANTAGE_COMPACT_DAYS else "full"
+
+
+async def fill_financial_data(limiter: Optional[RateLimiter] = None) -> None:
+    """
+    Populates financial_data table with new data collected from alphavantage.
+
+    Makes request to alphavantage API to collect stock data for ALPHAVANTAGE_SYMBOLS.
+    Every symbol is collected from its last saved day, so gaps of any length are backfilled,
+    and only new or changed days are written to database.
+    Requests are counted by the given rate limiter, or by a new one with the full quota.
+    """
+    INGESTION_RUNS.inc()
+    today = utcnow().date()
+    await ensure_partitions(today)
+    async with async_session() as session:
+        last_dates = await models.FinancialData.last_dates(session, settings.ALPHAVANTAGE_SYMBOLS)
+
+    # All symbols are scheduled at once, the client keeps requests within the API quota and concurrency limit
+    # and every symbol is saved as soon as its history is received.
+    async with AlphaVantageClient(limiter=limiter) as client:
+        await asyncio.gather(
+            *[
+                fill_symbol_data(client, symbol, get_start_date(last_dates.get(symbol), today), today)
+                for symbol in settings.ALPHAVANTAGE_SYMBOLS
+            ]
+        )
+
+
+async def ensure_partitions(today: date) -> None:
+    """
+    Creates financial_data partitions for every year ingestion may write to, including
+    DB_PARTITIONS_AHEAD_YEARS years ahead, so the partition of a new year exists before its first day.
+    """
+    async with async_session() as session:
+        created = await models.FinancialData.ensure_partitions(
+            session, settings.DB_PARTITIONS_FIRST_YEAR, today.year + settings.DB_PARTITIONS_AHEAD_YEARS
+        )
+        await session.commit()
+
+    if created:
+        logger.info("Created financial data partitions: %s", ", ".join(created))
+
+
+async def fill_symbol_data(client: AlphaVantageClient, symbol: str, start_date: date, today: date) -> None:
+    """Collects history of the symbol from alphavantage and upserts days since start_date to database."""
+    if settings.ALPHAVANTAGE_DATATYPE == "csv":
+        batches = iter_symbol_history_csv(client, symbol, start_date, get_output_size(start_date, today))
+    else:
+        batches = iter_symbol_history_json(client, symbol, start_date, get_output_size(start_date, today))
+
+    # Every batch is saved with its running totals in its own transaction. History comes from the latest day,
+    # so batches are saved from the oldest one and saving stops at the first failed batch: the last saved day
+    # is never ahead of a missing one and the next run, which starts from the last saved day, collects the rest.
+    history = sorted([batch async for batch in batches], key=lambda batch: min(row["date"] for row in batch))
+    collected = sum(len(batch) for batch in history)
+    saved = 0
+    for batch in history:
+        try:
+            saved += await save_batch(symbol, batch)
+        except SQLAlchemyError:
+            logger.exception("Exception occurred while saving financial data to database.")
+            INGESTION_ERRORS.labels("save").inc()
+            break
+
+    INGESTION_ROWS.labels("collected").inc(collected)
+    INGESTION_ROWS.labels("written").inc(saved)
+    logger.info("Symbol %s: %s days collected, %s days written", symbol, collected, saved)
+
+
+async def save_batch(symbol: str, rows: List[Dict[str, Any]]) -> int:
+    """
+    Upserts rows of the symbol, recalculates its running totals from the first day of the rows and
+    notifies listeners about changed data in one transaction, so saved prices always come with their totals
+    and a new data version. Returns the number of written rows.
+    """
+    async with async_session() as session:
+        written = await models.FinancialData.bulk_insert_or_update(session, rows)
+        if written:
+            await models.FinancialDataCumulative.refresh(session, symbol, min(row["date"] for row in rows))
+            await models.FinancialData.notify_changed(session, [symbol])
+        await session.commit()
+
+    return written
@@ -1,10 +1,17 @@
-from typing import Any, Dict
+import datetime
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
 
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from financial.cache import SingleFlight
 from financial.config import settings
-from financial.db import EmptyBaseModel
+from financial.db import EmptyBaseModel, ScaledDecimal
+
+
+count_stats_flight = SingleFlight("count_stats")
+range_stats_flight = SingleFlight("range_stats")
 
 
 class FinancialData(EmptyBaseModel):
@@ -13,26 +20,358 @@ class FinancialData(EmptyBaseModel):
     symbol = sa.Column(sa.String(settings.MAX_SYMBOL_LENGTH), nullable=False)
     date = sa.Column(sa.Date, nullable=False)
     # Use decimal because floats and doubles don't have an accurate enough representation
-    # to prevent rounding errors from accumulating when doing arithmetic with monetary values
-    open_price = sa.Column(sa.DECIMAL, nullable=False)
-    close_price = sa.Column(sa.DECIMAL, nullable=False)
+    # to prevent rounding errors from accumulating when doing arithmetic with monetary values.
+    # Prices are fixed-point decimals with 4 fractional digits (as alphavantage reports them) stored as BIGINT.
+    open_price = sa.Column(ScaledDecimal(4), nullable=False)
+    close_price = sa.Column(ScaledDecimal(4), nullable=False)
     volume = sa.Column(sa.BigInteger, nullable=False)
 
     # This pair must be unique through the DB. Also it helps to use Postgres ON CONFLICT statement.
-    __table_args__ = (sa.PrimaryKeyConstraint("symbol", "date"),)
+    # The table is partitioned by date into yearly partitions, see ensure_partitions(). Date is a part
+    # of the primary key, so it stays unique through all partitions and ON CONFLICT works.
+    # Days are appended in date order, so a BRIN index of a few pages serves date range scans of all symbols.
+    __table_args__ = (
+        sa.PrimaryKeyConstraint("symbol", "date"),
+        sa.Index("ix_financial_data_date_brin", "date", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
+    # symbol leads the primary key, date conditions prune partitions and use the BRIN index.
+    # Prefix LIKE is not here, the primary key serves it only with the C collation.
+    indexed_filters = {
+        "symbol": ("exact", "in", "between"),
+        "date": ("exact", "in", "between", "gt", "ge", "lt", "le"),
+    }
 
     @classmethod
-    async def count_stats(cls, session: AsyncSession, filters: Dict[str, Any]) -> dict:
+    async def count_stats(cls, session: AsyncSession, filters: Dict[str, Any], version: Hashable = None) -> dict:
         """
         Returns average for open_price, close_price and volume with conditions from filters.
+        Concurrent calls with the same filters and data version share a single execution, see paginate().
         """
+        return await count_stats_flight.do(
+            (version, tuple(sorted(filters.items()))), lambda: cls._count_stats(session, filters)
+        )
+
+    @classmethod
+    async def _count_stats(cls, session: AsyncSession, filters: Dict[str, Any]) -> dict:
+        # Prices are summed as integers, the division is the same as of numeric avg()
+        count = sa.func.nullif(sa.func.count(), 0)
         query = sa.select(
             [
-                sa.func.avg(cls.open_price).label("average_daily_open_price"),
-                sa.func.avg(cls.close_price).label("average_daily_close_price"),
+                (cls.open_price.type.to_numeric(sa.func.sum(cls.open_price)) / count).label("average_daily_open_price"),
+                (cls.close_price.type.to_numeric(sa.func.sum(cls.close_price)) / count).label(
+                    "average_daily_close_price"
+                ),
                 sa.func.avg(cls.volume).label("average_daily_volume"),
             ]
         ).where(sa.and_(True, *cls.build_filters(filters)))
-        db_execute = await session.execute(query)
+        db_execute = await session.execute(query.execution_options(statement_kind="count_stats"))
         result = db_execute.mappings().fetchone()
         return result
+
+    @classmethod
+    async def last_dates(cls, session: AsyncSession, symbols: Iterable[str]) -> Dict[str, Optional[datetime.date]]:
+        """
+        Returns the last saved date for every symbol or None if the symbol has no data.
+        Every max(date) is a single backward scan of the (symbol, date) primary key index.
+        """
+        symbols_table = sa.func.unnest(sa.cast(list(symbols), ARRAY(sa.String))).table_valued("symbol").render_derived()
+        last_date = sa.select(sa.func.max(cls.date)).where(cls.symbol == symbols_table.c.symbol).scalar_subquery()
+        query = sa.select(symbols_table.c.symbol, last_date).execution_options(statement_kind="last_dates")
+        db_execute = await session.execute(query)
+        return dict(db_execute.all())
+
+    @classmethod
+    async def resample(
+        cls, session: AsyncSession, filters: Dict[str, Any], interval: str, page: int, per_page: int
+    ) -> Tuple[List[Any], int, int]:
+        """
+        Aggregates daily rows into candles of the interval (week, month, quarter or year) ordered by symbol
+        and period: open_price of the first day, close_price of the last day, sum of volume, first and last dates
+        and the number of days. Candles are paginated the same way as paginate().
+        Returns rows of the page, the number of candles and pages.
+        """
+        period = sa.cast(sa.func.date_trunc(interval, sa.cast(cls.date, sa.DateTime)), sa.Date).label("period")
+        window = {"partition_by": [cls.symbol, period], "order_by": cls.date, "rows": (None, None)}
+        days = (
+            sa.select(
+                cls.symbol,
+                period,
+                cls.date,
+                sa.func.first_value(cls.open_price, type_=cls.open_price.type).over(**window).label("open_price"),
+                sa.func.last_value(cls.close_price, type_=cls.close_price.type).over(**window).label("close_price"),
+                cls.volume,
+            )
+            .where(sa.and_(True, *cls.build_filters(filters)))
+            .subquery()
+        )
+        query = (
+            sa.select(
+                days.c.symbol,
+                days.c.period,
+                sa.func.min(days.c.date).label("start_date"),
+                sa.func.max(days.c.date).label("end_date"),
+                # Values of the first and the last day are the same in all rows of the period
+                sa.func.min(days.c.open_price).label("open_price"),
+                sa.func.min(days.c.close_price).label("close_price"),
+                sa.cast(sa.func.sum(days.c.volume), sa.BigInteger).label("volume"),
+                sa.func.count().label("days"),
+            )
+            .group_by(days.c.symbol, days.c.period)
+            .order_by(days.c.symbol, days.c.period)
+        )
+        db_execute, total, pages = await cls.paginate_query(session, query, page, per_page)
+        return db_execute.all(), total, pages
+
+    @classmethod
+    async def close_series(
+        cls, session: AsyncSession, symbol: str, start_date: datetime.date, end_date: datetime.date, warmup: int
+    ) -> List[Any]:
+        """
+        Returns date, close_price (as float) and volume of the symbol ordered by date from start_date to end_date
+        and up to warmup days before start_date, in a single index range scan.
+        """
+        warmup_dates = (
+            sa.select(cls.date)
+            .where(cls.symbol == symbol, cls.date < start_date)
+            .order_by(cls.date.desc())
+            .limit(warmup)
+            .subquery()
+        )
+        first_date = sa.func.coalesce(sa.select(sa.func.min(warmup_dates.c.date)).scalar_subquery(), start_date)
+        query = (
+            sa.select(
+                cls.date,
+                (sa.cast(cls.close_price, sa.Float) / 10**cls.close_price.type.scale).label("close_price"),
+                cls.volume,
+            )
+            .where(cls.symbol == symbol, cls.date >= first_date, cls.date <= end_date)
+            .order_by(cls.date)
+            .execution_options(statement_kind="close_series")
+        )
+        db_execute = await session.execute(query)
+        return db_execute.all()
+
+    @classmethod
+    def partition_name(cls, year: int) -> str:
+        return f"{cls.__tablename__}_y{year}"
+
+    @classmethod
+    async def ensure_partitions(cls, session: AsyncSession, first_year: int, last_year: int) -> List[str]:
+        """
+        Creates missing yearly partitions for all years from first_year to last_year inclusive.
+        Returns names of the created partitions. Rows of a year without partition can't be inserted.
+        """
+        query = sa.text(
+            "SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = CAST(:table AS regclass)"
+        )
+        db_execute = await session.execute(query, {"table": cls.__tablename__})
+        existing = set(db_execute.scalars().all())
+
+        created = []
+        for year in range(first_year, last_year + 1):
+            name = cls.partition_name(year)
+            if name in existing:
+                continue
+
+            await session.execute(
+                sa.text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {cls.__tablename__} "
+                    f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+                )
+            )
+            created.append(name)
+
+        return created
+
+    @classmethod
+    async def notify_changed(cls, session: AsyncSession, symbols: Iterable[str]) -> None:
+        """
+        Bumps data versions of the symbols and notifies listeners (e.g. statistics cache) that their data changed.
+        Notifications are delivered when the transaction commits.
+        """
+        symbols = sorted(set(symbols))
+        await FinancialDataVersion.bump(session, symbols)
+        for symbol in symbols:
+            await session.execute(sa.select(sa.func.pg_notify(settings.DB_NOTIFY_CHANNEL, symbol)))
+
+
+class FinancialDataCumulative(EmptyBaseModel):
+    """
+    Running totals of financial_data: sums of prices and volume and the number of days of the symbol
+    from its first day up to every date. Maintained by ingestion, see refresh().
+    """
+
+    __tablename__ = "financial_data_cumulative"
+
+    symbol = sa.Column(sa.String(settings.MAX_SYMBOL_LENGTH), nullable=False)
+    date = sa.Column(sa.Date, nullable=False)
+    open_price_sum = sa.Column(sa.DECIMAL, nullable=False)
+    close_price_sum = sa.Column(sa.DECIMAL, nullable=False)
+    volume_sum = sa.Column(sa.DECIMAL, nullable=False)
+    count = sa.Column(sa.BigInteger, nullable=False)
+
+    __table_args__ = (sa.PrimaryKeyConstraint("symbol", "date"),)
+
+    @classmethod
+    async def refresh(cls, session: AsyncSession, symbol: str, since: datetime.date) -> None:
+        """
+        Recalculates running totals of the symbol for all dates from since. New days are appended to the end
+        of the history, so usually only the last few totals are recalculated.
+        """
+        previous = (
+            sa.select(cls.open_price_sum, cls.close_price_sum, cls.volume_sum, cls.count)
+            .where(cls.symbol == symbol, cls.date < since)
+            .order_by(cls.date.desc())
+            .limit(1)
+            .subquery()
+        )
+        window = {"order_by": FinancialData.date}
+        price_type = FinancialData.open_price.type
+        totals = (
+            sa.select(
+                FinancialData.symbol,
+                FinancialData.date,
+                sa.func.coalesce(previous.c.open_price_sum, 0)
+                + price_type.to_numeric(sa.func.sum(FinancialData.open_price).over(**window)),
+                sa.func.coalesce(previous.c.close_price_sum, 0)
+                + price_type.to_numeric(sa.func.sum(FinancialData.close_price).over(**window)),
+                sa.func.coalesce(previous.c.volume_sum, 0) + sa.func.sum(FinancialData.volume).over(**window),
+                sa.func.coalesce(previous.c.count, 0) + sa.func.count().over(**window),
+            )
+            .select_from(sa.outerjoin(FinancialData, previous, sa.true()))
+            .where(FinancialData.symbol == symbol, FinancialData.date >= since)
+        )
+        columns = ["symbol", "date", "open_price_sum", "close_price_sum", "volume_sum", "count"]
+        query = insert(cls).from_select(columns, totals)
+        query = query.on_conflict_do_update(
+            index_elements=["symbol", "date"],
+            set_={name: query.excluded[name] for name in columns[2:]},
+        )
+        await session.execute(query.execution_options(statement_kind="cumulative_refresh"))
+
+    @classmethod
+    async def range_stats(
+        cls, session: AsyncSession, symbol: str, start_date: datetime.date, end_date: datetime.date
+    ) -> dict:
+        """
+        Returns average for open_price, close_price and volume of the symbol between start_date and end_date
+        inclusive. Sums over the range are the difference of running totals at the end of the range and right
+        before it, so it takes two index lookups for any range length. Averages are numeric divisions of sums
+        by the number of days, the same way Postgres avg() calculates them, so results are equal to count_stats.
+        """
+        result = await cls.range_stats_batch(session, [(symbol, start_date, end_date)])
+        return result[0]
+
+    @classmethod
+    async def range_stats_batch(
+        cls,
+        session: AsyncSession,
+        windows: Sequence[Tuple[str, datetime.date, datetime.date]],
+        version: Hashable = None,
+    ) -> List[dict]:
+        """
+        Returns range_stats() for every (symbol, start_date, end_date) window in the same order with a single query:
+        windows are unnested from arrays and joined laterally with their running totals.
+        Concurrent calls with the same windows and data version share a single execution, see paginate().
+        """
+        if not windows:
+            return []
+
+        return await range_stats_flight.do((version, tuple(windows)), lambda: cls._range_stats_batch(session, windows))
+
+    @classmethod
+    async def _range_stats_batch(
+        cls, session: AsyncSession, windows: Sequence[Tuple[str, datetime.date, datetime.date]]
+    ) -> List[dict]:
+        symbols, start_dates, end_dates = zip(*windows)
+        windows_table = (
+            sa.func.unnest(
+                sa.cast(list(symbols), ARRAY(sa.String)),
+                sa.cast(list(start_dates), ARRAY(sa.Date)),
+                sa.cast(list(end_dates), ARRAY(sa.Date)),
+            )
+            .table_valued("symbol", "start_date", "end_date", with_ordinality="position")
+            .render_derived()
+        )
+        end = (
+            sa.select(cls.open_price_sum, cls.close_price_sum, cls.volume_sum, cls.count)
+            .where(cls.symbol == windows_table.c.symbol, cls.date <= windows_table.c.end_date)
+            .order_by(cls.date.desc())
+            .limit(1)
+            .lateral()
+        )
+        start = (
+            sa.select(cls.open_price_sum, cls.close_price_sum, cls.volume_sum, cls.count)
+            .where(cls.symbol == windows_table.c.symbol, cls.date < windows_table.c.start_date)
+            .order_by(cls.date.desc())
+            .limit(1)
+            .lateral()
+        )
+        count = sa.func.nullif(end.c.count - sa.func.coalesce(start.c.count, 0), 0)
+        query = (
+            sa.select(
+                [
+                    ((end.c.open_price_sum - sa.func.coalesce(start.c.open_price_sum, 0)) / count).label(
+                        "average_daily_open_price"
+                    ),
+                    ((end.c.close_price_sum - sa.func.coalesce(start.c.close_price_sum, 0)) / count).label(
+                        "average_daily_close_price"
+                    ),
+                    ((end.c.volume_sum - sa.func.coalesce(start.c.volume_sum, 0)) / count).label(
+                        "average_daily_volume"
+                    ),
+                ]
+            )
+            .select_from(windows_table.outerjoin(end, sa.true()).outerjoin(start, sa.true()))
+            .order_by(windows_table.c.position)
+            .execution_options(statement_kind="range_stats")
+        )
+        db_execute = await session.execute(query)
+        return [dict(row) for row in db_execute.mappings().all()]
+
+
+class FinancialDataVersion(EmptyBaseModel):
+    """
+    Version of financial_data of every symbol, bumped with every change of its rows, see notify_changed().
+    Validators of conditional GET requests (ETag, Last-Modified) are derived from versions.
+    """
+
+    __tablename__ = "financial_data_versions"
+
+    symbol = sa.Column(sa.String(settings.MAX_SYMBOL_LENGTH), nullable=False)
+    version = sa.Column(sa.BigInteger, nullable=False)
+    modified_at = sa.Column(sa.DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (sa.PrimaryKeyConstraint("symbol"),)
+
+    @classmethod
+    async def bump(cls, session: AsyncSession, symbols: Sequence[str]) -> None:
+        """Increments versions of the symbols. Symbols are locked in the given order, pass them sorted."""
+        if not symbols:
+            return
+
+        query = insert(cls).values(
+            [{"symbol": symbol, "version": 1, "modified_at": sa.func.now()} for symbol in symbols]
+        )
+        query = query.on_conflict_do_update(
+            index_elements=["symbol"],
+            set_={"version": cls.version + 1, "modified_at": query.excluded.modified_at},
+        )
+        await session.execute(query.execution_options(statement_kind="data_version_bump"))
+
+    @classmethod
+    async def get(cls, session: AsyncSession, symbol: Optional[str]) -> Tuple[int, Optional[datetime.datetime]]:
+        """
+        Returns the version of the symbol data and the time it was modified, (0, None) if it has no data yet.
+        Without a symbol returns the version of all data: the sum of versions, which grows with any change.
+        """
+        if symbol is not None:
+            query = sa.select(cls.version, cls.modified_at).where(cls.symbol == symbol)
+        else:
+            query = sa.select(sa.func.coalesce(sa.func.sum(cls.version), 0), sa.func.max(cls.modified_at))
+
+        db_execute = await session.execute(query.execution_options(statement_kind="data_version"))
+        row = db_execute.first()
+        return (int(row[0]), row[1]) if row is not None else (0, None)
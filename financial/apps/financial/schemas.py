@@ -1,8 +1,11 @@
 import datetime
 import decimal
+import enum
 from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel, Field, root_validator
+from pydantic import BaseModel, Field, root_validator, validator
+
+from financial.config import settings
 
 
 class BaseSchema(BaseModel):
@@ -28,11 +31,17 @@ class FinancialDataCreate(FinancialData):
     volume: int = Field(..., alias="6. volume")
 
 
+class PaginationMode(str, enum.Enum):
+    offset = "offset"
+    cursor = "cursor"
+
+
 class Pagination(BaseSchema):
-    count: int
-    page: int
+    count: Optional[int]
+    page: Optional[int]
     limit: int
-    pages: int
+    pages: Optional[int]
+    next_cursor: Optional[str]
 
 
 class Info(BaseSchema):
@@ -59,6 +68,31 @@ class StatsResponse(BaseSchema):
     info: Info
 
 
+class BatchStatsItem(BaseSchema):
+    start_date: Optional[datetime.date]
+    end_date: Optional[datetime.date]
+    symbol: str
+    average_daily_open_price: Optional[decimal.Decimal]
+    average_daily_close_price: Optional[decimal.Decimal]
+    average_daily_volume: Optional[decimal.Decimal]
+    error: str = ""
+
+
+class BatchStatsResponse(BaseSchema):
+    data: Optional[List[BatchStatsItem]]
+    info: Info
+
+
+def interval_error(start_date: Optional[datetime.date], end_date: Optional[datetime.date]) -> str:
+    """
+    Returns the error of the period or an empty string: if both dates are not None end_date must come after start_date
+    """
+    if start_date and end_date and start_date >= end_date:
+        return "Field end_date must come after start_date"
+
+    return ""
+
+
 class FinancialDataFilters(BaseSchema):
     symbol: Optional[str] = None
     start_date: Optional[datetime.date] = None
@@ -69,11 +103,9 @@ class FinancialDataFilters(BaseSchema):
         """
         Checks if both dates are not None than end_date must come after start_date
         """
-        start_date = values.get("start_date")
-        end_date = values.get("end_date")
-
-        if start_date and end_date and start_date >= end_date:
-            raise ValueError("Field end_date must come after start_date")
+        error = interval_error(values.get("start_date"), values.get("end_date"))
+        if error:
+            raise ValueError(error)
 
         return values
 
@@ -98,6 +130,151 @@ class StatisticsFilters(FinancialDataFilters):
     end_date: datetime.date
 
 
-class PaginationFilters(BaseSchema):  # pylint: disable=C0115
+class StatisticsWindow(BaseSchema):
+    symbol: str
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+
+    def validation_error(self) -> str:
+        """Returns the period error or an empty string if the period is valid"""
+        if self.start_date is None or self.end_date is None:
+            return "Fields start_date and end_date are required"
+
+        return interval_error(self.start_date, self.end_date)
+
+
+class BatchStatisticsFilters(BaseSchema):
+    """
+    Symbols are symbol names or objects with the symbol and its own period.
+    start_date and end_date are used for symbols without their own period.
+    """
+
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+    symbols: List[StatisticsWindow] = Field(..., min_items=1, max_items=settings.STATS_BATCH_MAX_SYMBOLS)
+
+    @validator("symbols", pre=True, each_item=True)
+    def make_window(cls, value: Any) -> Any:  # pylint: disable=no-self-argument
+        return {"symbol": value} if isinstance(value, str) else value
+
+    def make_windows(self) -> List[StatisticsWindow]:
+        """Returns symbol periods with start_date and end_date set for symbols without their own period"""
+        return [
+            StatisticsWindow(
+                symbol=window.symbol,
+                start_date=window.start_date or self.start_date,
+                end_date=window.end_date or self.end_date,
+            )
+            for window in self.symbols
+        ]
+
+
+class ResampleInterval(str, enum.Enum):
+    week = "week"
+    month = "month"
+    quarter = "quarter"
+    year = "year"
+
+
+class ResampleFilters(FinancialDataFilters):
+    symbol: str
+    interval: ResampleInterval = ResampleInterval.month
+
+
+class Candle(BaseSchema):
+    symbol: str
+    period: datetime.date
+    start_date: datetime.date
+    end_date: datetime.date
+    open_price: decimal.Decimal
+    close_price: decimal.Decimal
+    volume: int
+    days: int
+
+
+class ResampleResponse(BaseSchema):
+    data: Optional[List[Candle]]
+    pagination: Optional[Pagination]
+    info: Info
+
+
+class IndicatorKind(str, enum.Enum):
+    sma = "sma"
+    ema = "ema"
+    vwap = "vwap"
+    volatility = "volatility"
+
+
+class Indicator(BaseSchema):
+    kind: IndicatorKind
+    period: int = Field(..., ge=2, le=settings.INDICATORS_MAX_PERIOD)
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}_{self.period}"
+
+
+class IndicatorsFilters(BaseSchema):
+    """Indicators are passed as kind_period, e.g. sma_20"""
+
+    indicators: List[Indicator] = Field(..., min_items=1, max_items=settings.INDICATORS_MAX_COUNT)
+
+    @validator("indicators", pre=True, each_item=True)
+    def parse_indicator(cls, value: Any) -> Any:  # pylint: disable=no-self-argument
+        if isinstance(value, str):
+            kind, _, period = value.rpartition("_")
+            return {"kind": kind, "period": period}
+        return value
+
+
+class IndicatorsData(BaseSchema):
+    start_date: datetime.date
+    end_date: datetime.date
+    symbol: str
+    date: List[datetime.date]
+    close_price: List[float]
+    volume: List[int]
+    indicators: Dict[str, List[Optional[float]]]
+
+
+class IndicatorsResponse(BaseSchema):
+    data: Optional[IndicatorsData]
+    info: Info
+
+
+class DataFormat(str, enum.Enum):
+    json = "json"
+    columnar = "columnar"
+
+
+class DataFormatFilters(BaseSchema):  # pylint: disable=C0115
+    format: Optional[DataFormat] = None
+
+
+class ExportFormat(str, enum.Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+class ExportFilters(BaseSchema):  # pylint: disable=C0115
+    format: ExportFormat = ExportFormat.ndjson
+
+
+class OffsetPaginationFilters(BaseSchema):  # pylint: disable=C0115
     page: Optional[int] = Field(default=1, ge=1)
-    limit: Optional[int] = Field(default=5, le=100)
+    limit: Optional[int] = Field(default=5, ge=1, le=100)
+
+
+class PaginationFilters(OffsetPaginationFilters):  # pylint: disable=C0115
+    mode: PaginationMode = PaginationMode.offset
+    cursor: Optional[str] = None
+
+    @root_validator
+    def check_cursor(cls, values: dict) -> dict:  # pylint: disable=no-self-argument
+        """
+        Passing a cursor switches pagination to the cursor mode
+        """
+        if values.get("cursor"):
+            values["mode"] = PaginationMode.cursor.value
+
+        return values
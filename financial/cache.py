@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict, OrderedDict
+from typing import Any, Awaitable, Callable, DefaultDict, Dict, Hashable, Optional, Tuple, TypeVar
+
+import asyncpg
+
+from financial.config import settings
+from financial.metrics import COALESCED_CALLS
+
+
+logger = logging.getLogger(__name__)
+T = TypeVar("T")
+
+
+class LRUCache:
+    """
+    Bounded cache. Evicts the least recently used entry when it is full and expires entries after ttl seconds.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class SymbolCache:
+    """
+    LRU cache of per symbol results. Every symbol has a version, entries saved with an older version are stale.
+    Bumping the version invalidates all entries of the symbol at once.
+
+    Take the version before reading from database and pass it to set(), so a result read before
+    an invalidation is never served after it.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self._cache = LRUCache(maxsize, ttl)
+        self._versions: DefaultDict[str, int] = defaultdict(int)
+        # Bumped by clear() to invalidate versions taken before it
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, symbol: str) -> Tuple[int, int]:
+        return self._generation, self._versions[symbol]
+
+    def get(self, symbol: str, key: Hashable) -> Optional[Any]:
+        entry = self._cache.get((symbol, key))
+        if entry is None or entry[0] != self.version(symbol):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry[1]
+
+    def set(self, symbol: str, key: Hashable, value: Any, version: Tuple[int, int]) -> None:
+        self._cache.set((symbol, key), (version, value))
+
+    def invalidate(self, symbol: str) -> None:
+        self._versions[symbol] += 1
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._versions.clear()
+        self._generation += 1
+
+    def info(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "maxsize": self._cache.maxsize}
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first call with a key executes, calls with the same key made
+    while it's in flight await it and share its result or exception. Nothing is kept after the call completes.
+    Shared results must not be modified. If the executing call is cancelled, the waiting ones call again.
+    """
+
+    def __init__(self, operation: str) -> None:
+        self.operation = operation
+        self._calls: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self._executed = COALESCED_CALLS.labels(operation, "executed")
+        self._shared = COALESCED_CALLS.labels(operation, "shared")
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        if not settings.COALESCING_ENABLED:
+            return await func()
+
+        while (future := self._calls.get(key)) is not None:
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+            self.shared += 1
+            self._shared.inc()
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.executed += 1
+        self._executed.inc()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marks the exception as retrieved, there may be no waiting calls
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+        future.set_result(result)
+        return result
+
+    def info(self) -> Dict[str, Any]:
+        total = self.executed + self.shared
+        return {
+            "executed": self.executed,
+            "shared": self.shared,
+            "shared_ratio": self.shared / total if total else 0.0,
+            "in_flight": len(self._calls),
+        }
+
+
+stats_cache = SymbolCache(settings.STATS_CACHE_SIZE, settings.STATS_CACHE_TTL)
+listener_task: Optional["asyncio.Task[None]"] = None
+
+
+def on_notification(connection: Any, pid: int, channel: str, payload: str) -> None:  # pylint: disable=unused-argument
+    """
+    Ingestion notifies about every symbol with new or changed rows, see FinancialData.notify_changed.
+    Results read from a lagging read replica right after the notification may be outdated, so with a replica
+    the symbol is invalidated once more when the replica must have caught up or been excluded from reads.
+    """
+    stats_cache.invalidate(payload)
+    if settings.DB_READ_DSN is not None:
+        asyncio.get_event_loop().call_later(
+            settings.DB_READ_MAX_LAG + settings.DB_READ_CHECK_INTERVAL, stats_cache.invalidate, payload
+        )
+
+
+async def listen_invalidations() -> None:
+    """
+    Listens to DB_NOTIFY_CHANNEL on a dedicated connection and invalidates changed symbols.
+    Notifications sent while the connection is down are lost, so the cache is cleared on every (re)connect.
+    """
+    while True:
+        try:
+            connection = await asyncpg.connect(**settings.DB_CONNECT_PARAMS)
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.error("Cache invalidation listener can't connect to database: %s", e)
+        else:
+            try:
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(settings.DB_NOTIFY_CHANNEL, on_notification)
+                stats_cache.clear()
+                await closed.wait()
+                logger.error("Cache invalidation listener lost database connection")
+            finally:
+                await connection.close()
+
+        await asyncio.sleep(settings.DB_NOTIFY_RECONNECT_DELAY)
+
+
+async def start_invalidation_listener() -> None:
+    global listener_task  # pylint: disable=global-statement
+    listener_task = asyncio.create_task(listen_invalidations())
+
+
+async def stop_invalidation_listener() -> None:
+    if listener_task is not None:
+        listener_task.cancel()
@@ -1,3 +1,5 @@
+from typing import Any, Dict, Optional
+
 import pydantic
 from sqlalchemy.engine.url import URL
 
@@ -9,9 +11,23 @@ class Settings(pydantic.BaseSettings):
     DEBUG: bool = False
     LOG_LEVEL: str = "INFO"
 
+    ALPHAVANTAGE_URL: str = "https://www.alphavantage.co/query"
     ALPHAVANTAGE_APIKEY: str = ""
+    # History depth of symbols that have no data yet
     ALPHAVANTAGE_LAST_DAYS: int = 14
+    # Compact output has the latest 100 trading days, so any gap of up to 100 calendar days fits into it
+    ALPHAVANTAGE_COMPACT_DAYS: int = 100
+    # csv output is parsed while it is downloaded and memory usage does not depend on the history length,
+    # json output is loaded into memory as a whole
+    ALPHAVANTAGE_DATATYPE: str = "csv"
     ALPHAVANTAGE_SYMBOLS: tuple = ("IBM", "AAPL")
+    # Fetch scheduler: quota of the API key, parallel requests and retries of throttled requests
+    ALPHAVANTAGE_REQUESTS_PER_MINUTE: int = 5
+    ALPHAVANTAGE_REQUESTS_PER_DAY: int = 500
+    ALPHAVANTAGE_CONCURRENCY: int = 5
+    ALPHAVANTAGE_MAX_RETRIES: int = 3
+    ALPHAVANTAGE_BACKOFF: float = 15.0
+    ALPHAVANTAGE_TIMEOUT: float = 30.0
 
     # Ticker symbols for companies listed on the NYSE or AMEX are up to three letters long. Companies traded
     # on the Nasdaq National Market or Nasdaq Small-Cap exchanges commonly consist of four to five letters.
@@ -28,11 +44,100 @@ class Settings(pydantic.BaseSettings):
     DB_POOL_SIZE: int = 5
     DB_MAX_OVERFLOW: int = 0
     DB_ECHO: bool = False
+    # Engines are created on first use in every process. With DB_WARM_UP the startup hook opens pool size
+    # connections of every pool at once and the readiness probe fails until they are open (or the timeout passes).
+    DB_WARM_UP: bool = False
+    DB_WARM_UP_TIMEOUT: float = 10.0
+    # Optional read replica with its own pool for read-only endpoints, reads go to the primary if it's not set.
+    # Reads fall back to the primary while the replica is down or lags behind for more than DB_READ_MAX_LAG seconds.
+    DB_READ_HOST: Optional[str] = None
+    DB_READ_PORT: int = 5432
+    DB_READ_POOL_SIZE: int = 5
+    DB_READ_MAX_LAG: float = 30.0
+    DB_READ_CHECK_INTERVAL: float = 5.0
+    DB_READ_CHECK_TIMEOUT: float = 2.0
+    # Rows per multi-row upsert statement, each batch is saved in its own transaction.
+    # asyncpg accepts up to 32767 bind parameters per statement.
+    DB_UPSERT_BATCH_SIZE: int = 1000
+    # Ingestion notifies about changed symbols through this channel (LISTEN/NOTIFY)
+    DB_NOTIFY_CHANNEL: str = "financial_data"
+    DB_NOTIFY_RECONNECT_DELAY: float = 5.0
+    # financial_data is partitioned by year, ingestion creates partitions from the first year
+    # (alphavantage daily history starts in 1999) up to this many years ahead of the current one
+    DB_PARTITIONS_FIRST_YEAR: int = 1999
+    DB_PARTITIONS_AHEAD_YEARS: int = 1
+
+    # Periodic ingestion in the app: one of the app processes (the holder of the advisory lock INGESTION_LOCK_ID)
+    # runs ingestion.fill_financial_data every INGESTION_INTERVAL seconds, others retry to take the lock
+    # every INGESTION_LOCK_RETRY seconds, so another process takes over when the leader goes down.
+    # The leader checks its lock connection every INGESTION_LOCK_CHECK_INTERVAL seconds and stops ingestion if it's lost
+    INGESTION_ENABLED: bool = False
+    INGESTION_INTERVAL: float = 300.0
+    INGESTION_LOCK_ID: int = 727100418
+    INGESTION_LOCK_RETRY: float = 30.0
+    INGESTION_LOCK_CHECK_INTERVAL: float = 5.0
+    INGESTION_LOCK_CHECK_TIMEOUT: float = 5.0
+
+    # Query guard: filters an index can't serve (e.g. symbol__ilike alone) are rejected with 422
+    # instead of scanning the table, see EmptyBaseModel.indexed_filters. Plan checks (financial/plans.py)
+    # flag scans of relations with more than QUERY_PLAN_MIN_ROWS rows.
+    QUERY_GUARD_ENABLED: bool = False
+    QUERY_PLAN_MIN_ROWS: int = 10000
+
+    # Concurrent identical paginate and statistics queries share a single execution
+    COALESCING_ENABLED: bool = True
+
+    # Statistics results cache, invalidated by ingestion notifications
+    STATS_CACHE_SIZE: int = 10000
+    STATS_CACHE_TTL: float = 300.0
+    STATS_BATCH_MAX_SYMBOLS: int = 500
+
+    # Indicators endpoint: the longest indicator period in days and indicators per request
+    INDICATORS_MAX_PERIOD: int = 500
+    INDICATORS_MAX_COUNT: int = 10
+
+    # Rows fetched from the server-side cursor at once by the export endpoint
+    EXPORT_CHUNK_SIZE: int = 5000
+
+    # CSV import: files imported at once (limited by the pool size), bytes read from a file at once
+    # and seconds between progress log records
+    IMPORT_JOBS: int = 4
+    IMPORT_CHUNK_SIZE: int = 2**20
+    IMPORT_PROGRESS_INTERVAL: float = 5.0
+
+    # Opt-in request profiling: requests with the header are profiled, the header value "stacks"
+    # adds a sampled stack profile. Nothing is installed while it's disabled.
+    PROFILING_ENABLED: bool = False
+    PROFILING_HEADER: str = "X-Profile"
+    PROFILING_SAMPLE_INTERVAL: float = 0.001
+    PROFILING_TOP_STACKS: int = 20
+    # Reports are kept for GET /profilez/{id}
+    PROFILING_REPORTS: int = 100
+    PROFILING_REPORTS_TTL: float = 600.0
 
     @property
     def DB_DSN(self) -> URL:
         return URL.create(self.DB_DRIVER, self.DB_USER, self.DB_PASSWORD, self.DB_HOST, self.DB_PORT, self.DB_DATABASE)
 
+    @property
+    def DB_CONNECT_PARAMS(self) -> Dict[str, Any]:
+        """asyncpg.connect() parameters of dedicated connections outside of the pool (LISTEN, advisory locks)"""
+        return {
+            "host": self.DB_HOST,
+            "port": self.DB_PORT,
+            "user": self.DB_USER,
+            "password": self.DB_PASSWORD,
+            "database": self.DB_DATABASE,
+        }
+
+    @property
+    def DB_READ_DSN(self) -> Optional[URL]:
+        if not self.DB_READ_HOST:
+            return None
+        return URL.create(
+            self.DB_DRIVER, self.DB_USER, self.DB_PASSWORD, self.DB_READ_HOST, self.DB_READ_PORT, self.DB_DATABASE
+        )
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -1,23 +1,279 @@
-from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar
+import asyncio
+import base64
+import binascii
+import decimal
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, ClassVar, Dict, Hashable, List, Optional, Sequence, Tuple, Type, TypeVar
 
 import sqlalchemy as sa
 from sqlalchemy import MetaData
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.engine.url import URL
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, selectinload, sessionmaker
 from sqlalchemy.sql import operators
 
+from financial.cache import SingleFlight
 from financial.config import settings
+from financial.metrics import instrument_engine, instrumented_pool_class, STARTUP_DURATION
 
 
-engine = create_async_engine(
-    settings.DB_DSN,
-    echo=settings.DB_ECHO,
-    pool_size=settings.DB_POOL_SIZE,
-    max_overflow=settings.DB_MAX_OVERFLOW,
-    future=True,
-)
-async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession, future=True, autoflush=False)
+logger = logging.getLogger(__name__)
+paginate_flight = SingleFlight("paginate")
+
+
+class ReplicaMonitor:
+    """
+    Tracks if the read replica is up and how far its replay lags behind the primary.
+    The replica is checked in a background task at most once per DB_READ_CHECK_INTERVAL, requests never wait
+    for the check and use the last result. Until the first check finishes the replica counts as unavailable.
+    """
+
+    # Replay timestamp stays old while the primary has no writes, so a replica that replayed
+    # everything it received has no lag. A server that is not in recovery is the primary itself.
+    LAG_QUERY = sa.text(
+        "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    )
+
+    def __init__(self, read_engine: AsyncEngine, max_lag: float, check_interval: float, check_timeout: float) -> None:
+        self.engine = read_engine
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.available = False
+        self.lag: Optional[float] = None
+        self.checked_at = float("-inf")
+        self.check_task: Optional["asyncio.Task[None]"] = None
+
+    async def get_lag(self) -> float:
+        async with self.engine.connect() as connection:
+            return float(await connection.scalar(self.LAG_QUERY))
+
+    async def check(self) -> None:
+        try:
+            self.lag = await asyncio.wait_for(self.get_lag(), self.check_timeout)
+        except (OSError, asyncio.TimeoutError, SQLAlchemyError) as e:
+            logger.warning("Read replica is unavailable: %r", e)
+            self.lag = None
+
+        available = self.lag is not None and self.lag <= self.max_lag
+        if self.available and not available and self.lag is not None:
+            logger.warning("Read replica lags behind for %.1f seconds, reads go to the primary", self.lag)
+        self.available = available
+        self.checked_at = time.monotonic()
+
+    def is_available(self) -> bool:
+        """Returns the last check result and starts a new check when it's due"""
+        if time.monotonic() - self.checked_at >= self.check_interval and (
+            self.check_task is None or self.check_task.done()
+        ):
+            self.check_task = asyncio.create_task(self.check())
+        return self.available
+
+
+def create_engine(dsn: URL, pool_size: int, name: str) -> AsyncEngine:
+    engine = create_async_engine(
+        dsn,
+        echo=settings.DB_ECHO,
+        pool_size=pool_size,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        poolclass=instrumented_pool_class(name),
+        future=True,
+    )
+    instrument_engine(engine, name)
+    if settings.PROFILING_ENABLED:
+        from financial.profiling import instrument_engine as profile_engine  # pylint: disable=import-outside-toplevel
+
+        profile_engine(engine)
+    return engine
+
+
+class Database:
+    """
+    Engines and session factories of the process. Nothing connects until the first query,
+    pools are filled on demand or in advance by warm_up().
+    """
+
+    def __init__(self) -> None:
+        self.engine = create_engine(settings.DB_DSN, settings.DB_POOL_SIZE, "primary")
+        self.session = sessionmaker(
+            self.engine, expire_on_commit=False, class_=AsyncSession, future=True, autoflush=False
+        )
+        self.read_engine: Optional[AsyncEngine] = None
+        self.read_session: Optional[sessionmaker] = None
+        self.replica_monitor: Optional[ReplicaMonitor] = None
+
+        if settings.DB_READ_DSN is not None:
+            self.read_engine = create_engine(settings.DB_READ_DSN, settings.DB_READ_POOL_SIZE, "read")
+            self.read_session = sessionmaker(
+                self.read_engine, expire_on_commit=False, class_=AsyncSession, future=True, autoflush=False
+            )
+            self.replica_monitor = ReplicaMonitor(
+                self.read_engine,
+                settings.DB_READ_MAX_LAG,
+                settings.DB_READ_CHECK_INTERVAL,
+                settings.DB_READ_CHECK_TIMEOUT,
+            )
+
+    def engines(self) -> List[AsyncEngine]:
+        return [engine for engine in (self.engine, self.read_engine) if engine is not None]
+
+    async def warm_up(self) -> None:
+        """
+        Opens pool_size connections of every pool at once and checks them, so first requests don't connect.
+        Connections are held until all of them are open, otherwise the pool would hand out the same one.
+        """
+        started_at = time.perf_counter()
+        connections = [engine.connect() for engine in self.engines() for _ in range(engine.pool.size())]
+
+        async def check(connection: AsyncConnection) -> None:
+            await connection.start()
+            await connection.scalar(sa.text("SELECT 1"))
+
+        try:
+            results = await asyncio.gather(*[check(connection) for connection in connections], return_exceptions=True)
+        finally:
+            await asyncio.gather(
+                *[connection.close() for connection in connections if connection.sync_connection is not None]
+            )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        duration = time.perf_counter() - started_at
+        STARTUP_DURATION.labels("db_warm_up").set(duration)
+        logger.info("Opened %s database connections in %.3f seconds", len(connections), duration)
+
+    async def dispose(self) -> None:
+        for engine in self.engines():
+            await engine.dispose()
+
+    def forget(self) -> None:
+        """Drops pooled connections inherited from the parent process without closing them, the parent uses them"""
+        for engine in self.engines():
+            engine.sync_engine.dispose(close=False)
+
+
+_database: Optional[Database] = None
+
+
+def get_database() -> Database:
+    """Returns the database of the process, it's created on first use and again in a forked process"""
+    global _database  # pylint: disable=global-statement
+    if _database is None:
+        _database = Database()
+    return _database
+
+
+def _after_fork_in_child() -> None:
+    global _database  # pylint: disable=global-statement
+    if _database is not None:
+        _database.forget()
+        _database = None
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def get_engine() -> AsyncEngine:
+    return get_database().engine
+
+
+def async_session() -> AsyncSession:
+    """Returns a session of the primary"""
+    return get_database().session()
+
+
+async def read_session() -> AsyncSession:
+    """Returns a session of the read replica if it's configured and available, otherwise of the primary"""
+    database = get_database()
+    if (
+        database.read_session is not None
+        and database.replica_monitor is not None
+        and database.replica_monitor.is_available()
+    ):
+        return database.read_session()
+    return database.session()
+
+
+async def warm_up_pools() -> None:
+    try:
+        await asyncio.wait_for(get_database().warm_up(), settings.DB_WARM_UP_TIMEOUT)
+    except (OSError, asyncio.TimeoutError, SQLAlchemyError) as e:
+        # Connections are opened on demand then, the readiness probe checks the database itself
+        logger.error("Database pools are not warmed up: %r", e)
+
+
+warm_up_task: Optional["asyncio.Task[None]"] = None
+
+
+async def start_pools_warm_up() -> None:
+    """Startup hook. With DB_WARM_UP pools are filled in the background and the readiness probe fails until then."""
+    global warm_up_task  # pylint: disable=global-statement
+    if settings.DB_WARM_UP:
+        warm_up_task = asyncio.create_task(warm_up_pools())
+
+
+def is_warming_up() -> bool:
+    return warm_up_task is not None and not warm_up_task.done()
+
+
+def created_engines() -> List[AsyncEngine]:
+    """Returns engines of the process without creating them"""
+    return _database.engines() if _database is not None else []
+
+
+async def dispose_engines() -> None:
+    if _database is not None:
+        await _database.dispose()
+
+
+class ScaledDecimal(sa.types.TypeDecorator):
+    """
+    Decimal stored as BIGINT number of 10^-scale units, e.g. 123.45 is 1234500 with the scale 4.
+    Integers take 8 bytes and integer sum() and avg() are much faster than numeric ones.
+    Values with more fractional digits are rounded half away from zero, the same way as Postgres round().
+    Results of SQL arithmetic on the column are in units, see to_numeric() and from_numeric().
+    """
+
+    impl = sa.BigInteger
+    cache_ok = True
+
+    def __init__(self, scale: int = 4) -> None:
+        super().__init__()
+        self.scale = scale
+
+    @property
+    def python_type(self) -> Type[decimal.Decimal]:
+        return decimal.Decimal
+
+    def process_bind_param(self, value: Any, dialect: Any) -> Optional[int]:
+        if value is None:
+            return None
+        return int(decimal.Decimal(value).scaleb(self.scale).to_integral_value(decimal.ROUND_HALF_UP))
+
+    def process_result_value(self, value: Any, dialect: Any) -> Optional[decimal.Decimal]:
+        if value is None:
+            return None
+        return decimal.Decimal(value).scaleb(-self.scale)
+
+    def to_numeric(self, expression: Any) -> Any:
+        """Converts SQL expression in units (e.g. sum of the column) to numeric with the scale fractional digits"""
+        return sa.cast(expression, sa.Numeric) * sa.literal_column(f"1e-{self.scale}", sa.Numeric)
+
+    def from_numeric(self, expression: Any) -> Any:
+        """Converts numeric SQL expression to units"""
+        return sa.cast(sa.func.round(expression * 10**self.scale), sa.BigInteger)
+
+
+class UnindexedFiltersError(Exception):
+    """Filters have no condition an index of the table can serve, see EmptyBaseModel.indexed_filters"""
+
 
 TBase = TypeVar("TBase", bound="EmptyBaseModel")
 metadata = MetaData()
@@ -53,8 +309,17 @@ class EmptyBaseModel(Base):  # type: ignore
 
     __abstract__ = True
 
+    # Operators of every column that indexes of the table serve, e.g. {"symbol": ("exact", "in")}.
+    # With QUERY_GUARD_ENABLED filters without any of them are rejected, models without it are not checked.
+    # tests/test_plans.py checks them against query plans.
+    indexed_filters: ClassVar[Dict[str, Tuple[str, ...]]] = {}
+
     @classmethod
-    def _get_query(cls: Type[TBase], prefetch: Optional[Tuple[str, ...]] = None) -> Any:
+    def _get_query(cls: Type[TBase], prefetch: Optional[Tuple[str, ...]] = None, as_rows: bool = False) -> Any:
+        """Selects model objects or, with as_rows, plain row tuples of table columns without ORM overhead"""
+        if as_rows:
+            return sa.select(*cls.__table__.columns)
+
         query = sa.select(cls)
         if prefetch:
             options: List[Any] = [selectinload(x) for x in prefetch]
@@ -70,9 +335,24 @@ class EmptyBaseModel(Base):  # type: ignore
             result.append(getattr(field, direction)())
         return result
 
+    @classmethod
+    def is_indexed(cls: Type[TBase], filters: Dict[str, Any]) -> bool:
+        """Checks if at least one of the filters can be served by an index, so the query doesn't scan the table"""
+        for expression in filters:
+            parts = expression.split("__")
+            if (parts[1] if len(parts) > 1 else "exact") in cls.indexed_filters.get(parts[0], ()):
+                return True
+        return False
+
     @classmethod
     def build_filters(cls: Type[TBase], filters: Dict[str, Any]) -> List[Any]:
         """Builds list of WHERE conditions"""
+        if settings.QUERY_GUARD_ENABLED and cls.indexed_filters and filters and not cls.is_indexed(filters):
+            indexed = ", ".join(f"{column} ({', '.join(ops)})" for column, ops in cls.indexed_filters.items())
+            raise UnindexedFiltersError(
+                f"Filters {', '.join(filters)} would scan the whole table, filter by one of: {indexed}"
+            )
+
         result = []
         for expression, value in filters.items():
             parts = expression.split("__")
@@ -95,9 +375,45 @@ class EmptyBaseModel(Base):  # type: ignore
             set_=to_set,
             where=sa.and_(True, *cls.build_filters(ids)),
         )
-        db_execute = await db.execute(query)
+        db_execute = await db.execute(query.execution_options(statement_kind="upsert"))
         return db_execute.inserted_primary_key[0]
 
+    @classmethod
+    async def bulk_insert_or_update(cls: Type[TBase], db: AsyncSession, rows: List[Dict[str, Any]]) -> int:
+        """
+        Upserts all rows with a single multi-row INSERT ... ON CONFLICT statement.
+        Conflicts are resolved by the primary key. Existing rows are updated only if any value differs,
+        so rewriting unchanged data produces no new row versions. Returns the number of inserted and updated rows.
+        """
+        if not rows:
+            return 0
+
+        query = cls._on_conflict_update(insert(cls).values(rows), list(rows[0]))
+        db_execute = await db.execute(query.execution_options(statement_kind="upsert"))
+        return db_execute.rowcount
+
+    @classmethod
+    async def insert_or_update_from_select(cls: Type[TBase], db: AsyncSession, columns: List[str], select: Any) -> int:
+        """
+        Upserts rows of the select into columns with INSERT ... SELECT ... ON CONFLICT the same way
+        as bulk_insert_or_update. The select must not return the same primary key twice.
+        Returns the number of inserted and updated rows.
+        """
+        query = cls._on_conflict_update(insert(cls).from_select(columns, select), columns)
+        db_execute = await db.execute(query.execution_options(statement_kind="upsert"))
+        return db_execute.rowcount
+
+    @classmethod
+    def _on_conflict_update(cls: Type[TBase], query: Any, columns: List[str]) -> Any:
+        """Resolves conflicts by the primary key, updates rows only if any of columns differs"""
+        primary_key = [column.name for column in cls._primary_key()]
+        to_update = [name for name in columns if name not in primary_key]
+        return query.on_conflict_do_update(
+            index_elements=primary_key,
+            set_={name: query.excluded[name] for name in to_update},
+            where=sa.or_(*[cls.__table__.c[name].is_distinct_from(query.excluded[name]) for name in to_update]),
+        )
+
     @classmethod
     async def paginate(
         cls: Type[TBase],
@@ -108,8 +424,44 @@ class EmptyBaseModel(Base):  # type: ignore
         prefetch: Optional[Tuple[str, ...]] = None,
         page: Optional[int] = 1,
         per_page: Optional[int] = 5,
-    ) -> Tuple[List[TBase], int, int]:
-        query = cls._get_query(prefetch)
+        as_rows: bool = False,
+        version: Hashable = None,
+    ) -> Tuple[List[Any], int, int]:
+        """
+        Returns objects (or rows with as_rows) of the page, the number of objects and pages.
+        Concurrent calls returning rows with the same arguments share a single execution. Objects belong to
+        the session that loaded them, so calls returning objects or with joins are always executed.
+        Pass the data version read before the call: calls share only executions of the same version,
+        so a call never gets rows of an execution started before a change it has seen.
+        """
+        if not as_rows or join:
+            return await cls._paginate(db, filters, join, sorting, prefetch, page, per_page, as_rows)
+
+        key = (
+            cls.__name__,
+            version,
+            tuple(sorted(filters.items())) if filters is not None else None,
+            tuple(sorting.items()) if sorting is not None else None,
+            page,
+            per_page,
+        )
+        return await paginate_flight.do(
+            key, lambda: cls._paginate(db, filters, join, sorting, prefetch, page, per_page, as_rows)
+        )
+
+    @classmethod
+    async def _paginate(
+        cls: Type[TBase],
+        db: AsyncSession,
+        filters: Optional[Dict[str, Any]],
+        join: Optional[List[Any]],
+        sorting: Optional[Dict[str, str]],
+        prefetch: Optional[Tuple[str, ...]],
+        page: Optional[int],
+        per_page: Optional[int],
+        as_rows: bool,
+    ) -> Tuple[List[Any], int, int]:
+        query = cls._get_query(prefetch, as_rows)
 
         if join:
             query = query.join(*join)
@@ -120,9 +472,106 @@ class EmptyBaseModel(Base):  # type: ignore
         if filters is not None:
             query = query.where(sa.and_(True, *cls.build_filters(filters)))
 
-        total = await db.scalar(sa.select([sa.func.count()]).select_from(query))
+        db_execute, total, pages = await cls.paginate_query(db, query, page, per_page)  # type: ignore
+        return db_execute.all() if as_rows else db_execute.scalars().all(), total, pages
+
+    @classmethod
+    async def paginate_query(
+        cls: Type[TBase], db: AsyncSession, query: Any, page: int, per_page: int
+    ) -> Tuple[Any, int, int]:
+        """Runs the page of the ordered query. Returns the result of the page, the number of rows and pages."""
+        total = await db.scalar(
+            sa.select([sa.func.count()])
+            .select_from(query.subquery())
+            .execution_options(statement_kind="paginate_count")
+        )
         pages = total // per_page if not total % per_page else total // per_page + 1
-        query = query.limit(per_page).offset((page - 1) * per_page)  # type: ignore
+        query = query.limit(per_page).offset((page - 1) * per_page)
+        query = query.execution_options(statement_kind="paginate_page")
+        return await db.execute(query), total, pages
+
+    @classmethod
+    def _primary_key(cls: Type[TBase]) -> List[Any]:
+        """Returns primary key columns in the order they were declared"""
+        return list(cls.__table__.primary_key.columns)
+
+    @classmethod
+    def encode_cursor(cls: Type[TBase], obj: Any) -> str:
+        """Builds an opaque cursor from the primary key values of the object"""
+        values = [getattr(obj, column.name) for column in cls._primary_key()]
+        raw = json.dumps(values, default=str, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @classmethod
+    def decode_cursor(cls: Type[TBase], cursor: str) -> List[Any]:
+        """Returns primary key values from the cursor. Raises ValueError if the cursor is malformed"""
+        columns = cls._primary_key()
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            values = json.loads(raw)
+        except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+            raise ValueError("malformed cursor") from e
+
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("malformed cursor")
+
+        result = []
+        for column, value in zip(columns, values):
+            python_type = column.type.python_type
+            try:
+                if hasattr(python_type, "fromisoformat"):
+                    result.append(python_type.fromisoformat(value))
+                else:
+                    result.append(python_type(value))
+            except (TypeError, ValueError) as e:
+                raise ValueError("malformed cursor") from e
+        return result
+
+    @classmethod
+    async def paginate_by_cursor(
+        cls: Type[TBase],
+        db: AsyncSession,
+        filters: Optional[Dict[str, Any]],
+        cursor: Optional[str] = None,
+        per_page: int = 5,
+        as_rows: bool = False,
+    ) -> Tuple[List[Any], Optional[str]]:
+        """
+        Keyset (seek) pagination. Rows are ordered by the primary key and every page starts right after
+        the row encoded in the cursor, so the index is used to seek and deep pages cost the same as the first one.
+        Returns page objects (or rows with as_rows) and the cursor of the next page or None if it is the last page.
+        """
+        primary_key = cls._primary_key()
+        query = cls._get_query(as_rows=as_rows).order_by(*primary_key)
+
+        if filters is not None:
+            query = query.where(sa.and_(True, *cls.build_filters(filters)))
+
+        if cursor:
+            query = query.where(sa.tuple_(*primary_key) > sa.tuple_(*cls.decode_cursor(cursor)))
+
+        # One extra row tells if there is a next page without running count(*)
+        db_execute = await db.execute(query.limit(per_page + 1).execution_options(statement_kind="paginate_cursor"))
+        objects = db_execute.all() if as_rows else db_execute.scalars().all()
+        if len(objects) <= per_page:
+            return objects, None
+
+        objects = objects[:per_page]
+        return objects, cls.encode_cursor(objects[-1])
+
+    @classmethod
+    async def stream_rows(
+        cls: Type[TBase], db: AsyncSession, filters: Optional[Dict[str, Any]], chunk_size: int = 1000
+    ) -> AsyncIterator[Sequence[Any]]:
+        """
+        Yields chunks of rows ordered by the primary key. Rows are plain tuples of table columns
+        fetched through a server-side cursor, so memory usage does not depend on the number of rows.
+        """
+        query = sa.select(*cls.__table__.columns).order_by(*cls._primary_key())
+
+        if filters is not None:
+            query = query.where(sa.and_(True, *cls.build_filters(filters)))
 
-        db_execute = await db.execute(query)
-        return db_execute.scalars().all(), total, pages
+        db_stream = await db.stream(query.execution_options(max_row_buffer=chunk_size, statement_kind="stream"))
+        async for rows in db_stream.partitions(chunk_size):
+            yield rows
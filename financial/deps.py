@@ -1,4 +1,4 @@
-from financial.db import async_session
+from financial.db import async_session, read_session
 
 
 async def get_db():
@@ -7,3 +7,12 @@ async def get_db():
         yield db
     finally:
         await db.close()
+
+
+async def get_read_db():
+    """Session for read-only endpoints, uses the read replica when it's available"""
+    db = await read_session()
+    try:
+        yield db
+    finally:
+        await db.close()
@@ -8,6 +8,7 @@ from fastapi.responses import JSONResponse
 
 from financial.api.base import InternalServerError, ProbeError
 from financial.apps.financial.schemas import StatsResponse
+from financial.db import UnindexedFiltersError
 
 
 logger = logging.getLogger(__name__)
@@ -24,13 +25,13 @@ def default_error_handler_creator(resp_status: int) -> Callable:  # pylint: disa
     """
 
     async def default_error_handler(request: Request, exc: Exception) -> JSONResponse:
-        if "route" in request.scope:
+        response_model = StatsResponse
+        # Probes respond with plain values, their response model (if any) has no info field
+        if "route" in request.scope and "info" in getattr(request.scope["route"].response_model, "__fields__", {}):
             response_model = request.scope["route"].response_model
-        else:
-            response_model = StatsResponse
 
         if isinstance(exc, (RequestValidationError, ValidationError)):
-            message = "; ".join([f"{'.'.join(err['loc'])}: {err['msg']}" for err in exc.errors()])  # type: ignore
+            message = "; ".join([f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in exc.errors()])
             return error_response(resp_status, response_model, message=message)
 
         if isinstance(exc, StarletteHTTPException):
@@ -52,6 +53,7 @@ def setup_exceptions(application: FastAPI) -> None:
         (RequestValidationError, default_error_handler_creator(status.HTTP_422_UNPROCESSABLE_ENTITY)),
         (ValidationError, default_error_handler_creator(status.HTTP_422_UNPROCESSABLE_ENTITY)),
         (StarletteHTTPException, default_error_handler_creator(status.HTTP_422_UNPROCESSABLE_ENTITY)),
+        (UnindexedFiltersError, default_error_handler_creator(status.HTTP_422_UNPROCESSABLE_ENTITY)),
     ]
 
     for err, handler in exc_pairs:
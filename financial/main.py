@@ -1,10 +1,20 @@
+import logging
+import time
+
 from fastapi import FastAPI
 
+from financial import IMPORT_STARTED_AT
 from financial.api.base import router as base_router
 from financial.apps.financial.api.views import router as financial_router
+from financial.cache import start_invalidation_listener, stop_invalidation_listener
 from financial.config import settings
+from financial.db import created_engines, dispose_engines, start_pools_warm_up
 from financial.exceptions import setup_exceptions
 from financial.logging import configure_logging
+from financial.metrics import MetricsMiddleware, STARTUP_DURATION
+from financial.profiling import instrument_engine, instrument_responses, ProfilingMiddleware
+from financial.responses import ColumnarResponse, FastJSONResponse
+from financial.scheduler import start_ingestion_scheduler, stop_ingestion_scheduler
 
 
 def setup_routers(application: FastAPI) -> None:
@@ -12,6 +22,34 @@ def setup_routers(application: FastAPI) -> None:
     application.include_router(base_router, tags=["probe"])
 
 
+logger = logging.getLogger(__name__)
+
+
+def setup_events(application: FastAPI) -> None:
+    application.add_event_handler("startup", start_pools_warm_up)
+    application.add_event_handler("shutdown", dispose_engines)
+    application.add_event_handler("startup", start_invalidation_listener)
+    application.add_event_handler("shutdown", stop_invalidation_listener)
+    application.add_event_handler("startup", start_ingestion_scheduler)
+    application.add_event_handler("shutdown", stop_ingestion_scheduler)
+
+
+def setup_middlewares(application: FastAPI) -> None:
+    application.add_middleware(MetricsMiddleware)
+
+
+def setup_profiling(application: FastAPI) -> None:
+    """Installs request profiling only when it's enabled, so it costs nothing otherwise"""
+    if not settings.PROFILING_ENABLED:
+        return
+
+    # Engines created later are instrumented on creation
+    for profiled_engine in created_engines():
+        instrument_engine(profiled_engine)
+    instrument_responses(FastJSONResponse, ColumnarResponse)
+    application.add_middleware(ProfilingMiddleware)
+
+
 def get_app(app_name: str) -> FastAPI:
     application = FastAPI(
         title=app_name,
@@ -22,7 +60,12 @@ def get_app(app_name: str) -> FastAPI:
     configure_logging()
     setup_exceptions(application)
     setup_routers(application)
+    setup_events(application)
+    setup_middlewares(application)
+    setup_profiling(application)
     return application
 
 
 app = get_app(app_name=settings.SERVICE_NAME)
+STARTUP_DURATION.labels("import").set(time.perf_counter() - IMPORT_STARTED_AT)
+logger.info("Imported the app in %.3f seconds", time.perf_counter() - IMPORT_STARTED_AT)
@@ -0,0 +1,113 @@
+import time
+from typing import Any, Type
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request duration until the response is sent", ["method", "route", "status"]
+)
+POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool",
+    ["pool"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+POOL_IN_USE = Gauge("db_pool_connections_in_use", "Connections checked out from the pool", ["pool"])
+QUERY_DURATION = Histogram("db_query_duration_seconds", "Query execution duration", ["pool", "kind"])
+COALESCED_CALLS = Counter(
+    "db_coalesced_calls_total",
+    "Calls of coalesced queries by the operation, executed ones ran the query, shared ones awaited an executed one",
+    ["operation", "result"],
+)
+INGESTION_RUNS = Counter("ingestion_runs_total", "Ingestion runs")
+INGESTION_ROWS = Counter("ingestion_rows_total", "Rows collected from alphavantage and written to database", ["stage"])
+INGESTION_ERRORS = Counter("ingestion_errors_total", "Ingestion errors", ["stage"])
+INGESTION_DURATION = Histogram(
+    "ingestion_duration_seconds",
+    "Duration of scheduled ingestion runs",
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0),
+)
+INGESTION_LAST_RUN = Gauge("ingestion_last_run_timestamp_seconds", "Start time of the last scheduled ingestion run")
+INGESTION_LEADER = Gauge("ingestion_leader", "1 if the process holds the ingestion lock and runs scheduled ingestion")
+STARTUP_DURATION = Gauge("app_startup_seconds", "Duration of startup phases of the process", ["phase"])
+
+# Queries are labeled by the statement_kind execution option, e.g. query.execution_options(statement_kind="upsert")
+DEFAULT_STATEMENT_KIND = "other"
+
+
+def instrumented_pool_class(name: str) -> Type[AsyncAdaptedQueuePool]:
+    """
+    Returns pool class measuring checkout wait time with the pool label name.
+    A subclass keeps the label when the pool is recreated, e.g. on engine.dispose().
+    """
+
+    class InstrumentedPool(AsyncAdaptedQueuePool):
+        def _do_get(self) -> Any:
+            started_at = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                POOL_WAIT.labels(name).observe(time.perf_counter() - started_at)
+
+    return InstrumentedPool
+
+
+def instrument_engine(engine: AsyncEngine, name: str) -> None:
+    """Tracks connections in use and query durations of the engine with the pool label name"""
+    in_use = POOL_IN_USE.labels(name)
+
+    @event.listens_for(engine.sync_engine, "checkout")
+    def on_checkout(*args: Any) -> None:  # pylint: disable=unused-argument
+        in_use.inc()
+
+    @event.listens_for(engine.sync_engine, "checkin")
+    def on_checkin(*args: Any) -> None:  # pylint: disable=unused-argument
+        in_use.dec()
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_execute(
+        conn: Any, cursor: Any, statement: Any, parameters: Any, context: Any, executemany: bool
+    ) -> None:
+        context.query_started_at = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_execute(conn: Any, cursor: Any, statement: Any, parameters: Any, context: Any, executemany: bool) -> None:
+        kind = context.execution_options.get("statement_kind", DEFAULT_STATEMENT_KIND)
+        QUERY_DURATION.labels(name, kind).observe(time.perf_counter() - context.query_started_at)
+
+
+class MetricsMiddleware:
+    """
+    Measures duration of HTTP requests labeled by the route path template, so path parameters
+    don't make new series. Requests that matched no route are labeled as unmatched.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_DURATION.labels(
+                scope["method"], route.path if route is not None else "unmatched", str(status_code)
+            ).observe(time.perf_counter() - started_at)
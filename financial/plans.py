@@ -0,0 +1,85 @@
+"""
+Query plan checks: EXPLAIN (FORMAT JSON) of a query and the scans in its plan that read whole relations,
+i.e. sequential scans and index scans without an index condition. tests/test_plans.py runs them for the
+filters the API builds, so a filter an index can't serve is caught before it meets a large table.
+"""
+import re
+from typing import Any, Dict, Iterator, List
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from financial.config import settings
+
+
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+# Conditions that limit the range of scanned index entries
+INDEX_CONDITION = re.compile(r"[=<>]|ANY")
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of the query, parameters are bound the same way as when the query is executed"""
+
+    inherit_cache = False
+
+    def __init__(self, query: Any) -> None:
+        self.query = query
+
+
+@compiles(Explain)
+def compile_explain(element: Explain, compiler: Any, **kwargs: Any) -> str:
+    return f"EXPLAIN (FORMAT JSON) {compiler.process(element.query, **kwargs)}"
+
+
+async def explain(session: AsyncSession, query: Any) -> Dict[str, Any]:
+    """Returns the root node of the query plan"""
+    db_execute = await session.execute(Explain(query))
+    return db_execute.scalar()[0]["Plan"]
+
+
+def iter_nodes(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from iter_nodes(child)
+
+
+def full_scans(plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Returns scan nodes that read whole relations"""
+    return [
+        node
+        for node in iter_nodes(plan)
+        if node["Node Type"] == "Seq Scan"
+        # IS NOT NULL of a not null column is an index condition matching every row
+        or (node["Node Type"] in INDEX_SCANS and not INDEX_CONDITION.search(node.get("Index Cond", "")))
+    ]
+
+
+async def check_plan(session: AsyncSession, query: Any, min_rows: int = settings.QUERY_PLAN_MIN_ROWS) -> List[str]:
+    """
+    Returns problems of the query plan: full scans of relations with at least min_rows rows
+    (as estimated by the last ANALYZE, relations without statistics are counted as large).
+    """
+    scans = full_scans(await explain(session, query))
+    if not scans:
+        return []
+
+    relations = sorted({node["Relation Name"] for node in scans if "Relation Name" in node})
+    db_execute = await session.execute(
+        sa.select(sa.column("relname"), sa.column("reltuples"))
+        .select_from(sa.table("pg_class"))
+        .where(sa.column("relname").in_(relations), sa.column("relkind") == "r")
+    )
+    # reltuples is -1 until the relation is analyzed
+    rows = {name: tuples if tuples >= 0 else float("inf") for name, tuples in db_execute}
+
+    problems = []
+    for node in scans:
+        relation = node.get("Relation Name", node.get("Index Name", "?"))
+        relation_rows = rows.get(relation, float("inf"))
+        if relation_rows >= min_rows:
+            problems.append(
+                f"{node['Node Type']} on {relation} ({relation_rows:.0f} rows): {node.get('Filter', 'no condition')}"
+            )
+    return problems
@@ -0,0 +1,259 @@
+import asyncio
+import functools
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Any, Callable, DefaultDict, Dict, Optional, Type, TypeVar
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from financial.cache import LRUCache
+from financial.config import settings
+
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Header value requesting a sampled stack profile in addition to timings
+SAMPLE_STACKS = "stacks"
+
+
+class StackSampler:
+    """
+    Samples the stack of the thread running the event loop from a background thread.
+    Stacks are counted in the collapsed format (frames from outermost to innermost separated by ;),
+    which flame graph tools read. Concurrent requests run in the same thread and may appear in samples too.
+    """
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: "Counter[str]" = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            frames = []
+            while frame is not None:
+                frames.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+
+class Profile:
+    """Time breakdown of a single request, phases are summed in seconds"""
+
+    def __init__(self, method: str, path: str, sample_stacks: bool = False) -> None:
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.status: Optional[int] = None
+        self.started_at = time.perf_counter()
+        self.total = 0.0
+        self.timings: DefaultDict[str, float] = defaultdict(float)
+        self.counts: DefaultDict[str, int] = defaultdict(int)
+        self.endpoint_finished_at: Optional[float] = None
+        self.sampler = (
+            StackSampler(threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL) if sample_stacks else None
+        )
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.timings[phase] += seconds
+        self.counts[phase] += 1
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        metrics = [f"{phase.replace('_', '-')};dur={seconds * 1000:.3f}" for phase, seconds in self.timings.items()]
+        metrics.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.3f}")
+        return ", ".join(metrics)
+
+    def report(self) -> Dict[str, Any]:
+        report: Dict[str, Any] = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "total_ms": self.total * 1000,
+            "timings_ms": {phase: seconds * 1000 for phase, seconds in self.timings.items()},
+            "counts": dict(self.counts),
+        }
+        if self.sampler is not None:
+            report["sample_interval_ms"] = self.sampler.interval * 1000
+            report["stacks"] = [
+                {"stack": stack, "samples": samples}
+                for stack, samples in self.sampler.stacks.most_common(settings.PROFILING_TOP_STACKS)
+            ]
+        return report
+
+
+current_profile: ContextVar[Optional[Profile]] = ContextVar("current_profile", default=None)
+profile_reports = LRUCache(settings.PROFILING_REPORTS, settings.PROFILING_REPORTS_TTL)
+
+
+def profiled(phase: str) -> Callable[[F], F]:
+    """Adds duration of the decorated function to the phase of the profiled request"""
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            profile = current_profile.get()
+            if profile is None:
+                return func(*args, **kwargs)
+
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.add(phase, time.perf_counter() - started_at)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def before_execute(conn: Any, *args: Any) -> None:
+    if current_profile.get() is not None:
+        conn.info["profile_compile_started_at"] = time.perf_counter()
+
+
+def before_cursor_execute(
+    conn: Any, cursor: Any, statement: Any, parameters: Any, context: Any, executemany: bool
+) -> None:
+    profile = current_profile.get()
+    if profile is None:
+        return
+
+    now = time.perf_counter()
+    compile_started_at = conn.info.pop("profile_compile_started_at", None)
+    if compile_started_at is not None:
+        profile.add("sql_compile", now - compile_started_at)
+    context.profile_execute_started_at = now
+
+
+def after_cursor_execute(
+    conn: Any, cursor: Any, statement: Any, parameters: Any, context: Any, executemany: bool
+) -> None:
+    profile = current_profile.get()
+    started_at = getattr(context, "profile_execute_started_at", None)
+    if profile is not None and started_at is not None:
+        profile.add("sql_execute", time.perf_counter() - started_at)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Records SQL compile time (statement construction to cursor execute, including the compiled cache lookup
+    and parameters processing) and execute time (database round trip with fetching of buffered rows).
+    """
+    for name, listener in [
+        ("before_execute", before_execute),
+        ("before_cursor_execute", before_cursor_execute),
+        ("after_cursor_execute", after_cursor_execute),
+    ]:
+        if not event.contains(engine.sync_engine, name, listener):
+            event.listen(engine.sync_engine, name, listener)
+
+
+def instrument_responses(*response_classes: Type[Response]) -> None:
+    """
+    Records render time of the response classes in the serialize phase. Views create them in the endpoint,
+    so the route doesn't see their rendering after the endpoint returned.
+    """
+    for response_class in response_classes:
+        if not hasattr(response_class.render, "__wrapped__"):
+            setattr(response_class, "render", profiled("serialize")(response_class.render))
+
+
+class ProfilingRoute(APIRoute):
+    """
+    Records endpoint time and serialization time (response_model validation, encoding and rendering after
+    the endpoint returned, and rendering of instrumented responses inside it) of profiled requests.
+    Without PROFILING_ENABLED it's a plain APIRoute.
+    """
+
+    def get_route_handler(self) -> Callable:
+        if not settings.PROFILING_ENABLED or not asyncio.iscoroutinefunction(self.dependant.call):
+            return super().get_route_handler()
+
+        endpoint = self.dependant.call
+
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args: Any, **kwargs: Any) -> Any:
+            profile = current_profile.get()
+            serialized = profile.timings.get("serialize", 0.0) if profile is not None else 0.0
+            started_at = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                if profile is not None:
+                    profile.endpoint_finished_at = time.perf_counter()
+                    # Responses rendered by the endpoint are counted in serialize only
+                    serialized = profile.timings.get("serialize", 0.0) - serialized
+                    profile.add("endpoint", profile.endpoint_finished_at - started_at - serialized)
+
+        self.dependant.call = timed_endpoint
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Any) -> Any:
+            response = await handler(request)
+            profile = current_profile.get()
+            if profile is not None and profile.endpoint_finished_at is not None:
+                profile.add("serialize", time.perf_counter() - profile.endpoint_finished_at)
+            return response
+
+        return timed_handler
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests with the PROFILING_HEADER header, its value "stacks" adds a sampled stack profile.
+    The time breakdown is returned in the Server-Timing header and the full report is kept
+    for GET /profilez/{X-Profile-Id}. The middleware is installed only with PROFILING_ENABLED.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        header = Headers(scope=scope).get(settings.PROFILING_HEADER) if scope["type"] == "http" else None
+        if header is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"], sample_stacks=header == SAMPLE_STACKS)
+        token = current_profile.set(profile)
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", profile.server_timing())
+                headers.append("X-Profile-Id", profile.id)
+            await send(message)
+
+        if profile.sampler is not None:
+            profile.sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.total = time.perf_counter() - profile.started_at
+            if profile.sampler is not None:
+                profile.sampler.stop()
+            current_profile.reset(token)
+            profile_reports.set(profile.id, profile.report())
@@ -0,0 +1,178 @@
+import array
+import datetime
+import decimal
+import hashlib
+import json
+import struct
+import sys
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import orjson
+from fastapi import Request, status
+from fastapi.responses import ORJSONResponse, Response
+from pydantic.json import decimal_encoder
+
+from financial.utils import utcnow
+
+
+# orjson and json format floats the same way only within this range, e.g. 1e-05 is rendered by orjson as 1e-5
+SAME_FLOAT_FORMAT_RANGE = (1e-4, 1e16)
+
+COLUMNAR_MAGIC = b"FDC1"
+COLUMNAR_ALIGNMENT = 8
+# Column types of the columnar format and their array module typecodes, all little-endian
+COLUMNAR_TYPES = {"uint16": "H", "int32": "i", "int64": "q", "float64": "d"}
+
+
+def encode_default(value: Any) -> Any:
+    """Encodes values the same way as jsonable_encoder does"""
+    if isinstance(value, decimal.Decimal):
+        return decimal_encoder(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(ORJSONResponse):
+    """
+    Renders plain content (dicts, lists, str, int, date and Decimal values) with orjson.
+    Views return it to skip response_model validation and jsonable_encoder for large responses.
+
+    Output is byte to byte the same as of JSONResponse with jsonable_encoder: decimals are encoded the same way
+    as pydantic does (int without fractional digits, otherwise float) and dates in isoformat.
+    Content with floats orjson would format differently is rendered by the standard json module.
+    """
+
+    def render(self, content: Any) -> bytes:
+        fallback: List[Any] = []
+
+        def default(value: Any) -> Any:
+            result = encode_default(value)
+            if (
+                isinstance(result, float)
+                and result
+                and not SAME_FLOAT_FORMAT_RANGE[0] <= abs(result) < SAME_FLOAT_FORMAT_RANGE[1]
+            ):
+                fallback.append(result)
+                raise TypeError("Float is formatted differently by orjson")
+            return result
+
+        try:
+            return orjson.dumps(content, default=default)
+        except TypeError:
+            if not fallback:
+                raise
+
+        return json.dumps(
+            content, default=encode_default, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+
+
+def pad(data: bytes, fill: bytes = b"\0") -> bytes:
+    return data + fill * (-len(data) % COLUMNAR_ALIGNMENT)
+
+
+class ColumnarResponse(Response):
+    """
+    Renders columns of fixed size numbers as a packed binary payload, so clients load every column
+    without parsing (e.g. numpy.frombuffer). Content is {"columns": {name: (type, values)}, ...metadata}.
+
+    Layout, all numbers are little-endian:
+    - 4 bytes magic FDC1, uint32 length of the header
+    - header: JSON metadata with "rows" count and "columns" list of {"name", "type", "offset"},
+      padded with spaces to 8 bytes
+    - column arrays, every one starts at its offset from the end of the header and is padded to 8 bytes
+
+    Types: uint16, int32, int64, float64.
+    """
+
+    media_type = "application/vnd.financial.columnar"
+
+    def render(self, content: Any) -> bytes:
+        columns: Dict[str, Tuple[str, Sequence[Any]]] = content.pop("columns")
+        header: Dict[str, Any] = {"rows": 0, "columns": [], **content}
+        data = []
+        offset = 0
+
+        for name, (type_name, values) in columns.items():
+            values_array = array.array(COLUMNAR_TYPES[type_name], values)
+            if sys.byteorder == "big":
+                values_array.byteswap()
+
+            header["rows"] = len(values_array)
+            header["columns"].append({"name": name, "type": type_name, "offset": offset})
+            data.append(pad(values_array.tobytes()))
+            offset += len(data[-1])
+
+        # The magic and the length take 8 bytes, so the padded header keeps columns aligned
+        header_bytes = pad(orjson.dumps(header, default=encode_default), fill=b" ")
+        return b"".join([COLUMNAR_MAGIC, struct.pack("<I", len(header_bytes)), header_bytes, *data])
+
+
+def decode_columnar(body: bytes) -> Tuple[Dict[str, Any], Dict[str, List[Any]]]:
+    """Reads ColumnarResponse body. Returns the header and lists of column values."""
+    if body[:4] != COLUMNAR_MAGIC:
+        raise ValueError("not a columnar payload")
+
+    (header_length,) = struct.unpack_from("<I", body, 4)
+    header = json.loads(body[8 : 8 + header_length])
+    data = memoryview(body)[8 + header_length :]
+
+    columns = {}
+    for column in header["columns"]:
+        values_array = array.array(COLUMNAR_TYPES[column["type"]])
+        start = column["offset"]
+        values_array.frombytes(data[start : start + header["rows"] * values_array.itemsize])
+        if sys.byteorder == "big":
+            values_array.byteswap()
+        columns[column["name"]] = values_array.tolist()
+
+    return header, columns
+
+
+class Validators:
+    """
+    Conditional GET validators of a response derived from the version of its data: ETag is the version
+    and a digest of the variant (everything else the body depends on, e.g. query parameters), Last-Modified
+    is the time of the version. Views check them before running their queries and answer 304 Not Modified.
+
+    HTTP dates have second precision, so Last-Modified is sent only once the second of the version has passed:
+    a later change gets a later Last-Modified, while a client holding a response of the same second would
+    get 304 Not Modified for stale data.
+    """
+
+    def __init__(self, version: int, modified_at: Optional[datetime.datetime], variant: Any) -> None:
+        digest = hashlib.blake2b(repr(variant).encode(), digest_size=8).hexdigest()
+        self.etag = f'"{version}-{digest}"'
+        self.last_modified: Optional[datetime.datetime] = None
+        if modified_at is not None and utcnow() - modified_at.replace(microsecond=0) >= datetime.timedelta(seconds=1):
+            self.last_modified = modified_at.replace(microsecond=0)
+
+    def headers(self) -> Dict[str, str]:
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache"}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(self.last_modified, usegmt=True)
+        return headers
+
+    def is_not_modified(self, request: Request) -> bool:
+        """
+        If-None-Match is compared with the weak comparison and takes precedence over If-Modified-Since.
+        """
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [
+                tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip() for tag in if_none_match.split(",")
+            ]
+            return "*" in tags or self.etag in tags
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is None or self.last_modified is None:
+            return False
+        try:
+            return self.last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    def not_modified(self) -> Response:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=self.headers())
@@ -0,0 +1,174 @@
+import asyncio
+import datetime
+import logging
+import time
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import asyncpg
+
+from financial.config import settings
+from financial.metrics import INGESTION_DURATION, INGESTION_LAST_RUN, INGESTION_LEADER
+from financial.utils import utcnow
+
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionScheduler:
+    """
+    Runs ingestion periodically in exactly one of the app processes (uvicorn workers, pods).
+
+    Processes compete for the session level advisory lock lock_id on a dedicated connection. The holder is
+    the leader and runs ingestion every interval seconds, others retry to take the lock every retry seconds.
+    Postgres releases the lock when the leader's connection is closed, so another process takes over
+    when the leader stops or goes down. The leader watches its connection during runs and between them
+    (termination listener plus a check every check_interval seconds) and cancels the running ingestion
+    when the connection is lost, so two processes never run ingestion on schedule at once.
+    """
+
+    def __init__(
+        self,
+        ingest: Callable[[], Awaitable[Any]],
+        lock_id: int,
+        interval: float,
+        retry: float,
+        check_interval: float,
+        check_timeout: float,
+    ) -> None:
+        self.ingest = ingest
+        self.lock_id = lock_id
+        self.interval = interval
+        self.retry = retry
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.is_leader = False
+        self.runs = 0
+        self.last_started_at: Optional[datetime.datetime] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                connection = await asyncpg.connect(**settings.DB_CONNECT_PARAMS)
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error("Ingestion scheduler can't connect to database: %s", e)
+            else:
+                try:
+                    if await connection.fetchval("SELECT pg_try_advisory_lock($1)", self.lock_id):
+                        await self.lead(connection)
+                except (OSError, asyncpg.PostgresError) as e:
+                    logger.error("Ingestion scheduler lost database connection: %s", e)
+                finally:
+                    self.set_leader(False)
+                    await connection.close()
+
+            await asyncio.sleep(self.retry)
+
+    async def lead(self, connection: asyncpg.Connection) -> None:
+        """Runs ingestion on schedule while the connection holding the lock is alive"""
+        self.set_leader(True)
+        logger.info("Ingestion scheduler is the leader, ingestion runs every %s seconds", self.interval)
+        schedule = asyncio.create_task(self.run_on_schedule())
+        try:
+            await self.watch(connection)
+            logger.error("Ingestion scheduler lost the lock connection, ingestion is stopped")
+        finally:
+            schedule.cancel()
+            with suppress(asyncio.CancelledError):
+                await schedule
+
+    async def run_on_schedule(self) -> None:
+        while True:
+            started_at = time.monotonic()
+            await self.run_once()
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started_at)))
+
+    async def watch(self, connection: asyncpg.Connection) -> None:
+        """Returns when the connection holding the lock is lost"""
+        lost = asyncio.Event()
+        connection.add_termination_listener(lambda _: lost.set())
+        while not lost.is_set():
+            try:
+                await asyncio.wait_for(connection.fetchval("SELECT 1"), self.check_timeout)
+            except (asyncio.TimeoutError, OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                return
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(lost.wait(), self.check_interval)
+
+    async def run_once(self) -> None:
+        self.runs += 1
+        self.last_started_at = utcnow()
+        INGESTION_LAST_RUN.set(self.last_started_at.timestamp())
+        started_at = time.perf_counter()
+        try:
+            await self.ingest()
+            self.last_error = None
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception("Scheduled ingestion failed")
+            self.last_error = str(e) or type(e).__name__
+        finally:
+            self.last_duration = time.perf_counter() - started_at
+            INGESTION_DURATION.observe(self.last_duration)
+
+    def set_leader(self, is_leader: bool) -> None:
+        self.is_leader = is_leader
+        INGESTION_LEADER.set(int(is_leader))
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.INGESTION_ENABLED,
+            "leader": self.is_leader,
+            "interval": self.interval,
+            "runs": self.runs,
+            "last_started_at": self.last_started_at,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+        }
+
+
+class ScheduledIngestion:
+    """
+    Ingestion run by the scheduler. Runs share the alphavantage rate limiter, so the daily quota
+    is spent over all runs of the process rather than anew every run.
+    """
+
+    def __init__(self) -> None:
+        self.limiter: Any = None
+
+    async def __call__(self) -> None:
+        # Imported on the first run, processes without scheduled ingestion don't load the alphavantage client
+        # pylint: disable=import-outside-toplevel
+        from financial.apps.financial.alphavantage import RateLimiter
+        from financial.apps.financial.ingestion import fill_financial_data
+
+        if self.limiter is None:
+            self.limiter = RateLimiter(
+                settings.ALPHAVANTAGE_REQUESTS_PER_MINUTE, settings.ALPHAVANTAGE_REQUESTS_PER_DAY
+            )
+        await fill_financial_data(self.limiter)
+
+
+ingestion_scheduler = IngestionScheduler(
+    ScheduledIngestion(),
+    settings.INGESTION_LOCK_ID,
+    settings.INGESTION_INTERVAL,
+    settings.INGESTION_LOCK_RETRY,
+    settings.INGESTION_LOCK_CHECK_INTERVAL,
+    settings.INGESTION_LOCK_CHECK_TIMEOUT,
+)
+scheduler_task: Optional["asyncio.Task[None]"] = None
+
+
+async def start_ingestion_scheduler() -> None:
+    global scheduler_task  # pylint: disable=global-statement
+    if settings.INGESTION_ENABLED:
+        scheduler_task = asyncio.create_task(ingestion_scheduler.run())
+
+
+async def stop_ingestion_scheduler() -> None:
+    if scheduler_task is not None:
+        scheduler_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await scheduler_task
@@ -1,6 +1,18 @@
 import datetime
+import itertools
+from typing import Iterable, Iterator, List, TypeVar
+
+
+T = TypeVar("T")
 
 
 def utcnow() -> datetime.datetime:
     """Returns current date and time in UTC with tz set."""
     return datetime.datetime.now(datetime.timezone.utc)
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Splits iterable into lists of the given size. The last list may be shorter."""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
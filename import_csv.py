@@ -0,0 +1,249 @@
+"""
+Imports daily history from vendor CSV files into financial_data:
+
+    python import_csv.py dumps/*.csv.gz --jobs 4
+
+Every file must have a header with date (or timestamp), open, close and volume columns, other columns
+are ignored. Files without a symbol (or ticker) column hold a single symbol, it's taken from --symbol
+or the file name (ibm.csv.gz is IBM). Files may be gzip-compressed.
+
+Raw file contents are streamed with COPY into a temporary table and merged into financial_data
+with a single INSERT ... SELECT ... ON CONFLICT, so rows are converted and validated by Postgres.
+Every file is imported in its own transaction: a file with a bad row is not imported at all.
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from financial.apps.financial import models
+from financial.config import settings
+from financial.db import async_session
+
+
+# Accepted header names of every financial_data column, symbol is optional
+COLUMN_ALIASES = {
+    "symbol": ("symbol", "ticker"),
+    "date": ("date", "timestamp"),
+    "open_price": ("open", "open_price"),
+    "close_price": ("close", "close_price"),
+    "volume": ("volume",),
+}
+GZIP_MAGIC = b"\x1f\x8b"
+
+logger = logging.getLogger(__name__)
+
+
+class Progress:
+    """Logs imported bytes of all files at most once per interval seconds"""
+
+    def __init__(self, total_bytes: int, interval: float) -> None:
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.bytes = 0
+        self.rows = 0
+        self.started_at = time.monotonic()
+        self.logged_at = self.started_at
+
+    def add(self, size: int = 0, rows: int = 0) -> None:
+        self.bytes += size
+        self.rows += rows
+        now = time.monotonic()
+        if now - self.logged_at >= self.interval:
+            self.logged_at = now
+            self.log()
+
+    def log(self) -> None:
+        elapsed = time.monotonic() - self.started_at
+        logger.info(
+            "Imported %.1f%% of %.1f MB, %s rows, %.0f rows/min",
+            self.bytes * 100 / (self.total_bytes or 1),
+            self.total_bytes / 2**20,
+            self.rows,
+            self.rows * 60 / (elapsed or 1),
+        )
+
+
+def open_file(path: str) -> Tuple[BinaryIO, BinaryIO]:
+    """Returns the file to read data from, decompressed if it's gzipped, and the raw file to track progress"""
+    raw = open(path, "rb")  # pylint: disable=consider-using-with
+    if raw.read(2) == GZIP_MAGIC:
+        raw.seek(0)
+        return gzip.GzipFile(fileobj=raw), raw  # type: ignore
+
+    raw.seek(0)
+    return raw, raw
+
+
+def symbol_from_path(path: str) -> str:
+    name = os.path.basename(path)
+    for extension in (".gz", ".csv"):
+        if name.lower().endswith(extension):
+            name = name[: -len(extension)]
+    return name.upper()
+
+
+def map_columns(header: Sequence[str]) -> Dict[str, Optional[int]]:
+    """Returns positions of financial_data columns in the header. Raises ValueError if a column is missing."""
+    names = [name.strip().lower() for name in header]
+    positions: Dict[str, Optional[int]] = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        positions[column] = next((names.index(alias) for alias in aliases if alias in names), None)
+        if positions[column] is None and column != "symbol":
+            raise ValueError(f"column {column} is missing, expected one of: {', '.join(aliases)}")
+    return positions
+
+
+async def iter_chunks(file: BinaryIO, raw: BinaryIO, progress: Progress, chunk_size: int) -> AsyncIterator[bytes]:
+    """Reads (and decompresses) the file in a thread, so parallel files don't block each other"""
+    loop = asyncio.get_running_loop()
+    position = raw.tell()
+    while chunk := await loop.run_in_executor(None, file.read, chunk_size):
+        progress.add(size=raw.tell() - position)
+        position = raw.tell()
+        yield chunk
+
+
+async def ensure_partitions(lock: asyncio.Lock, first_year: int, last_year: int) -> None:
+    """
+    Creates partitions in a separate transaction, one file at a time: partition DDL locks financial_data
+    until commit and concurrent creation of the same partition fails.
+    """
+    async with lock, async_session() as session:
+        created = await models.FinancialData.ensure_partitions(session, first_year, last_year)
+        await session.commit()
+
+    if created:
+        logger.info("Created financial data partitions: %s", ", ".join(created))
+
+
+async def import_file(
+    session: AsyncSession,
+    path: str,
+    symbol: Optional[str],
+    progress: Progress,
+    chunk_size: int,
+    partitions_lock: asyncio.Lock,
+) -> Tuple[int, int]:
+    """Imports the file in the session transaction. Returns the number of rows in the file and written rows."""
+    file, raw = open_file(path)
+    with file, raw:
+        header_line = file.readline().decode("utf-8-sig").strip()
+        positions = map_columns(header_line.split(","))
+
+        # Staging table has a text column for every column of the file
+        staging = sa.Table(
+            f"import_{uuid.uuid4().hex}",
+            sa.MetaData(),
+            *[sa.Column(f"c{i}", sa.Text) for i in range(header_line.count(",") + 1)],
+            prefixes=["TEMPORARY"],
+            postgresql_on_commit="DROP",
+        )
+        connection = await session.connection()
+        await connection.run_sync(staging.create)
+        raw_connection = await connection.get_raw_connection()
+        status = await raw_connection.driver_connection.copy_to_table(
+            staging.name, source=iter_chunks(file, raw, progress, chunk_size), format="csv"
+        )
+        rows = int(status.split()[-1])
+
+    def column(name: str) -> sa.sql.ColumnElement:
+        position = positions[name]
+        if position is None:
+            return sa.literal(symbol or symbol_from_path(path), sa.String)
+        return sa.func.trim(staging.c[f"c{position}"])
+
+    price_type = models.FinancialData.open_price.type
+    values = (
+        sa.select(
+            sa.func.upper(column("symbol")).label("symbol"),
+            sa.cast(column("date"), sa.Date).label("date"),
+            price_type.from_numeric(sa.cast(column("open_price"), sa.Numeric)).label("open_price"),
+            price_type.from_numeric(sa.cast(column("close_price"), sa.Numeric)).label("close_price"),
+            sa.cast(column("volume"), sa.BigInteger).label("volume"),
+            sa.literal_column("ctid").label("position"),
+        )
+        .select_from(staging)
+        .subquery()
+    )
+
+    # Rows of every symbol start from its first day in the file, partitions must exist before the merge
+    days = await session.execute(
+        sa.select(values.c.symbol, sa.func.min(values.c.date), sa.func.max(values.c.date)).group_by(values.c.symbol)
+    )
+    first_days, last_days = {}, []
+    for day_symbol, first_day, last_day in days:
+        first_days[day_symbol] = first_day
+        last_days.append(last_day)
+    if not first_days:
+        return rows, 0
+    await ensure_partitions(partitions_lock, min(first_days.values()).year, max(last_days).year)
+
+    # The last row of a day wins if the file has duplicates
+    columns = ["symbol", "date", "open_price", "close_price", "volume"]
+    deduplicated = (
+        sa.select(*[values.c[name] for name in columns])
+        .distinct(values.c.symbol, values.c.date)
+        .order_by(values.c.symbol, values.c.date, values.c.position.desc())
+    )
+    written = await models.FinancialData.insert_or_update_from_select(session, columns, deduplicated)
+
+    for day_symbol, first_day in first_days.items():
+        await models.FinancialDataCumulative.refresh(session, day_symbol, first_day)
+    await models.FinancialData.notify_changed(session, first_days)
+    progress.add(rows=rows)
+    return rows, written
+
+
+async def import_files(paths: List[str], symbol: Optional[str], jobs: int, chunk_size: int) -> Tuple[int, int]:
+    """Imports files, up to jobs files at once. Returns the number of files that failed and of written rows."""
+    # Every job holds a pooled session for its file and ensure_partitions takes one more, so jobs leave it a connection
+    jobs = max(1, min(jobs, settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW - 1))
+    progress = Progress(sum(os.path.getsize(path) for path in paths), settings.IMPORT_PROGRESS_INTERVAL)
+    semaphore = asyncio.Semaphore(jobs)
+    partitions_lock = asyncio.Lock()
+    failed = written = 0
+
+    async def import_one(path: str) -> None:
+        nonlocal failed, written
+        async with semaphore:
+            try:
+                async with async_session() as session:
+                    rows, file_written = await import_file(session, path, symbol, progress, chunk_size, partitions_lock)
+                    await session.commit()
+            except (OSError, ValueError, UnicodeDecodeError, sa.exc.SQLAlchemyError) as e:
+                failed += 1
+                logger.error("File %s is not imported: %s", path, e)
+                return
+
+        written += file_written
+        logger.info("File %s: %s rows, %s rows written", path, rows, file_written)
+
+    await asyncio.gather(*[import_one(path) for path in paths])
+    progress.log()
+    return failed, written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="CSV files, optionally gzip-compressed")
+    parser.add_argument("--symbol", help="symbol of files without a symbol column, the file name by default")
+    parser.add_argument("--jobs", type=int, default=settings.IMPORT_JOBS, help="files imported at once")
+    parser.add_argument("--chunk-size", type=int, default=settings.IMPORT_CHUNK_SIZE, help="bytes read at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=settings.LOG_LEVEL, format="%(asctime)s %(levelname)s %(message)s")
+    # Every job holds a database connection
+    failed, _ = asyncio.run(import_files(args.paths, args.symbol, args.jobs, args.chunk_size))
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
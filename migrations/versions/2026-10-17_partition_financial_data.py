@@ -0,0 +1,65 @@
+"""partition financial_data
+
+Revision ID: 3c1f7a9e52d4
+Revises: bd685393a834
+Create Date: 2026-10-17 14:03:27.815462
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f7a9e52d4'
+down_revision = 'bd685393a834'
+branch_labels = None
+depends_on = None
+
+# Alphavantage daily history starts in 1999, next year partition is created in advance.
+# Later partitions are created by ingestion, see FinancialData.ensure_partitions.
+FIRST_YEAR = 1999
+AHEAD_YEARS = 1
+
+
+def create_financial_data(**kwargs):
+    op.create_table('financial_data',
+    sa.Column('symbol', sa.String(length=5), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('open_price', sa.DECIMAL(), nullable=False),
+    sa.Column('close_price', sa.DECIMAL(), nullable=False),
+    sa.Column('volume', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('symbol', 'date'),
+    **kwargs
+    )
+
+
+def upgrade():
+    op.rename_table('financial_data', 'financial_data_unpartitioned')
+    op.execute('ALTER INDEX financial_data_pkey RENAME TO financial_data_unpartitioned_pkey')
+    create_financial_data(postgresql_partition_by='RANGE (date)')
+
+    first_year, last_year = op.get_bind().execute(sa.text(
+        'SELECT CAST(extract(year FROM min(date)) AS integer), CAST(extract(year FROM max(date)) AS integer) '
+        'FROM financial_data_unpartitioned'
+    )).one()
+    first_year = min(first_year or FIRST_YEAR, FIRST_YEAR)
+    last_year = max(last_year or 0, datetime.date.today().year + AHEAD_YEARS)
+    for year in range(first_year, last_year + 1):
+        op.execute(
+            f"CREATE TABLE financial_data_y{year} PARTITION OF financial_data "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        )
+
+    op.execute('INSERT INTO financial_data SELECT symbol, date, open_price, close_price, volume FROM financial_data_unpartitioned')
+    op.drop_table('financial_data_unpartitioned')
+
+
+def downgrade():
+    op.rename_table('financial_data', 'financial_data_partitioned')
+    op.execute('ALTER INDEX financial_data_pkey RENAME TO financial_data_partitioned_pkey')
+    create_financial_data()
+    op.execute('INSERT INTO financial_data SELECT symbol, date, open_price, close_price, volume FROM financial_data_partitioned')
+    # Partitions are dropped with the partitioned table
+    op.drop_table('financial_data_partitioned')
@@ -0,0 +1,48 @@
+"""scaled prices
+
+Revision ID: 8a4f0c6e2b17
+Revises: 5e8b2d1c7a90
+Create Date: 2026-10-17 21:12:44.508193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4f0c6e2b17'
+down_revision = '5e8b2d1c7a90'
+branch_labels = None
+depends_on = None
+
+# Prices are stored as BIGINT number of 10^-4 units, see ScaledDecimal
+SCALE = 4
+
+
+def upgrade():
+    # Both columns are rewritten at once, ALTER TYPE rewrites every partition.
+    # numeric * integer and numeric round() round half away from zero, the same way as ScaledDecimal
+    op.execute(f"""
+        ALTER TABLE financial_data
+        ALTER COLUMN open_price TYPE bigint USING round(open_price * {10 ** SCALE})::bigint,
+        ALTER COLUMN close_price TYPE bigint USING round(close_price * {10 ** SCALE})::bigint
+    """)
+    # Running totals are recalculated from the stored prices, so they agree with aggregates of the rows
+    op.execute("DELETE FROM financial_data_cumulative")
+    op.execute(f"""
+        INSERT INTO financial_data_cumulative (symbol, date, open_price_sum, close_price_sum, volume_sum, count)
+        SELECT symbol, date, sum(open_price) OVER w * 1e-{SCALE}, sum(close_price) OVER w * 1e-{SCALE},
+            sum(volume) OVER w, count(*) OVER w
+        FROM financial_data
+        WINDOW w AS (PARTITION BY symbol ORDER BY date)
+    """)
+    op.create_index('ix_financial_data_date_brin', 'financial_data', ['date'], unique=False, postgresql_using='brin')
+
+
+def downgrade():
+    op.drop_index('ix_financial_data_date_brin', table_name='financial_data', postgresql_using='brin')
+    op.execute(f"""
+        ALTER TABLE financial_data
+        ALTER COLUMN open_price TYPE numeric USING open_price * 1e-{SCALE},
+        ALTER COLUMN close_price TYPE numeric USING close_price * 1e-{SCALE}
+    """)
@@ -1,7 +1,11 @@
+import asyncio
+
 import pytest
 from fastapi import status
 from httpx import AsyncClient
 
+from financial import db
+
 
 pytestmark = pytest.mark.asyncio
 
@@ -18,3 +22,48 @@ async def test_readiness_probe(client: AsyncClient):
 
     assert response.status_code == status.HTTP_200_OK
     assert response.text == '"OK"'
+
+
+async def test_readiness_probe_warming_up(client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(db, "warm_up_task", asyncio.get_running_loop().create_future())
+
+    response = await client.get("/healthz")
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.json()["info"]["error"] == "Database pools are warming up"
+
+
+async def test_metrics(client: AsyncClient):
+    await client.get("/api/financial_data", params={"symbol": "IBM"})
+    response = await client.get("/metrics")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/financial_data",status="200"}' in text
+    assert 'db_query_duration_seconds_count{kind="paginate_count",pool="primary"}' in text
+    assert 'db_query_duration_seconds_count{kind="paginate_page",pool="primary"}' in text
+    assert 'db_pool_checkout_wait_seconds_count{pool="primary"}' in text
+    assert 'db_pool_connections_in_use{pool="primary"}' in text
+
+
+async def test_metrics_unmatched_route(client: AsyncClient):
+    await client.get("/no/such/route")
+    response = await client.get("/metrics")
+
+    assert 'http_request_duration_seconds_count{method="GET",route="unmatched",status="404"}' in response.text
+
+
+async def test_ingestion_probe(client: AsyncClient):
+    response = await client.get("/ingestionz")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "enabled": False,
+        "leader": False,
+        "interval": 300.0,
+        "runs": 0,
+        "last_started_at": None,
+        "last_duration": None,
+        "last_error": None,
+    }
@@ -1,15 +1,18 @@
 import asyncio
 
 import pytest
+import uvicorn
 from httpx import AsyncClient
 from sqlalchemy import event
 from sqlalchemy.engine import Transaction
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from financial.db import engine
-from financial.deps import get_db
+from financial.cache import stats_cache
+from financial.db import get_engine
+from financial.deps import get_db, get_read_db
 from financial.main import app
+from tests.stubs import AlphaVantageStub
 
 
 @pytest.fixture(scope="session")
@@ -21,7 +24,12 @@ def event_loop(request):
 
 @pytest.fixture(scope="session")
 def db_engine():
-    return engine
+    return get_engine()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    stats_cache.clear()
 
 
 @pytest.fixture
@@ -30,6 +38,7 @@ async def client(db: AsyncSession):
         return db
 
     app.dependency_overrides[get_db] = _get_db
+    app.dependency_overrides[get_read_db] = _get_db
     async with AsyncClient(app=app, base_url="http://test") as client:
         yield client
 
@@ -56,3 +65,19 @@ async def db(db_engine):
     if session.in_transaction():  # pylint: disable=no-member
         await transaction.rollback()
     await connection.close()
+
+
+@pytest.fixture
+async def alphavantage_stub():
+    stub = AlphaVantageStub()
+    server = uvicorn.Server(uvicorn.Config(stub.app, host="127.0.0.1", port=0, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    port = server.servers[0].sockets[0].getsockname()[1]
+    stub.url = f"http://127.0.0.1:{port}/query"
+    yield stub
+
+    server.should_exit = True
+    await task
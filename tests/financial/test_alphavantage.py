@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+from financial.apps.financial.alphavantage import AlphaVantageClient, AlphaVantageError, TokenBucket
+from tests.stubs import AlphaVantageStub
+
+
+pytestmark = pytest.mark.asyncio
+
+THROTTLED = {"Note": "Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute."}
+RATE_LIMITED = {"Information": "Thank you for using Alpha Vantage! Our standard API rate limit is 25 requests per day."}
+PREMIUM = {"Information": "Thank you for using Alpha Vantage! This is a premium endpoint."}
+HISTORY = {"Time Series (Daily)": {"2023-02-24": {"1. open": "10", "4. close": "11", "6. volume": "100"}}}
+
+
+@pytest.fixture
+def stub(alphavantage_stub: AlphaVantageStub):
+    alphavantage_stub.default_response = JSONResponse(HISTORY)
+    return alphavantage_stub
+
+
+def make_client(stub: AlphaVantageStub, **kwargs) -> AlphaVantageClient:
+    options = {"apikey": "test", "requests_per_minute": 6000, "requests_per_day": 100000, "backoff": 0.01}
+    options.update(kwargs)
+    return AlphaVantageClient(url=stub.url, **options)
+
+
+async def test_client_passes_params(stub: AlphaVantageStub):
+    async with make_client(stub) as client:
+        response = await client.get({"symbol": "IBM"})
+
+    assert response.json() == HISTORY
+    assert stub.requests == [{"symbol": "IBM", "apikey": "test"}]
+
+
+async def test_client_retries_throttled_requests(stub: AlphaVantageStub):
+    stub.responses = [JSONResponse(THROTTLED), JSONResponse({}, status_code=status.HTTP_429_TOO_MANY_REQUESTS)]
+
+    async with make_client(stub) as client:
+        response = await client.get({"symbol": "IBM"})
+
+    assert response.json() == HISTORY
+    assert len(stub.requests) == 3
+
+
+async def test_client_retries_rate_limit_information(stub: AlphaVantageStub):
+    stub.responses = [JSONResponse(RATE_LIMITED)]
+
+    async with make_client(stub) as client:
+        response = await client.get({"symbol": "IBM"})
+
+    assert response.json() == HISTORY
+    assert len(stub.requests) == 2
+
+
+async def test_client_does_not_retry_rejected_requests(stub: AlphaVantageStub):
+    stub.responses = [JSONResponse(PREMIUM)]
+
+    async with make_client(stub) as client:
+        with pytest.raises(AlphaVantageError, match="premium"):
+            await client.get({"symbol": "IBM"})
+
+    assert len(stub.requests) == 1
+
+
+async def test_client_gives_up_after_max_retries(stub: AlphaVantageStub):
+    stub.responses = [JSONResponse({}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE) for _ in range(3)]
+
+    async with make_client(stub, max_retries=1) as client:
+        response = await client.get({"symbol": "IBM"})
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert len(stub.requests) == 2
+
+
+async def test_client_limits_concurrency(stub: AlphaVantageStub):
+    stub.delay = 0.05
+
+    async with make_client(stub, concurrency=2) as client:
+        await asyncio.gather(*[client.get({"symbol": str(i)}) for i in range(6)])
+
+    assert len(stub.requests) == 6
+    assert stub.max_active == 2
+
+
+async def test_client_limits_rate(stub: AlphaVantageStub):
+    started_at = time.monotonic()
+
+    # 600 requests per minute is one request per 0.1 second
+    async with make_client(stub, requests_per_minute=600) as client:
+        await asyncio.gather(*[client.get({"symbol": str(i)}) for i in range(4)])
+
+    assert time.monotonic() - started_at >= 0.3
+
+
+async def test_token_bucket_burst():
+    bucket = TokenBucket(rate=10, capacity=3)
+    started_at = time.monotonic()
+
+    for _ in range(4):
+        await bucket.acquire()
+
+    elapsed = time.monotonic() - started_at
+    assert 0.08 <= elapsed < 0.5
@@ -0,0 +1,37 @@
+import math
+
+import pytest
+
+from financial.apps.financial import indicators
+
+
+CLOSES = [10.0, 11.0, 12.0, 11.0, 13.0]
+VOLUMES = [100, 200, 100, 0, 100]
+
+
+def test_sma():
+    assert indicators.sma(CLOSES, VOLUMES, 3) == [None, None, 11.0, pytest.approx(34 / 3), 12.0]
+    assert indicators.sma(CLOSES[:2], VOLUMES[:2], 3) == [None, None]
+
+
+def test_ema():
+    result = indicators.ema(CLOSES, VOLUMES, 3)
+
+    assert result[:3] == [None, None, 11.0]
+    assert result[3:] == [11.0, 12.0]
+
+
+def test_vwap():
+    result = indicators.vwap(CLOSES, VOLUMES, 2)
+
+    assert result == [None, pytest.approx(32 / 3), pytest.approx(34 / 3), 12.0, 13.0]
+    assert indicators.vwap([1.0, 2.0], [0, 0], 2) == [None, None]
+
+
+def test_volatility():
+    result = indicators.volatility(CLOSES, VOLUMES, 2)
+    returns = [math.log(close / previous) for previous, close in zip(CLOSES, CLOSES[1:])]
+
+    assert result[:2] == [None, None]
+    assert result[2] == pytest.approx(abs(returns[0] - returns[1]) / math.sqrt(2))
+    assert len(result) == len(CLOSES)
@@ -0,0 +1,158 @@
+import datetime
+import decimal
+
+import pytest
+import sqlalchemy as sa
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.exc import SQLAlchemyError
+
+from financial.apps.financial import ingestion
+from financial.apps.financial.alphavantage import AlphaVantageClient, RateLimiter
+from financial.apps.financial.ingestion import get_output_size, get_start_date, iter_symbol_history_csv
+from financial.apps.financial.models import FinancialData, FinancialDataCumulative, FinancialDataVersion
+from financial.config import settings
+from financial.db import async_session
+from financial.utils import utcnow
+from tests.stubs import AlphaVantageStub
+
+
+TODAY = datetime.date(2023, 3, 1)
+CSV = (
+    "timestamp,open,high,low,close,adjusted_close,volume,dividend_amount,split_coefficient\r\n"
+    "2023-02-28,130.5700,130.9100,129.6200,129.3000,129.3000,5243378,0.0000,1.0\r\n"
+    "2023-02-27,130.0000,131.4000,129.7100,130.4900,130.4900,2761155,0.0000,1.0\r\n"
+    "2023-02-24,broken,130.2900,128.1000,130.5700,130.5700,3695452,0.0000,1.0\r\n"
+    "2023-02-23,131.0000,131.4200,129.7200,131.0000,131.0000,3456271,0.0000,1.0\r\n"
+    "2023-02-22,131.6700,132.1300,130.3500,131.3400,131.3400,4140421,0.0000,1.0\r\n"
+)
+# Ingestion commits, rows of the symbol are deleted after every test
+SYMBOL = "ZZIN1"
+
+
+@pytest.fixture
+async def ingestion_stub(alphavantage_stub: AlphaVantageStub, monkeypatch):
+    """Stub with the last ALPHAVANTAGE_LAST_DAYS days of SYMBOL, ingestion of only SYMBOL goes to it"""
+    monkeypatch.setattr(settings, "ALPHAVANTAGE_SYMBOLS", (SYMBOL,))
+    monkeypatch.setattr(settings, "ALPHAVANTAGE_URL", alphavantage_stub.url)
+    today = utcnow().date()
+    lines = ["timestamp,open,high,low,close,adjusted_close,volume,dividend_amount,split_coefficient"]
+    for days in range(settings.ALPHAVANTAGE_LAST_DAYS):
+        day = today - datetime.timedelta(days=days)
+        lines.append(f"{day},{100 + days}.1250,0,0,{101 + days}.5000,0,{1000 + days},0,1")
+    alphavantage_stub.default_response = Response("\r\n".join(lines), media_type="text/csv")
+    yield alphavantage_stub
+
+    async with async_session() as session:
+        for model in (FinancialData, FinancialDataCumulative, FinancialDataVersion):
+            await session.execute(sa.delete(model).where(model.symbol == SYMBOL))
+        await session.commit()
+
+
+async def run_ingestion() -> None:
+    await ingestion.fill_financial_data(RateLimiter(per_minute=60000, per_day=10000))
+
+
+async def get_ingested() -> tuple:
+    """Returns saved days of SYMBOL, totals of all of them by running totals and by the direct aggregate"""
+    today = utcnow().date()
+    start = today - datetime.timedelta(days=settings.ALPHAVANTAGE_LAST_DAYS)
+    async with async_session() as session:
+        days = (await session.execute(sa.select(FinancialData.date).where(FinancialData.symbol == SYMBOL))).scalars()
+        days = sorted(days)
+        stats = await FinancialDataCumulative.range_stats(session, SYMBOL, start, today)
+        expected = await FinancialData.count_stats(session, {"symbol": SYMBOL})
+    return days, dict(stats), dict(expected)
+
+
+def test_start_date_of_new_symbol():
+    assert get_start_date(None, TODAY) == datetime.date(2023, 2, 16)
+
+
+def test_start_date_is_last_saved_date():
+    assert get_start_date(datetime.date(2020, 5, 4), TODAY) == datetime.date(2020, 5, 4)
+
+
+def test_output_size():
+    assert get_output_size(datetime.date(2023, 2, 16), TODAY) == "compact"
+    assert get_output_size(TODAY - datetime.timedelta(days=99), TODAY) == "compact"
+    assert get_output_size(TODAY - datetime.timedelta(days=100), TODAY) == "full"
+
+
+@pytest.mark.asyncio
+async def test_iter_symbol_history_csv(alphavantage_stub: AlphaVantageStub, monkeypatch):
+    monkeypatch.setattr(settings, "DB_UPSERT_BATCH_SIZE", 2)
+    alphavantage_stub.default_response = Response(CSV, media_type="text/csv")
+
+    async with AlphaVantageClient(url=alphavantage_stub.url, apikey="test") as client:
+        batches = [batch async for batch in iter_symbol_history_csv(client, "IBM", datetime.date(2023, 2, 23))]
+
+    assert alphavantage_stub.requests[0]["datatype"] == "csv"
+    assert [[row["date"].isoformat() for row in batch] for batch in batches] == [
+        ["2023-02-28", "2023-02-27"],
+        ["2023-02-23"],
+    ]
+    assert batches[0][0] == {
+        "symbol": "IBM",
+        "date": datetime.date(2023, 2, 28),
+        "open_price": decimal.Decimal("130.5700"),
+        "close_price": decimal.Decimal("129.3000"),
+        "volume": 5243378,
+    }
+
+
+@pytest.mark.asyncio
+async def test_iter_symbol_history_csv_error_message(alphavantage_stub: AlphaVantageStub):
+    alphavantage_stub.default_response = JSONResponse({"Error Message": "Invalid API call."})
+
+    async with AlphaVantageClient(url=alphavantage_stub.url, apikey="test") as client:
+        batches = [batch async for batch in iter_symbol_history_csv(client, "IBM", datetime.date(2023, 2, 23))]
+
+    assert not batches
+
+
+@pytest.mark.asyncio
+async def test_failed_totals_are_saved_by_next_run(ingestion_stub: AlphaVantageStub, monkeypatch):
+    refresh = FinancialDataCumulative.refresh
+    failures = []
+
+    async def fail_once(session, symbol, since):
+        if not failures:
+            failures.append(symbol)
+            raise SQLAlchemyError("totals are not saved")
+        await refresh(session, symbol, since)
+
+    monkeypatch.setattr(FinancialDataCumulative, "refresh", fail_once)
+    await run_ingestion()
+    await run_ingestion()
+
+    days, stats, expected = await get_ingested()
+    assert failures and len(days) == settings.ALPHAVANTAGE_LAST_DAYS
+    assert stats == expected
+    assert expected["average_daily_volume"] == 1000 + decimal.Decimal(settings.ALPHAVANTAGE_LAST_DAYS - 1) / 2
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_collected_by_next_run(ingestion_stub: AlphaVantageStub, monkeypatch):
+    monkeypatch.setattr(settings, "DB_UPSERT_BATCH_SIZE", 4)
+    bulk_insert_or_update = FinancialData.bulk_insert_or_update
+    calls = []
+
+    async def fail_second_batch(session, rows):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise SQLAlchemyError("batch is not saved")
+        return await bulk_insert_or_update(session, rows)
+
+    monkeypatch.setattr(FinancialData, "bulk_insert_or_update", fail_second_batch)
+    await run_ingestion()
+
+    # Saving stops at the failed batch, newer days are not saved ahead of the missing ones.
+    # Batches are cut from the latest day, so the oldest one has the remaining ALPHAVANTAGE_LAST_DAYS % 4 days.
+    days, _, _ = await get_ingested()
+    first_day = utcnow().date() - datetime.timedelta(days=settings.ALPHAVANTAGE_LAST_DAYS - 1)
+    assert days == [first_day + datetime.timedelta(days=i) for i in range(settings.ALPHAVANTAGE_LAST_DAYS % 4)]
+
+    await run_ingestion()
+    days, stats, expected = await get_ingested()
+    assert len(days) == settings.ALPHAVANTAGE_LAST_DAYS
+    assert stats == expected
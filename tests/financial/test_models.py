@@ -0,0 +1,165 @@
+import datetime
+import decimal
+import random
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from financial.apps.financial.models import FinancialData, FinancialDataCumulative
+from financial.apps.financial.schemas import FinancialDataFilters
+
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_rows(symbol: str, days: int, price: str = "10.5000") -> list:
+    start = datetime.date(2022, 3, 1)
+    return [
+        {
+            "symbol": symbol,
+            "date": start + datetime.timedelta(days=i),
+            "open_price": decimal.Decimal(price),
+            "close_price": decimal.Decimal(price) + 1,
+            "volume": 100 + i,
+        }
+        for i in range(days)
+    ]
+
+
+async def test_bulk_insert_or_update(db: AsyncSession):
+    assert await FinancialData.bulk_insert_or_update(db, make_rows("TST", 10)) == 10
+    assert await FinancialData.bulk_insert_or_update(db, make_rows("TST", 12, price="11.0000")) == 12
+    # Unchanged rows are not rewritten
+    assert await FinancialData.bulk_insert_or_update(db, make_rows("TST", 12, price="11.0000")) == 0
+
+    rows = (await db.execute(sa.select(FinancialData).where(FinancialData.symbol == "TST"))).scalars().all()
+    assert len(rows) == 12
+    assert {row.open_price for row in rows} == {decimal.Decimal("11.0000")}
+
+
+async def test_bulk_insert_or_update_empty(db: AsyncSession):
+    assert await FinancialData.bulk_insert_or_update(db, []) == 0
+
+
+async def test_last_dates(db: AsyncSession):
+    await FinancialData.bulk_insert_or_update(db, make_rows("TST", 10) + make_rows("TST2", 3))
+
+    last_dates = await FinancialData.last_dates(db, ["TST", "TST2", "NEW"])
+
+    assert last_dates == {"TST": datetime.date(2022, 3, 10), "TST2": datetime.date(2022, 3, 3), "NEW": None}
+
+
+async def test_range_stats_equal_to_count_stats(db: AsyncSession):
+    rnd = random.Random(42)
+    start = datetime.date(2020, 1, 1)
+    rows = [
+        {
+            "symbol": "RND",
+            "date": start + datetime.timedelta(days=i),
+            "open_price": decimal.Decimal(rnd.randint(1, 10**7)).scaleb(-4),
+            "close_price": decimal.Decimal(rnd.randint(1, 10**7)).scaleb(-4),
+            "volume": rnd.randint(0, 10**9),
+        }
+        for i in range(500)
+        if rnd.random() < 0.7
+    ]
+    await FinancialData.bulk_insert_or_update(db, rows)
+    # Totals are built in two steps to check recalculation of the tail
+    await FinancialDataCumulative.refresh(db, "RND", start)
+    await FinancialDataCumulative.refresh(db, "RND", start + datetime.timedelta(days=250))
+
+    for _ in range(30):
+        start_date = start + datetime.timedelta(days=rnd.randint(-20, 500))
+        end_date = start_date + datetime.timedelta(days=rnd.randint(1, 500))
+        filters = {"symbol": "RND", "date__ge": start_date, "date__le": end_date}
+
+        expected = dict(await FinancialData.count_stats(db, filters))
+        result = await FinancialDataCumulative.range_stats(db, "RND", start_date, end_date)
+
+        # Compared as strings to check that numeric scale is the same too
+        assert {k: str(v) for k, v in result.items()} == {k: str(v) for k, v in expected.items()}
+
+
+async def test_range_stats_without_data(db: AsyncSession):
+    result = await FinancialDataCumulative.range_stats(db, "NONE", datetime.date(2020, 1, 1), datetime.date(2021, 1, 1))
+
+    assert result == {"average_daily_open_price": None, "average_daily_close_price": None, "average_daily_volume": None}
+
+
+async def test_ensure_partitions(db: AsyncSession):
+    assert await FinancialData.ensure_partitions(db, 2100, 2101) == ["financial_data_y2100", "financial_data_y2101"]
+    assert await FinancialData.ensure_partitions(db, 2099, 2101) == ["financial_data_y2099"]
+
+    await FinancialData.insert_or_update(
+        db,
+        ids={"symbol": "TST", "date": datetime.date(2100, 6, 1)},
+        values={"open_price": decimal.Decimal("1"), "close_price": decimal.Decimal("2"), "volume": 3},
+    )
+    db_execute = await db.execute(sa.text("SELECT count(*) FROM financial_data_y2100"))
+    assert db_execute.scalar() == 1
+
+
+async def test_prices_stored_as_scaled_integers(db: AsyncSession):
+    await FinancialData.insert_or_update(
+        db,
+        ids={"symbol": "TST", "date": datetime.date(2022, 3, 1)},
+        values={"open_price": decimal.Decimal("123.4567"), "close_price": decimal.Decimal("0.00005"), "volume": 3},
+    )
+
+    db_execute = await db.execute(sa.text("SELECT open_price, close_price FROM financial_data WHERE symbol = 'TST'"))
+    assert db_execute.one() == (1234567, 1)
+    row = (await db.execute(sa.select(FinancialData).where(FinancialData.symbol == "TST"))).scalar_one()
+    assert (row.open_price, row.close_price) == (decimal.Decimal("123.4567"), decimal.Decimal("0.0001"))
+    # Filters compare scaled values
+    db_execute = await db.execute(
+        sa.select(sa.func.count()).where(FinancialData.open_price > decimal.Decimal("123.4566"))
+    )
+    assert db_execute.scalar() == 1
+
+
+async def test_date_filters_prune_partitions(db: AsyncSession):
+    await FinancialData.ensure_partitions(db, 2021, 2023)
+    filters = FinancialDataFilters(symbol="IBM", start_date="2022-02-01", end_date="2022-03-01").make_filters()
+    query = sa.select(FinancialData).where(*FinancialData.build_filters(filters))
+    connection = await db.connection()
+    # Executed with bound parameters the same way as API queries
+    compiled = query.compile(dialect=connection.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+
+    db_execute = await connection.exec_driver_sql(f"EXPLAIN {compiled}", params)
+    plan = "\n".join(db_execute.scalars().all())
+
+    assert "financial_data_y2022" in plan
+    assert "financial_data_y2021" not in plan
+    assert "financial_data_y2023" not in plan
+
+
+async def test_resample(db: AsyncSession):
+    rows = make_rows("ZZRS", 70)
+    for i, row in enumerate(rows):
+        row["open_price"] += i
+        row["close_price"] += i
+    await FinancialData.bulk_insert_or_update(db, rows)
+
+    candles, count, pages = await FinancialData.resample(
+        db, {"symbol": "ZZRS", "date__le": datetime.date(2022, 5, 5)}, "month", page=1, per_page=2
+    )
+
+    assert (count, pages) == (3, 2)
+    march, april = [dict(candle._mapping) for candle in candles]
+    assert march == {
+        "symbol": "ZZRS",
+        "period": datetime.date(2022, 3, 1),
+        "start_date": datetime.date(2022, 3, 1),
+        "end_date": datetime.date(2022, 3, 31),
+        "open_price": decimal.Decimal("10.5000"),
+        "close_price": decimal.Decimal("41.5000"),
+        "volume": sum(range(100, 131)),
+        "days": 31,
+    }
+    assert april["open_price"] == decimal.Decimal("41.5000")
+
+    candles, _, _ = await FinancialData.resample(db, {"symbol": "ZZRS"}, "week", page=1, per_page=1)
+    # 2022-03-01 is Tuesday
+    assert candles[0].period == datetime.date(2022, 2, 28) and candles[0].days == 6
@@ -0,0 +1,385 @@
+import asyncio
+import datetime
+import decimal
+import json
+
+import pytest
+import sqlalchemy as sa
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from financial.apps.financial.models import FinancialData, FinancialDataCumulative, FinancialDataVersion
+from financial.cache import stats_cache
+from financial.config import settings
+from financial.responses import ColumnarResponse, decode_columnar
+
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def financial_data(db: AsyncSession):
+    start = datetime.date(2023, 1, 2)
+    objects = [
+        FinancialData(
+            symbol=symbol,
+            date=start + datetime.timedelta(days=i),
+            open_price=decimal.Decimal("100.1000") + i,
+            close_price=decimal.Decimal("101.2000") + i,
+            volume=1000 + i,
+        )
+        for symbol in ("AAPL", "IBM")
+        for i in range(7)
+    ]
+    db.add_all(objects)
+    await db.flush()
+    await FinancialDataCumulative.refresh(db, "AAPL", start)
+    await FinancialDataCumulative.refresh(db, "IBM", start)
+    return objects
+
+
+async def test_financial_data_offset_pagination(client: AsyncClient, financial_data):
+    response = await client.get("/api/financial_data", params={"symbol": "IBM", "page": 2, "limit": 3})
+
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert [row["date"] for row in body["data"]] == ["2023-01-05", "2023-01-06", "2023-01-07"]
+    assert body["pagination"] == {"count": 7, "page": 2, "limit": 3, "pages": 3, "next_cursor": None}
+
+
+async def test_financial_data_cursor_pagination(client: AsyncClient, financial_data):
+    rows = []
+    params = {"mode": "cursor", "limit": 4}
+
+    while True:
+        response = await client.get("/api/financial_data", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        body = response.json()
+        assert body["pagination"]["count"] is None
+        rows.extend((row["symbol"], row["date"]) for row in body["data"])
+
+        if body["pagination"]["next_cursor"] is None:
+            break
+        params = {"cursor": body["pagination"]["next_cursor"], "limit": 4}
+
+    expected = sorted((obj.symbol, obj.date.isoformat()) for obj in financial_data)
+    assert rows == expected
+
+
+async def test_financial_data_cursor_with_filters(client: AsyncClient, financial_data):
+    params = {"symbol": "AAPL", "start_date": "2023-01-03", "mode": "cursor", "limit": 5}
+    response = await client.get("/api/financial_data", params=params)
+    body = response.json()
+
+    assert [row["date"] for row in body["data"]] == [
+        "2023-01-03",
+        "2023-01-04",
+        "2023-01-05",
+        "2023-01-06",
+        "2023-01-07",
+    ]
+    assert body["pagination"]["next_cursor"]
+
+    params["cursor"] = body["pagination"]["next_cursor"]
+    response = await client.get("/api/financial_data", params=params)
+    body = response.json()
+
+    assert [row["date"] for row in body["data"]] == ["2023-01-08"]
+    assert body["pagination"]["next_cursor"] is None
+
+
+async def test_financial_data_invalid_cursor(client: AsyncClient):
+    response = await client.get("/api/financial_data", params={"cursor": "not-a-cursor"})
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response.json()["info"]["error"].startswith("cursor:")
+
+
+@pytest.mark.parametrize("mode", ["offset", "cursor"])
+async def test_financial_data_zero_limit(client: AsyncClient, mode: str):
+    response = await client.get("/api/financial_data", params={"mode": mode, "limit": 0})
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_statistics(client: AsyncClient, financial_data):
+    params = {"symbol": "IBM", "start_date": "2023-01-02", "end_date": "2023-01-04"}
+    response = await client.get("/api/statistics", params=params)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["data"] == {
+        "start_date": "2023-01-02",
+        "end_date": "2023-01-04",
+        "symbol": "IBM",
+        "average_daily_open_price": 101.1,
+        "average_daily_close_price": 102.2,
+        "average_daily_volume": 1001.0,
+    }
+
+
+async def test_statistics_cache(client: AsyncClient, db: AsyncSession, financial_data):
+    params = {"symbol": "IBM", "start_date": "2023-01-02", "end_date": "2023-01-04"}
+    await client.get("/api/statistics", params=params)
+
+    await db.execute(sa.update(FinancialData).where(FinancialData.symbol == "IBM").values(volume=0))
+    await FinancialDataCumulative.refresh(db, "IBM", datetime.date(2023, 1, 2))
+    cached = await client.get("/api/statistics", params=params)
+    stats_cache.invalidate("IBM")
+    fresh = await client.get("/api/statistics", params=params)
+
+    assert cached.json()["data"]["average_daily_volume"] == 1001.0
+    assert fresh.json()["data"]["average_daily_volume"] == 0.0
+    assert stats_cache.info()["hits"] == 1
+
+
+async def test_batch_statistics(client: AsyncClient, financial_data):
+    payload = {
+        "start_date": "2023-01-02",
+        "end_date": "2023-01-04",
+        "symbols": [
+            "IBM",
+            {"symbol": "AAPL", "start_date": "2023-01-07", "end_date": "2023-01-31"},
+            {"symbol": "IBM", "end_date": "2023-01-01"},
+            "NONE",
+        ],
+    }
+    response = await client.post("/api/statistics/batch", json=payload)
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()["data"]
+    assert [(item["symbol"], item["start_date"], item["end_date"], item["error"]) for item in data] == [
+        ("IBM", "2023-01-02", "2023-01-04", ""),
+        ("AAPL", "2023-01-07", "2023-01-31", ""),
+        ("IBM", "2023-01-02", "2023-01-01", "Field end_date must come after start_date"),
+        ("NONE", "2023-01-02", "2023-01-04", "No data for the symbol in the period"),
+    ]
+    assert [item["average_daily_volume"] for item in data] == [1001.0, 1005.5, None, None]
+
+
+async def test_batch_statistics_without_data(client: AsyncClient, financial_data):
+    payload = {"start_date": "2022-01-01", "end_date": "2022-12-31", "symbols": ["IBM", "UNKWN"]}
+    response = await client.post("/api/statistics/batch", json=payload)
+
+    assert response.status_code == status.HTTP_200_OK
+    for item in response.json()["data"]:
+        assert item["error"] == "No data for the symbol in the period"
+        assert item["average_daily_volume"] is None
+
+
+async def test_batch_statistics_requires_symbols(client: AsyncClient):
+    response = await client.post("/api/statistics/batch", json={"symbols": []})
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_export_ndjson(client: AsyncClient, financial_data):
+    response = await client.get("/api/financial_data/export", params={"symbol": "IBM", "end_date": "2023-01-03"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"symbol": "IBM", "date": "2023-01-02", "open_price": "100.1000", "close_price": "101.2000", "volume": 1000},
+        {"symbol": "IBM", "date": "2023-01-03", "open_price": "101.1000", "close_price": "102.2000", "volume": 1001},
+    ]
+
+
+async def test_export_csv(client: AsyncClient, financial_data, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_CHUNK_SIZE", 3)
+    response = await client.get("/api/financial_data/export", params={"format": "csv"})
+
+    assert response.status_code == status.HTTP_200_OK
+    lines = response.text.splitlines()
+    assert lines[0] == "symbol,date,open_price,close_price,volume"
+    assert lines[1] == "AAPL,2023-01-02,100.1000,101.2000,1000"
+    assert lines[-1] == "IBM,2023-01-08,106.1000,107.2000,1006"
+    assert len(lines) == len(financial_data) + 1
+
+
+async def test_financial_data_columnar(client: AsyncClient, financial_data):
+    params = {"start_date": "2023-01-07", "mode": "cursor", "limit": 3, "format": "columnar"}
+    response = await client.get("/api/financial_data", params=params)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == ColumnarResponse.media_type
+    header, columns = decode_columnar(response.content)
+    assert header["rows"] == 3
+    assert header["symbols"] == ["AAPL", "IBM"]
+    assert header["price_scale"] == 4
+    assert header["pagination"]["next_cursor"]
+    assert columns == {
+        "symbol": [0, 0, 1],
+        "date": [19364, 19365, 19364],
+        "open_price": [1051000, 1061000, 1051000],
+        "close_price": [1062000, 1072000, 1062000],
+        "volume": [1005, 1006, 1005],
+    }
+
+
+async def test_financial_data_columnar_by_accept_header(client: AsyncClient, financial_data):
+    params = {"symbol": "IBM", "limit": 100}
+    json_response = await client.get("/api/financial_data", params=params)
+    response = await client.get("/api/financial_data", params=params, headers={"Accept": ColumnarResponse.media_type})
+
+    header, columns = decode_columnar(response.content)
+    assert header["pagination"] == json_response.json()["pagination"]
+    assert [decimal.Decimal(price).scaleb(-header["price_scale"]) for price in columns["close_price"]] == [
+        decimal.Decimal(str(row["close_price"])) for row in json_response.json()["data"]
+    ]
+    assert len(response.content) < len(json_response.content)
+
+
+async def test_indicators(client: AsyncClient, financial_data):
+    params = {
+        "symbol": "IBM",
+        "start_date": "2023-01-04",
+        "end_date": "2023-01-08",
+        "indicators": ["sma_3", "ema_3", "vwap_2", "volatility_4"],
+    }
+    response = await client.get("/api/indicators", params=params)
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()["data"]
+    assert data["date"] == ["2023-01-04", "2023-01-05", "2023-01-06", "2023-01-07", "2023-01-08"]
+    assert data["close_price"] == [103.2, 104.2, 105.2, 106.2, 107.2]
+    # Days before start_date warm indicators up
+    assert data["indicators"]["sma_3"] == pytest.approx([102.2, 103.2, 104.2, 105.2, 106.2])
+    assert data["indicators"]["ema_3"] == pytest.approx([102.2, 103.2, 104.2, 105.2, 106.2])
+    assert data["indicators"]["vwap_2"][0] == pytest.approx((102.2 * 1001 + 103.2 * 1002) / 2003)
+    # There are only two returns before 2023-01-06
+    assert data["indicators"]["volatility_4"][:2] == [None, None]
+    assert data["indicators"]["volatility_4"][2] is not None
+
+
+async def test_indicators_validation(client: AsyncClient):
+    params = {"symbol": "IBM", "start_date": "2023-01-04", "end_date": "2023-01-08", "indicators": ["rsi_14"]}
+    response = await client.get("/api/indicators", params=params)
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response.json()["info"]["error"].startswith("indicators.0.kind")
+
+
+async def test_resample(client: AsyncClient, financial_data):
+    response = await client.get("/api/resample", params={"symbol": "IBM", "interval": "week"})
+
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert body["data"] == [
+        {
+            "symbol": "IBM",
+            "period": "2023-01-02",
+            "start_date": "2023-01-02",
+            "end_date": "2023-01-08",
+            "open_price": 100.1,
+            "close_price": 107.2,
+            "volume": sum(range(1000, 1007)),
+            "days": 7,
+        }
+    ]
+    assert body["pagination"] == {"count": 1, "page": 1, "limit": 5, "pages": 1, "next_cursor": None}
+
+
+async def test_conditional_get(client: AsyncClient, db: AsyncSession, financial_data, monkeypatch):
+    await FinancialData.notify_changed(db, ["IBM"])
+    # Last-Modified is sent once the second of the change has passed
+    await db.execute(
+        sa.update(FinancialDataVersion).values(
+            modified_at=FinancialDataVersion.modified_at - datetime.timedelta(seconds=1)
+        )
+    )
+    params = {"symbol": "IBM", "limit": 3}
+    response = await client.get("/api/financial_data", params=params)
+
+    assert response.status_code == status.HTTP_200_OK
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+
+    async def paginate(*args, **kwargs):
+        raise AssertionError("unchanged data is queried")
+
+    monkeypatch.setattr(FinancialData, "paginate", paginate)
+    for headers in (
+        {"If-None-Match": etag},
+        {"If-None-Match": f'W/{etag}, "other"'},
+        {"If-Modified-Since": last_modified},
+    ):
+        response = await client.get("/api/financial_data", params=params, headers=headers)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+    monkeypatch.undo()
+
+    # Other parameters or a new version of the data change the ETag
+    response = await client.get("/api/financial_data", params={**params, "page": 2}, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    await FinancialData.notify_changed(db, ["IBM"])
+    response = await client.get("/api/financial_data", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    version, _ = await FinancialDataVersion.get(db, "IBM")
+    assert version == 2
+
+
+async def test_conditional_get_statistics(client: AsyncClient, financial_data):
+    params = {"symbol": "IBM", "start_date": "2023-01-02", "end_date": "2023-01-08"}
+    response = await client.get("/api/statistics", params=params)
+    assert response.status_code == status.HTTP_200_OK
+
+    response = await client.get("/api/statistics", params=params, headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+def pause_first_call(monkeypatch, cls, name: str):
+    """The first call of the method fetches its result and waits until released, so data can change meanwhile"""
+    fetched, released = asyncio.Event(), asyncio.Event()
+    original = getattr(cls, name)
+
+    async def paused(*args, **kwargs):
+        result = await original(*args, **kwargs)
+        if not fetched.is_set():
+            fetched.set()
+            await released.wait()
+        return result
+
+    monkeypatch.setattr(cls, name, paused)
+    return fetched, released
+
+
+async def test_financial_data_not_shared_after_change(
+    client: AsyncClient, db: AsyncSession, financial_data, monkeypatch
+):
+    fetched, released = pause_first_call(monkeypatch, FinancialData, "_paginate")
+    params = {"symbol": "IBM", "limit": 3}
+    first = asyncio.create_task(client.get("/api/financial_data", params=params))
+    await fetched.wait()
+
+    await db.execute(sa.update(FinancialData).where(FinancialData.symbol == "IBM").values(volume=0))
+    await FinancialData.notify_changed(db, ["IBM"])
+    # A shared call would wait for the first one
+    second = await asyncio.wait_for(client.get("/api/financial_data", params=params), 5)
+    released.set()
+    first_response = await first
+
+    assert [row["volume"] for row in first_response.json()["data"]] == [1000, 1001, 1002]
+    assert [row["volume"] for row in second.json()["data"]] == [0, 0, 0]
+    assert first_response.headers["ETag"] != second.headers["ETag"]
+
+
+async def test_statistics_not_shared_after_change(client: AsyncClient, db: AsyncSession, financial_data, monkeypatch):
+    fetched, released = pause_first_call(monkeypatch, FinancialDataCumulative, "_range_stats_batch")
+    params = {"symbol": "IBM", "start_date": "2023-01-02", "end_date": "2023-01-04"}
+    first = asyncio.create_task(client.get("/api/statistics", params=params))
+    await fetched.wait()
+
+    await db.execute(sa.update(FinancialData).where(FinancialData.symbol == "IBM").values(volume=0))
+    await FinancialDataCumulative.refresh(db, "IBM", datetime.date(2023, 1, 2))
+    await FinancialData.notify_changed(db, ["IBM"])
+    # The notification reaches the cache listener
+    stats_cache.invalidate("IBM")
+    second = await asyncio.wait_for(client.get("/api/statistics", params=params), 5)
+    released.set()
+    first_response = await first
+    # The result read before the change is not cached as current
+    third = await client.get("/api/statistics", params=params)
+
+    assert first_response.json()["data"]["average_daily_volume"] == 1001.0
+    assert second.json()["data"]["average_daily_volume"] == 0.0
+    assert third.json()["data"]["average_daily_volume"] == 0.0
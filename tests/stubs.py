@@ -0,0 +1,26 @@
+import asyncio
+
+from fastapi import FastAPI, Request, Response
+
+
+class AlphaVantageStub:
+    """Local HTTP server standing in for alphavantage. Responds with queued responses and records requests."""
+
+    def __init__(self) -> None:
+        self.responses: list = []
+        self.default_response = Response()
+        self.requests: list = []
+        self.active = 0
+        self.max_active = 0
+        self.delay = 0.0
+        self.url = ""
+        self.app = FastAPI()
+        self.app.get("/query")(self.query)
+
+    async def query(self, request: Request) -> Response:
+        self.requests.append(dict(request.query_params))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+        return self.responses.pop(0) if self.responses else self.default_response
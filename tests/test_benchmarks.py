@@ -0,0 +1,33 @@
+import datetime
+
+import pytest
+import sqlalchemy as sa
+from benchmarks import generator
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from financial.apps.financial.models import FinancialData, FinancialDataCumulative
+
+
+def test_generated_bars_are_deterministic():
+    days = list(generator.trading_days(datetime.date(2022, 1, 1), datetime.date(2022, 1, 31)))
+
+    assert len(days) == 21
+    assert all(day.weekday() < 5 for day in days)
+    assert list(generator.generate_bars("ZZ000", days)) == list(generator.generate_bars("ZZ000", days))
+    assert list(generator.generate_bars("ZZ000", days)) != list(generator.generate_bars("ZZ001", days))
+
+
+@pytest.mark.asyncio
+async def test_fill(db: AsyncSession):
+    symbols = generator.make_symbols("ZZ", 2)
+    start, end = datetime.date(2021, 12, 1), datetime.date(2022, 1, 31)
+
+    rows = await generator.fill(db, symbols, start, end)
+    # Filling again replaces the data
+    assert await generator.fill(db, symbols, start, end) == rows
+
+    count = await db.scalar(sa.select(sa.func.count()).where(FinancialData.symbol.in_(symbols)))
+    assert count == rows == 2 * 44
+    stats = await FinancialDataCumulative.range_stats(db, "ZZ001", start, end)
+    expected = await FinancialData.count_stats(db, {"symbol": "ZZ001", "date__ge": start, "date__le": end})
+    assert stats == dict(expected)
@@ -0,0 +1,136 @@
+import asyncio
+import contextlib
+
+import pytest
+import sqlalchemy as sa
+
+from financial.cache import listen_invalidations, LRUCache, SingleFlight, stats_cache, SymbolCache
+from financial.config import settings
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(maxsize=2, ttl=-1)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_symbol_cache_invalidation():
+    cache = SymbolCache(maxsize=10, ttl=60)
+    cache.set("IBM", "key", "ibm", cache.version("IBM"))
+    cache.set("AAPL", "key", "aapl", cache.version("AAPL"))
+
+    cache.invalidate("IBM")
+
+    assert cache.get("IBM", "key") is None
+    assert cache.get("AAPL", "key") == "aapl"
+    assert cache.info() == {"hits": 1, "misses": 1, "size": 2, "maxsize": 10}
+
+
+def test_symbol_cache_skips_results_read_before_invalidation():
+    cache = SymbolCache(maxsize=10, ttl=60)
+    version = cache.version("IBM")
+
+    cache.invalidate("IBM")
+    cache.set("IBM", "key", "stale", version)
+
+    assert cache.get("IBM", "key") is None
+
+
+@pytest.mark.asyncio
+async def test_listener_invalidates_notified_symbols(db_engine):
+    listener = asyncio.create_task(listen_invalidations())
+    try:
+        await asyncio.sleep(0.2)
+        stats_cache.set("NTF", "key", "value", stats_cache.version("NTF"))
+
+        async with db_engine.connect() as connection:
+            await connection.execute(sa.select(sa.func.pg_notify(settings.DB_NOTIFY_CHANNEL, "NTF")))
+            await connection.commit()
+        await asyncio.sleep(0.2)
+
+        assert stats_cache.get("NTF", "key") is None
+    finally:
+        listener.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await listener
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def query(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return [value]
+
+    results = await asyncio.gather(
+        *[flight.do("a", lambda: query(1)) for _ in range(5)], flight.do("b", lambda: query(2))
+    )
+
+    assert results == [[1]] * 5 + [[2]]
+    assert calls == [1, 2]
+    assert flight.info() == {"executed": 2, "shared": 4, "shared_ratio": 4 / 6, "in_flight": 0}
+    # Completed calls are not kept
+    assert await flight.do("a", lambda: query(3)) == [3]
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_exception():
+    flight = SingleFlight("test")
+
+    async def query():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    results = await asyncio.gather(flight.do("a", query), flight.do("a", query), return_exceptions=True)
+
+    assert [str(result) for result in results] == ["failed", "failed"]
+    assert flight.executed == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_executes_again_if_cancelled():
+    flight = SingleFlight("test")
+
+    async def query(value):
+        await asyncio.sleep(0.05)
+        return value
+
+    first = asyncio.create_task(flight.do("a", lambda: query(1)))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(flight.do("a", lambda: query(2)))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == 2
+    assert flight.executed == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "COALESCING_ENABLED", False)
+    flight = SingleFlight("test")
+
+    async def query():
+        await asyncio.sleep(0.01)
+        return 1
+
+    assert await asyncio.gather(flight.do("a", query), flight.do("a", query)) == [1, 1]
+    assert flight.executed == 0
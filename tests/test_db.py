@@ -0,0 +1,144 @@
+import asyncio
+import os
+import threading
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from financial import db
+from financial.config import settings
+from financial.db import async_session, Database, get_engine, ReplicaMonitor
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def check(monitor: ReplicaMonitor) -> bool:
+    """Starts a check and waits for its result"""
+    monitor.is_available()
+    assert monitor.check_task is not None
+    await monitor.check_task
+    return monitor.is_available()
+
+
+async def test_replica_monitor_available():
+    # The primary is a replica without lag
+    monitor = ReplicaMonitor(get_engine(), max_lag=1, check_interval=60, check_timeout=5)
+
+    assert await check(monitor)
+    assert monitor.lag == 0
+
+
+async def test_replica_monitor_lagging():
+    monitor = ReplicaMonitor(get_engine(), max_lag=-1, check_interval=60, check_timeout=5)
+
+    assert not await check(monitor)
+
+
+async def test_replica_monitor_down():
+    down_engine = create_async_engine(settings.DB_DSN.set(port=1), future=True)
+    monitor = ReplicaMonitor(down_engine, max_lag=1, check_interval=60, check_timeout=5)
+
+    assert not await check(monitor)
+    assert monitor.lag is None
+    await down_engine.dispose()
+
+
+async def test_replica_monitor_check_interval():
+    monitor = ReplicaMonitor(get_engine(), max_lag=1, check_interval=60, check_timeout=5)
+    await check(monitor)
+
+    monitor.max_lag = -1
+    # The last check result is used until the interval passes
+    assert await check(monitor)
+
+    monitor.checked_at -= 60
+    assert not await check(monitor)
+
+
+async def test_replica_monitor_check_in_background(monkeypatch):
+    monitor = ReplicaMonitor(get_engine(), max_lag=1, check_interval=60, check_timeout=5)
+    checked = asyncio.Event()
+
+    async def get_lag() -> float:
+        await checked.wait()
+        return 0.0
+
+    monkeypatch.setattr(monitor, "get_lag", get_lag)
+    # Requests get the last result while the check is running and don't start another one
+    assert not monitor.is_available()
+    check_task = monitor.check_task
+    assert not monitor.is_available()
+    assert monitor.check_task is check_task
+
+    checked.set()
+    await asyncio.wait_for(check_task, 5)
+    assert monitor.is_available()
+
+
+async def test_database_warm_up():
+    database = Database()
+    assert database.engine.pool.checkedin() == 0
+
+    await database.warm_up()
+
+    # Connections are open and returned to the pool
+    assert database.engine.pool.checkedin() == settings.DB_POOL_SIZE
+    assert database.engine.pool.checkedout() == 0
+    await database.dispose()
+
+
+async def test_database_warm_up_failed():
+    database = Database()
+    database.engine = create_async_engine(settings.DB_DSN.set(port=1), pool_size=2, future=True)
+
+    with pytest.raises(OSError):
+        await database.warm_up()
+    assert database.engine.pool.checkedout() == 0
+    await database.dispose()
+
+
+async def test_start_pools_warm_up(monkeypatch):
+    monkeypatch.setattr(settings, "DB_WARM_UP", True)
+    monkeypatch.setattr(db, "warm_up_task", None)
+
+    await db.start_pools_warm_up()
+
+    assert db.is_warming_up()
+    await db.warm_up_task
+    assert not db.is_warming_up()
+    assert get_engine().pool.checkedin() >= settings.DB_POOL_SIZE
+
+
+async def test_database_after_fork():
+    # The parent holds pooled connections at fork
+    async with async_session() as session:
+        await session.scalar(sa.text("SELECT 1"))
+    parent_engine = get_engine()
+
+    pid = os.fork()
+    if pid == 0:
+        status = []
+
+        def child() -> None:
+            async def query() -> None:
+                async with async_session() as session:
+                    assert get_engine() is not parent_engine
+                    status.append(await session.scalar(sa.text("SELECT 1")))
+                await db.dispose_engines()
+
+            asyncio.run(query())
+
+        # The event loop of the parent is still running in this thread of the child
+        thread = threading.Thread(target=child)
+        thread.start()
+        thread.join()
+        os._exit(0 if status == [1] else 1)
+
+    _, wait_status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(wait_status) == 0
+    # Connections of the parent are not closed by the child
+    async with async_session() as session:
+        assert await session.scalar(sa.text("SELECT 1")) == 1
+    assert get_engine() is parent_engine
@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+import gzip
+from decimal import Decimal
+
+import import_csv
+import pytest
+import sqlalchemy as sa
+from import_csv import import_file, import_files, map_columns, Progress, symbol_from_path
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from financial.apps.financial.models import FinancialData, FinancialDataCumulative
+from financial.config import settings
+
+
+async def run_import(db: AsyncSession, path: str, symbol=None):
+    return await import_file(db, str(path), symbol, Progress(0, float("inf")), 16, asyncio.Lock())
+
+
+async def get_rows(db: AsyncSession, symbol: str):
+    query = sa.select(FinancialData.date, FinancialData.close_price, FinancialData.volume).order_by(FinancialData.date)
+    return (await db.execute(query.where(FinancialData.symbol == symbol))).all()
+
+
+def test_map_columns():
+    assert map_columns(["timestamp", "open", "high", "low", "close", "volume"]) == {
+        "symbol": None,
+        "date": 0,
+        "open_price": 1,
+        "close_price": 4,
+        "volume": 5,
+    }
+    with pytest.raises(ValueError, match="volume"):
+        map_columns(["symbol", "date", "open", "close"])
+
+
+def test_symbol_from_path():
+    assert symbol_from_path("/data/ibm.csv.gz") == "IBM"
+    assert symbol_from_path("aapl.CSV") == "AAPL"
+
+
+@pytest.mark.asyncio
+async def test_import_file(db: AsyncSession, tmp_path):
+    path = tmp_path / "dump.csv"
+    path.write_text(
+        "Ticker,Date,Open,Close,Volume\n"
+        "zzcs1,2022-01-03,10.5,11.25,100\n"
+        "ZZCS1,2022-01-04,11,12,200\n"
+        "ZZCS2,2022-01-03,1,2,300\n"
+        # The last row of a day wins
+        "ZZCS1,2022-01-04,11,13,250\n"
+    )
+
+    assert await run_import(db, path) == (4, 3)
+    assert await get_rows(db, "ZZCS1") == [
+        (datetime.date(2022, 1, 3), Decimal("11.25"), 100),
+        (datetime.date(2022, 1, 4), Decimal("13"), 250),
+    ]
+    stats = await FinancialDataCumulative.range_stats(
+        db, "ZZCS1", datetime.date(2022, 1, 1), datetime.date(2022, 1, 31)
+    )
+    assert stats["average_daily_volume"] == 175
+
+    # Unchanged rows are not written again
+    assert await run_import(db, path) == (4, 0)
+
+
+@pytest.mark.asyncio
+async def test_import_gzip_file_without_symbol(db: AsyncSession, tmp_path):
+    path = tmp_path / "zzcs3.csv.gz"
+    with gzip.open(path, "wt") as file:
+        file.write("timestamp,open,high,low,close,volume\n2022-01-05,1,3,1,2,10\n2022-01-06,2,4,2,3,20\n")
+
+    assert await run_import(db, path) == (2, 2)
+    assert [row.date for row in await get_rows(db, "ZZCS3")] == [datetime.date(2022, 1, 5), datetime.date(2022, 1, 6)]
+
+    assert await run_import(db, path, symbol="ZZCS4") == (2, 2)
+    assert len(await get_rows(db, "ZZCS4")) == 2
+
+
+@pytest.mark.asyncio
+async def test_import_files_leave_connection_for_partitions(monkeypatch, tmp_path):
+    async def hold_session_import_file(session, path, symbol, progress, chunk_size, partitions_lock):
+        # Every job holds its connection while partitions are created
+        await session.execute(sa.text("SELECT 1"))
+        await asyncio.sleep(0.05)
+        await import_csv.ensure_partitions(partitions_lock, 2022, 2022)
+        return 1, 0
+
+    monkeypatch.setattr(import_csv, "import_file", hold_session_import_file)
+    paths = []
+    for i in range(settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW):
+        path = tmp_path / f"zzcs{i}.csv"
+        path.write_text("date,open,close,volume\n")
+        paths.append(str(path))
+
+    assert await asyncio.wait_for(import_files(paths, None, len(paths), 16), 5) == (0, 0)
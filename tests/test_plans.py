@@ -0,0 +1,94 @@
+import datetime
+import decimal
+import itertools
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from financial.apps.financial.models import FinancialData
+from financial.apps.financial.schemas import FinancialDataFilters
+from financial.config import settings
+from financial.db import UnindexedFiltersError
+from financial.plans import check_plan
+
+
+pytestmark = pytest.mark.asyncio
+
+# Every combination of the API filters, at least one of them is required
+API_FILTERS = [
+    FinancialDataFilters(**dict(fields)).make_filters()
+    for size in range(1, 4)
+    for fields in itertools.combinations(
+        [("symbol", "IBM"), ("start_date", datetime.date(2022, 1, 3)), ("end_date", datetime.date(2022, 3, 1))], size
+    )
+]
+OPERATOR_FILTERS = [
+    {"symbol": "IBM"},
+    {"symbol__in": ["IBM", "AAPL"]},
+    {"symbol__between": ("A", "B")},
+    {"symbol__ne": "IBM"},
+    {"symbol__notin": ["IBM"]},
+    {"symbol__ilike": "ib%"},
+    {"symbol__istartswith": "IB"},
+    {"symbol__endswith": "M"},
+    {"symbol__iendswith": "m"},
+    {"symbol__isnull": False},
+    {"date": datetime.date(2022, 1, 3)},
+    {"date__in": [datetime.date(2022, 1, 3)]},
+    {"date__between": (datetime.date(2022, 1, 3), datetime.date(2022, 3, 1))},
+    {"date__ge": datetime.date(2022, 1, 3)},
+    {"date__lt": datetime.date(2022, 1, 3)},
+    {"date__ne": datetime.date(2022, 1, 3)},
+    {"volume__gt": 1000},
+    {"open_price__le": decimal.Decimal("10.5")},
+    {"symbol__ilike": "ib%", "date__ge": datetime.date(2022, 1, 3)},
+    {"symbol__endswith": "M", "volume__gt": 1000},
+]
+
+
+@pytest.fixture
+async def plan_db(db: AsyncSession):
+    # Test tables are small and sequential scans are cheaper than any index, without them the planner
+    # falls back to a sequential scan only when no index can serve the conditions
+    await db.execute(sa.text("SET LOCAL enable_seqscan = off"))
+    return db
+
+
+def make_query(filters: dict) -> sa.sql.Select:
+    return FinancialData._get_query(as_rows=True).where(sa.and_(True, *FinancialData.build_filters(filters)))
+
+
+@pytest.mark.parametrize("filters", API_FILTERS, ids=lambda filters: ",".join(filters))
+async def test_api_filters_use_indexes(plan_db: AsyncSession, filters: dict):
+    assert FinancialData.is_indexed(filters)
+    assert await check_plan(plan_db, make_query(filters).order_by(FinancialData.date), min_rows=0) == []
+    assert await check_plan(plan_db, make_query(filters).order_by(*FinancialData._primary_key()), min_rows=0) == []
+
+
+@pytest.mark.parametrize("filters", OPERATOR_FILTERS, ids=lambda filters: ",".join(filters))
+async def test_indexed_filters_match_plans(plan_db: AsyncSession, filters: dict):
+    problems = await check_plan(plan_db, make_query(filters), min_rows=0)
+
+    assert FinancialData.is_indexed(filters) == (not problems), problems
+
+
+async def test_check_plan_min_rows(plan_db: AsyncSession):
+    query = make_query({"symbol__ilike": "ib%"})
+    # Relations without statistics are counted as large
+    await plan_db.execute(sa.text("ANALYZE financial_data"))
+
+    assert await check_plan(plan_db, query, min_rows=0)
+    assert await check_plan(plan_db, query, min_rows=10**12) == []
+
+
+async def test_query_guard(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "QUERY_GUARD_ENABLED", True)
+
+    with pytest.raises(UnindexedFiltersError, match="symbol__ilike"):
+        FinancialData.build_filters({"symbol__ilike": "ib%"})
+    assert len(FinancialData.build_filters({"symbol__ilike": "ib%", "date__ge": datetime.date(2022, 1, 3)})) == 2
+
+
+async def test_query_guard_disabled():
+    assert len(FinancialData.build_filters({"symbol__ilike": "ib%"})) == 1
@@ -0,0 +1,85 @@
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from financial import profiling
+from financial.config import settings
+from financial.db import get_engine
+from financial.deps import get_db, get_read_db
+from financial.main import get_app
+from financial.responses import ColumnarResponse, FastJSONResponse
+
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def profiling_client(db: AsyncSession, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", True)
+    # Renders are instrumented by get_app, monkeypatch restores them after the test
+    for response_class in (FastJSONResponse, ColumnarResponse):
+        monkeypatch.setattr(response_class, "render", response_class.render)
+    application = get_app(app_name="test")
+    application.dependency_overrides[get_db] = lambda: db
+    application.dependency_overrides[get_read_db] = lambda: db
+
+    async with AsyncClient(app=application, base_url="http://test") as client:
+        yield client
+
+    for name in ("before_execute", "before_cursor_execute", "after_cursor_execute"):
+        event.remove(get_engine().sync_engine, name, getattr(profiling, name))
+
+
+async def test_profiled_request(profiling_client: AsyncClient):
+    response = await profiling_client.get("/api/financial_data", headers={settings.PROFILING_HEADER: "1"})
+
+    assert response.status_code == status.HTTP_200_OK
+    timing = response.headers["Server-Timing"]
+    for phase in ("sql-compile", "sql-execute", "endpoint", "serialize", "total"):
+        assert f"{phase};dur=" in timing
+
+    report = (await profiling_client.get(f"/profilez/{response.headers['X-Profile-Id']}")).json()
+    assert report["path"] == "/api/financial_data"
+    assert report["status"] == status.HTTP_200_OK
+    # The data version lookup, then paginate runs count and page queries
+    assert report["counts"]["sql_execute"] == 3
+    assert report["timings_ms"]["sql_execute"] <= report["total_ms"]
+    # Rendering inside the endpoint is not counted twice
+    assert report["timings_ms"]["endpoint"] + report["timings_ms"]["serialize"] <= report["total_ms"]
+    assert "stacks" not in report
+
+
+async def test_profiled_request_with_stacks(profiling_client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_INTERVAL", 0.0001)
+    headers = {settings.PROFILING_HEADER: profiling.SAMPLE_STACKS}
+    response = await profiling_client.get(
+        "/api/statistics?symbol=IBM&start_date=2023-01-01&end_date=2023-02-01", headers=headers
+    )
+
+    report = (await profiling_client.get(f"/profilez/{response.headers['X-Profile-Id']}")).json()
+    assert report["sample_interval_ms"] == pytest.approx(0.1)
+    assert report["stacks"]
+    assert all(stack["samples"] > 0 for stack in report["stacks"])
+
+
+async def test_not_profiled_request(profiling_client: AsyncClient, client: AsyncClient):
+    response = await profiling_client.get("/api/financial_data")
+    assert "Server-Timing" not in response.headers
+
+    # Profiling is not installed into the app while it's disabled
+    response = await client.get("/api/financial_data", headers={settings.PROFILING_HEADER: "1"})
+    assert "Server-Timing" not in response.headers
+
+
+async def test_responses_not_instrumented(client: AsyncClient):
+    # Rendering is timed only in apps with profiling
+    assert not hasattr(FastJSONResponse.render, "__wrapped__")
+    assert not hasattr(ColumnarResponse.render, "__wrapped__")
+
+
+async def test_profile_report_not_found(client: AsyncClient):
+    response = await client.get("/profilez/unknown")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,54 @@
+import datetime
+import decimal
+import random
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from financial.apps.financial.schemas import FinancialDataResponse
+from financial.responses import FastJSONResponse, Validators
+from financial.utils import utcnow
+
+
+def make_content(prices: list) -> dict:
+    start = datetime.date(2023, 1, 2)
+    data = [
+        {
+            "symbol": "IBM",
+            "date": start + datetime.timedelta(days=i),
+            "open_price": price,
+            "close_price": price,
+            "volume": i,
+        }
+        for i, price in enumerate(prices)
+    ]
+    return {
+        "data": data,
+        "pagination": {"count": 1, "page": 1, "limit": 5, "pages": 1, "next_cursor": None},
+        "info": {"error": ""},
+    }
+
+
+@pytest.mark.parametrize(
+    "prices",
+    [
+        [decimal.Decimal(random.Random(i).randint(0, 10**12)).scaleb(-4) for i in range(1000)],
+        [decimal.Decimal("100.1000"), decimal.Decimal("100"), decimal.Decimal("0.0000"), decimal.Decimal("1E+3")],
+        # orjson formats these floats differently, they are rendered by the json module
+        [decimal.Decimal("0.00001"), decimal.Decimal("12345678901234567.5")],
+    ],
+)
+def test_fast_json_response_is_same_as_json_response(prices: list):
+    content = make_content(prices)
+    expected = JSONResponse(jsonable_encoder(FinancialDataResponse(**content))).body
+
+    assert FastJSONResponse(content).body == expected
+
+
+def test_last_modified_after_its_second():
+    # Another change may follow in the same second and would have the same Last-Modified
+    assert "Last-Modified" not in Validators(1, utcnow(), {}).headers()
+
+    modified_at = utcnow() - datetime.timedelta(seconds=1)
+    assert Validators(1, modified_at, {}).last_modified == modified_at.replace(microsecond=0)
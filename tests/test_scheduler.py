@@ -0,0 +1,97 @@
+import asyncio
+
+import asyncpg
+import pytest
+
+from financial.apps.financial import ingestion
+from financial.config import settings
+from financial.scheduler import IngestionScheduler, ScheduledIngestion
+
+
+pytestmark = pytest.mark.asyncio
+
+LOCK_ID = 727100419
+
+
+def make_scheduler(runs: list, name: str) -> IngestionScheduler:
+    async def ingest() -> None:
+        runs.append(name)
+
+    return IngestionScheduler(ingest, LOCK_ID, interval=0.05, retry=0.05, check_interval=0.05, check_timeout=5)
+
+
+async def test_only_leader_runs_ingestion():
+    runs: list = []
+    first, second = make_scheduler(runs, "first"), make_scheduler(runs, "second")
+    first_task = asyncio.create_task(first.run())
+    await asyncio.sleep(0.2)
+    second_task = asyncio.create_task(second.run())
+    await asyncio.sleep(0.3)
+
+    assert first.is_leader and not second.is_leader
+    assert set(runs) == {"first"} and first.runs == len(runs) > 1
+    assert first.last_started_at is not None and first.last_duration is not None
+    assert second.info()["last_started_at"] is None
+
+    # The lock is released with the leader's connection and the other process takes over
+    first_task.cancel()
+    await asyncio.sleep(0.3)
+    assert second.is_leader and second.runs > 0
+
+    second_task.cancel()
+
+
+async def test_run_is_cancelled_when_lock_is_lost():
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def ingest() -> None:
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    # The check interval is long, the termination listener notices the closed connection
+    scheduler = IngestionScheduler(ingest, LOCK_ID, interval=60, retry=60, check_interval=60, check_timeout=5)
+    task = asyncio.create_task(scheduler.run())
+    await asyncio.wait_for(started.wait(), 5)
+
+    connection = await asyncpg.connect(**settings.DB_CONNECT_PARAMS)
+    try:
+        await connection.execute(
+            "SELECT pg_terminate_backend(pid) FROM pg_locks WHERE locktype = 'advisory' AND objid = $1", LOCK_ID
+        )
+    finally:
+        await connection.close()
+
+    await asyncio.wait_for(cancelled.wait(), 5)
+    await asyncio.sleep(0.1)
+    assert not scheduler.is_leader
+
+    task.cancel()
+
+
+async def test_failed_run_is_reported():
+    async def ingest() -> None:
+        raise RuntimeError("alphavantage is down")
+
+    scheduler = IngestionScheduler(ingest, LOCK_ID, interval=60, retry=60, check_interval=60, check_timeout=5)
+    await scheduler.run_once()
+
+    assert scheduler.info()["last_error"] == "alphavantage is down"
+    assert scheduler.last_duration is not None
+
+
+async def test_scheduled_runs_share_rate_limiter(monkeypatch):
+    limiters = []
+
+    async def fill_financial_data(limiter):
+        limiters.append(limiter)
+
+    monkeypatch.setattr(ingestion, "fill_financial_data", fill_financial_data)
+    ingest = ScheduledIngestion()
+    await ingest()
+    await ingest()
+
+    assert limiters[0] is not None and limiters[0] is limiters[1]